@@ -5,52 +5,109 @@
 # @LastEditTime: 2023-09-14 17:28:05
 # @Description:
 
+import sys
 from contextlib import asynccontextmanager
 from typing import AsyncGenerator
 
 from fastapi import FastAPI
 from starlette.middleware.cors import CORSMiddleware
 
+from src.apps.monitor import router as monitor
+from src.config import load_settings
 from src.config.common import setting
+from src.config.compression import setting as compression_setting
+from src.config.monitor import setting as monitor_setting
 from src.ext.exceptions import init_exception_handler
-from src.ext.interface_cache import init_cache
-from src.ext.logging import init_log
-from src.ext.redis import get_client as get_redis_client
-from src.openapi import openapi
-from src.tasks.scheduler import scheduler
-
-init_log()
+from src.ext.interface_cache import close_cache, init_cache
+from src.ext.logging import flush_log, init_log
+from src.ext.metrics import close_metrics, init_metrics
+from src.ext.rate_limiter import close_rate_limiter
+from src.ext.redis import close_client as close_redis_client
+from src.ext.redis import init_client as init_redis_client
+from src.ext.response import EnvelopeResponse
+from src.middlewares.compression import CompressionMiddleware
+from src.middlewares.identity import IdentityMiddleware
+from src.middlewares.logging import LoguruLoggerWithRequestIDMiddleware
+from src.middlewares.metrics import MetricsMiddleware
+from src.tasks.scheduler import close_scheduler, init_scheduler
 
 
 @asynccontextmanager
-async def lifespan(_application: FastAPI) -> AsyncGenerator:
-    """生命周期管理"""
+async def lifespan(application: FastAPI) -> AsyncGenerator:
+    """生命周期管理，每个worker进程各自执行，状态由/health/ready返回"""
     # Startup
-    redis_client = await get_redis_client()
+    application.state.lifecycle = "starting"
+    load_settings()  # 一次加载并校验所有配置，配置错误时在创建任何连接之前失败
+    await init_redis_client()  # 初始化进程内共享的redis连接池
 
-    scheduler.start()
+    init_scheduler()
     await init_cache()
+    await init_metrics()
+    application.state.lifecycle = "ready"
 
     yield
     # Shutdown
-    scheduler.shutdown()
-    await redis_client.close()
-
-
-
-app = FastAPI(docs_url=None, redoc_url=None, lifespan=lifespan)
-
-app.include_router(openapi.router)  # 注册openapi路由
-
-app.add_middleware(  # 注册跨域中间件
-    CORSMiddleware,
-    allow_origins=setting.CORS_ORIGINS,
-    allow_credentials=setting.CROS_CREDENTIALS,
-    allow_methods=setting.CORS_METHODS,
-    allow_headers=setting.CORS_HEADERS,
-)
-init_log()  # 初始化日志
-init_exception_handler(app) # 初始化异常处理
+    application.state.lifecycle = "stopping"
+    close_scheduler()
+    await close_metrics()
+    await close_cache()
+    await close_rate_limiter()
+    await close_redis_client()
+    # 没有使用数据库时不为了关闭连接池而导入sqlalchemy
+    if "src.ext.database" in sys.modules:
+        await sys.modules["src.ext.database"].dispose_engines()
+    flush_log()
+
+
+
+def create_app() -> FastAPI:
+    """
+    创建应用：先一次加载并校验所有配置(配置错误时抛出SettingsError)，再初始化日志、注册路由和中间件
+    """
+    load_settings()
+    init_log()  # 初始化日志
+    from src.openapi import openapi  # 该模块导入时按OPEN_DOC注册文档路由
+
+    application = FastAPI(
+        docs_url=None,
+        redoc_url=None,
+        openapi_url=None,  # 文档由openapi路由提供，见src/openapi/openapi.py
+        lifespan=lifespan,
+        default_response_class=EnvelopeResponse,  # 统一包装为{code, message, data}
+    )
+
+    application.include_router(openapi.router)  # 注册openapi路由
+    application.include_router(monitor.health_router)  # 注册健康检查路由
+    application.include_router(monitor.router)  # 注册监控路由
+    if monitor_setting.METRICS_ENABLED:
+        application.include_router(monitor.metrics_router)  # 注册Prometheus指标路由
+
+    application.add_middleware(  # 注册跨域中间件
+        CORSMiddleware,
+        allow_origins=setting.CORS_ORIGINS,
+        allow_credentials=setting.CROS_CREDENTIALS,
+        allow_methods=setting.CORS_METHODS,
+        allow_headers=setting.CORS_HEADERS,
+    )
+    if compression_setting.COMPRESSION_ENABLED:
+        application.add_middleware(CompressionMiddleware)  # 注册响应压缩中间件
+    # 注册身份信息中间件，每个请求只解析一次请求头
+    application.add_middleware(IdentityMiddleware)
+    if monitor_setting.METRICS_ENABLED:
+        application.add_middleware(MetricsMiddleware)  # 注册请求指标中间件
+    # 注册日志中间件，最外层
+    application.add_middleware(LoguruLoggerWithRequestIDMiddleware)
+    init_exception_handler(application)  # 初始化异常处理
+    return application
+
+
+def __getattr__(name: str):
+    """`main:app`在首次访问时才创建(PEP 562)，只导入main不读取任何配置"""
+    if name == "app":
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 if __name__ == "__main__":
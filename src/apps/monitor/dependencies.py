@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# @Author: martinf fangjie.martin@gmail.com
+# @Date: 2026-10-18 23:30:48
+# @LastEditors: martinf fangjie.martin@gmail.com
+# @LastEditTime: 2026-10-18 23:30:48
+# @Description: 监控接口依赖
+import secrets
+from typing import Optional
+
+from fastapi import Header
+
+from src.config.common import EnvEnum, setting as common_setting
+from src.config.monitor import setting
+from src.ext.exceptions import PermissionDenied
+
+
+async def verify_monitor_token(
+    x_monitor_token: Optional[str] = Header(None),
+    authorization: Optional[str] = Header(None),
+) -> None:
+    """
+    配置了MONITOR_TOKEN时校验X-Monitor-Token请求头，
+    Prometheus抓取时可以使用Authorization: Bearer。
+    生产环境必须配置MONITOR_TOKEN，未配置时拒绝所有请求，避免监控接口对外公开
+    """
+    if setting.MONITOR_TOKEN is None:
+        if common_setting.ENV is EnvEnum.PROD:
+            raise PermissionDenied()
+        return
+    token = x_monitor_token
+    if not token and authorization and authorization[:7].lower() == "bearer ":
+        token = authorization[7:].strip()
+    if not token or not secrets.compare_digest(token, setting.MONITOR_TOKEN):
+        raise PermissionDenied()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# @Author: martinf fangjie.martin@gmail.com
+# @Date: 2026-10-18 23:30:48
+# @LastEditors: martinf fangjie.martin@gmail.com
+# @LastEditTime: 2026-10-18 23:30:48
+# @Description: 监控接口：健康检查、Prometheus指标、函数耗时、日志缓冲区状态
+import asyncio
+import os
+
+from fastapi import APIRouter, Depends, Request, status
+from fastapi.responses import Response
+from starlette.concurrency import run_in_threadpool
+
+from src.apps.monitor.dependencies import verify_monitor_token
+from src.ext.decorator import profile_stats, reset_profile_stats
+from src.ext.logging import log_stats
+from src.ext.metrics import collect_all, render
+from src.ext.redis import shared_client
+from src.ext.response import APIResponse
+
+router = APIRouter(
+    prefix="/monitor",
+    tags=["monitor"],
+    dependencies=[Depends(verify_monitor_token)],
+    include_in_schema=False,
+)
+
+# Prometheus默认抓取/metrics，不加前缀
+metrics_router = APIRouter(
+    dependencies=[Depends(verify_monitor_token)], include_in_schema=False
+)
+
+# 供负载均衡和容器编排探测，不校验令牌
+health_router = APIRouter(prefix="/health", tags=["health"], include_in_schema=False)
+
+# 就绪检查中redis ping的超时时间，单位秒
+READY_PING_TIMEOUT = 1.0
+
+
+@router.get("/profile")
+async def get_profile():
+    """profile装饰器记录的函数耗时统计(毫秒)，直方图只在进程内，多进程部署时为当前worker的数据"""
+    return profile_stats()
+
+
+@router.delete("/profile")
+async def clear_profile():
+    reset_profile_stats()
+
+
+@router.get("/logging")
+async def get_logging():
+    """日志缓冲区的写出、采样和丢弃计数"""
+    return log_stats()
+
+
+def _export_metrics() -> bytes:
+    return render(collect_all())
+
+
+@metrics_router.get("/metrics")
+async def metrics():
+    """Prometheus文本格式的指标，配置METRICS_MULTIPROC_DIR时汇总所有worker"""
+    # 多进程时需要读取其他worker的快照文件，放到线程池中执行
+    body = await run_in_threadpool(_export_metrics)
+    return Response(body, media_type="text/plain; version=0.0.4")
+
+
+@health_router.get("/live")
+async def live():
+    """存活检查：进程能处理请求即返回200"""
+    return {"status": "ok", "pid": os.getpid()}
+
+
+@health_router.get("/ready")
+async def ready(request: Request):
+    """
+    就绪检查：当前worker的lifespan启动完成(redis连接池、缓存、定时任务已初始化)且redis可用时返回200，
+    启动中、关闭中或redis不可用时返回503
+    """
+    state = getattr(request.app.state, "lifecycle", "starting")
+    if state != "ready":
+        return APIResponse(
+            http_status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            api_code=-1,
+            message=state,
+            data={"pid": os.getpid()},
+        )
+    try:
+        await asyncio.wait_for(shared_client().ping(), READY_PING_TIMEOUT)
+    except Exception:
+        return APIResponse(
+            http_status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            api_code=-1,
+            message="redis unavailable",
+            data={"pid": os.getpid()},
+        )
+    return {"status": state, "pid": os.getpid()}
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+# @Author: martinf fangjie.martin@gmail.com
+# @Date: 2026-10-19 01:48:30
+# @LastEditors: martinf fangjie.martin@gmail.com
+# @LastEditTime: 2026-10-19 01:48:30
+# @Description: 配置加载：各模块的配置在首次使用时才读取环境变量，
+#   load_settings一次加载全部配置
+import importlib
+from typing import Callable, Generic, TypeVar
+
+from pydantic import ValidationError
+from pydantic_settings import BaseSettings
+
+T = TypeVar("T", bound=BaseSettings)
+
+# 所有配置模块，load_settings按该顺序加载
+CONFIG_MODULES = (
+    "common",
+    "logging",
+    "server",
+    "redis",
+    "database",
+    "cache",
+    "rate_limit",
+    "scheduler",
+    "compression",
+    "monitor",
+    "openapi",
+)
+
+
+class LazySettings(Generic[T]):
+    """
+    配置代理：导入模块时不读取环境变量，首次访问属性时才通过`get_settings()`创建配置，
+    之后所有访问都转发给同一个配置对象
+    """
+
+    __slots__ = ("_factory",)
+
+    def __init__(self, factory: Callable[[], T]):
+        object.__setattr__(self, "_factory", factory)
+
+    def __getattr__(self, name: str):
+        return getattr(self._factory(), name)
+
+    def __setattr__(self, name: str, value) -> None:
+        setattr(self._factory(), name, value)
+
+    def __repr__(self) -> str:
+        return repr(self._factory())
+
+
+class SettingsError(RuntimeError):
+    """配置校验失败，包含所有配置模块的错误"""
+
+
+def load_settings() -> dict[str, BaseSettings]:
+    """
+    一次加载所有配置模块并汇总校验错误，在主进程启动worker之前和lifespan开始时调用，
+    配置缺失或错误时在初始化任何资源之前失败
+    """
+    settings, errors = {}, []
+    for name in CONFIG_MODULES:
+        module = importlib.import_module(f"{__name__}.{name}")
+        try:
+            settings[name] = module.get_settings()
+        except ValidationError as e:
+            errors.append(f"[{name}] {e}")
+    if errors:
+        raise SettingsError("Invalid settings:\n" + "\n".join(errors))
+    return settings
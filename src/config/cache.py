@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# @Author: martinf fangjie.martin@gmail.com
+# @Date: 2026-10-18 10:40:12
+# @LastEditors: martinf fangjie.martin@gmail.com
+# @LastEditTime: 2026-10-18 10:40:12
+# @Description: 接口缓存配置
+from functools import lru_cache
+
+from pydantic import Field
+from pydantic_settings import BaseSettings
+
+from src.config import LazySettings
+
+
+class Config(BaseSettings):
+    CACHE_PREFIX: str = Field("fastapi-cache", description="缓存key前缀")
+    CACHE_LOCAL_MAX_BYTES: int = Field(
+        64 * 1024 * 1024,
+        description="进程内一级缓存的内存上限，单位字节，设置为 0 时关闭一级缓存",
+    )
+    CACHE_INVALIDATE_CHANNEL: str = Field(
+        "fastapi-cache:invalidate", description="一级缓存失效通知的pub/sub频道"
+    )
+    CACHE_LOCK_TIMEOUT: float = Field(10, description="缓存重建锁的过期时间，单位秒")
+    CACHE_LOCK_WAIT: float = Field(
+        3, description="其他进程重建缓存时的最长等待时间，单位秒"
+    )
+    CACHE_KEY_MAX_QUERY: int = Field(
+        256, description="缓存key中查询参数的最大长度，超过时取摘要"
+    )
+
+
+@lru_cache
+def get_settings() -> Config:
+    return Config()
+
+
+setting: Config = LazySettings(get_settings)  # type: ignore[assignment]
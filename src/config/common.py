@@ -10,6 +10,8 @@ from functools import lru_cache
 from pydantic import Field
 from pydantic_settings import BaseSettings
 
+from src.config import LazySettings
+
 
 class EnvEnum(str, enum.Enum):
     """环境枚举"""
@@ -36,4 +38,4 @@ def get_settings() -> Config:
     return Config()
 
 
-setting: Config = get_settings()
+setting: Config = LazySettings(get_settings)  # type: ignore[assignment]
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# @Author: martinf fangjie.martin@gmail.com
+# @Date: 2026-10-18 21:40:26
+# @LastEditors: martinf fangjie.martin@gmail.com
+# @LastEditTime: 2026-10-18 21:40:26
+# @Description: 响应压缩配置
+from functools import lru_cache
+
+from pydantic import Field
+from pydantic_settings import BaseSettings
+
+from src.config import LazySettings
+
+
+class Config(BaseSettings):
+    COMPRESSION_ENABLED: bool = Field(True, description="是否开启响应压缩")
+    COMPRESSION_MINIMUM_SIZE: int = Field(
+        1024, description="响应体小于该字节数时不压缩"
+    )
+    COMPRESSION_GZIP_LEVEL: int = Field(6, ge=1, le=9, description="gzip压缩级别")
+    COMPRESSION_BROTLI_QUALITY: int = Field(
+        4, ge=0, le=11, description="brotli压缩级别"
+    )
+    COMPRESSION_ZSTD_LEVEL: int = Field(3, ge=1, le=22, description="zstd压缩级别")
+    COMPRESSION_EXCLUDED_TYPES: list[str] = Field(
+        [
+            "image/",
+            "video/",
+            "audio/",
+            "font/woff",
+            "application/zip",
+            "application/gzip",
+            "application/x-gzip",
+            "application/zstd",
+            "application/octet-stream",
+            "application/pdf",
+        ],
+        description="不压缩的Content-Type前缀，通常是已经压缩过的格式",
+    )
+
+
+@lru_cache
+def get_settings() -> Config:
+    return Config()
+
+
+setting: Config = LazySettings(get_settings)  # type: ignore[assignment]
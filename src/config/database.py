@@ -4,17 +4,39 @@
 # @LastEditors: martinf fangjie.martin@gmail.com
 # @LastEditTime: 2023-09-12 18:00:00
 # @Description: 数据库配置
+import enum
 from functools import lru_cache
 
 from pydantic import Field, PostgresDsn
 from pydantic_settings import BaseSettings
 
+from src.config import LazySettings
+
+
+class ReplicaStrategy(str, enum.Enum):
+    """从库选择策略"""
+
+    ROUND_ROBIN = "round-robin"
+    LEAST_CONNECTIONS = "least-connections"
+
 
 class Config(BaseSettings):
     PG_URL: PostgresDsn
-    PG_POOL_SIZE: int = Field(10, description="连接池的大小默认为 10 个，设置为 0 时表示连接无限制")
+    PG_POOL_SIZE: int = Field(
+        10, description="连接池的大小默认为 10 个，设置为 0 时表示连接无限制"
+    )
     PG_RECYCLE: int = Field(3600, description="设置时间以限制数据库自动断开")
     PG_ECHO: bool = Field(True, description="是否打印sql")
+    PG_REPLICA_URLS: list[PostgresDsn] = Field(
+        [], description="从库地址，为空时读写都走主库"
+    )
+    PG_REPLICA_STRATEGY: ReplicaStrategy = Field(
+        ReplicaStrategy.ROUND_ROBIN,
+        description="从库选择策略：round-robin、least-connections",
+    )
+    PG_READ_YOUR_WRITES: bool = Field(
+        True, description="会话内发生写操作后，后续的读操作也走主库"
+    )
 
 
 @lru_cache
@@ -22,4 +44,4 @@ def get_settings() -> Config:
     return Config()
 
 
-setting: Config = get_settings()
+setting: Config = LazySettings(get_settings)  # type: ignore[assignment]
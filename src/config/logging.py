@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# @Author: martinf fangjie.martin@gmail.com
+# @Date: 2026-10-18 23:05:12
+# @LastEditors: martinf fangjie.martin@gmail.com
+# @LastEditTime: 2026-10-18 23:05:12
+# @Description: 日志配置
+import enum
+from functools import lru_cache
+from typing import Optional
+
+from pydantic import Field
+from pydantic_settings import BaseSettings
+
+from src.config import LazySettings
+
+
+class LogFormatEnum(str, enum.Enum):
+    """日志输出格式"""
+
+    TEXT = "text"
+    JSON = "json"
+
+
+class Config(BaseSettings):
+    LOG_FORMAT: Optional[LogFormatEnum] = Field(
+        None, description="日志输出格式，不设置时本地环境输出文本，其他环境输出JSON"
+    )
+    LOG_BUFFER_SIZE: int = Field(
+        10000, ge=1, description="日志环形缓冲区容量，写满时丢弃最旧的日志"
+    )
+    LOG_BATCH_SIZE: int = Field(256, ge=1, description="写线程每次批量写出的最大条数")
+    LOG_FLUSH_INTERVAL: float = Field(
+        0.2, gt=0, description="写线程的最长刷新间隔，单位秒"
+    )
+    LOG_SAMPLING_THRESHOLD: float = Field(
+        0.5, ge=0, le=1, description="缓冲区占用比例超过该值时开始按级别采样"
+    )
+    LOG_SAMPLING_RATES: dict[str, float] = Field(
+        {"TRACE": 0.01, "DEBUG": 0.1, "INFO": 0.5},
+        description="高负载时各级别日志的保留比例，未配置的级别全部保留",
+    )
+
+
+@lru_cache
+def get_settings() -> Config:
+    return Config()
+
+
+setting: Config = LazySettings(get_settings)  # type: ignore[assignment]
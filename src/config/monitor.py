@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# @Author: martinf fangjie.martin@gmail.com
+# @Date: 2026-10-18 23:30:48
+# @LastEditors: martinf fangjie.martin@gmail.com
+# @LastEditTime: 2026-10-18 23:30:48
+# @Description: 监控配置
+from functools import lru_cache
+from typing import Optional
+
+from pydantic import Field
+from pydantic_settings import BaseSettings
+
+from src.config import LazySettings
+
+
+class Config(BaseSettings):
+    PROFILE_ENABLED: bool = Field(
+        True,
+        description="是否记录profile装饰器的耗时，首次调用时读取，关闭时直接调用原函数",
+    )
+    PROFILE_SLOW_MS: Optional[float] = Field(
+        None, description="单次调用超过该耗时(毫秒)时记录一条警告日志，不设置时不记录"
+    )
+    MONITOR_TOKEN: Optional[str] = Field(
+        None,
+        description=(
+            "监控接口的访问令牌，通过X-Monitor-Token或Authorization: Bearer请求头传递，"
+            "不设置时非生产环境不校验，生产环境拒绝所有请求"
+        ),
+    )
+
+    METRICS_ENABLED: bool = Field(
+        True, description="是否记录请求指标并提供/metrics接口"
+    )
+    METRICS_BUCKETS: list[float] = Field(
+        [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10],
+        description="请求耗时直方图的桶上限，单位秒",
+    )
+    METRICS_MULTIPROC_DIR: Optional[str] = Field(
+        None,
+        description="多进程部署时各worker写入指标快照的目录，/metrics汇总该目录下所有进程的指标",
+    )
+    METRICS_SYNC_INTERVAL: float = Field(
+        5, gt=0, description="写入指标快照的间隔，单位秒"
+    )
+
+
+@lru_cache
+def get_settings() -> Config:
+    return Config()
+
+
+setting: Config = LazySettings(get_settings)  # type: ignore[assignment]
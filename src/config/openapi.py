@@ -9,6 +9,8 @@ from functools import lru_cache
 from pydantic import Field
 from pydantic_settings import BaseSettings
 
+from src.config import LazySettings
+
 
 class Config(BaseSettings):
     OPEN_DOC: bool = Field(True, description="是否开启文档")
@@ -19,4 +21,4 @@ def get_settings() -> Config:
     return Config()
 
 
-setting: Config = get_settings()
+setting: Config = LazySettings(get_settings)  # type: ignore[assignment]
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# @Author: martinf fangjie.martin@gmail.com
+# @Date: 2026-10-18 12:02:31
+# @LastEditors: martinf fangjie.martin@gmail.com
+# @LastEditTime: 2026-10-18 12:02:31
+# @Description: 接口频率限制配置
+import enum
+from functools import lru_cache
+
+from pydantic import Field
+from pydantic_settings import BaseSettings
+
+from src.config import LazySettings
+
+
+class RateLimitStrategy(str, enum.Enum):
+    """限流算法"""
+
+    SLIDING_WINDOW = "sliding-window"
+    TOKEN_BUCKET = "token-bucket"
+
+
+class Config(BaseSettings):
+    RATE_LIMIT_ENABLED: bool = Field(True, description="是否开启接口频率限制")
+    RATE_LIMIT_STRATEGY: RateLimitStrategy = Field(
+        RateLimitStrategy.SLIDING_WINDOW, description="默认的限流算法"
+    )
+    RATE_LIMIT_PREFIX: str = Field("rate-limit", description="限流key前缀")
+    RATE_LIMIT_HEADERS_ENABLED: bool = Field(
+        False, description="是否在响应头中返回限流信息"
+    )
+    RATE_LIMIT_SYNC_INTERVAL: int = Field(
+        100, description="本地计数模式下与redis同步的间隔，单位毫秒"
+    )
+    RATE_LIMIT_LOCAL_ERROR: float = Field(
+        0.1,
+        description="本地计数模式下每个进程未同步的计数上限，占限制次数的比例，超过时立即同步",
+    )
+
+
+@lru_cache
+def get_settings() -> Config:
+    return Config()
+
+
+setting: Config = LazySettings(get_settings)  # type: ignore[assignment]
@@ -6,14 +6,36 @@
 # @Description: redis配置
 
 from functools import lru_cache
+from typing import Annotated
 
-from pydantic import Field, RedisDsn
+from pydantic import Field, UrlConstraints
+from pydantic_core import Url
 from pydantic_settings import BaseSettings
 
+from src.config import LazySettings
+
+# 在RedisDsn的基础上增加集群模式的scheme
+RedisUrl = Annotated[
+    Url,
+    UrlConstraints(
+        allowed_schemes=["redis", "rediss", "unix", "redis+cluster", "rediss+cluster"],
+        default_host="localhost",
+        default_port=6379,
+        default_path="/0",
+    ),
+]
+
 
 class Config(BaseSettings):
-    REDIS_URL: RedisDsn
-    REDIS_POOL_SIZE: int = Field(10, description="redis连接池大小")
+    REDIS_URL: RedisUrl = Field(
+        description="redis连接串，集群使用redis+cluster://或rediss+cluster://，填写任一节点即可"
+    )
+    REDIS_POOL_SIZE: int = Field(
+        10, description="redis连接池大小，集群模式下不限制各节点的连接数"
+    )
+    REDIS_POOL_TIMEOUT: int = Field(
+        5, description="连接池耗尽时等待空闲连接的超时时间，单位秒"
+    )
 
 
 @lru_cache
@@ -21,4 +43,4 @@ def get_settings() -> Config:
     return Config()
 
 
-setting: Config = get_settings()
\ No newline at end of file
+setting: Config = LazySettings(get_settings)  # type: ignore[assignment]
\ No newline at end of file
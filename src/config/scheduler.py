@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# @Author: martinf fangjie.martin@gmail.com
+# @Date: 2026-10-18 13:05:47
+# @LastEditors: martinf fangjie.martin@gmail.com
+# @LastEditTime: 2026-10-18 13:05:47
+# @Description: 定时任务配置
+from functools import lru_cache
+from typing import Optional
+
+from pydantic import Field, RedisDsn
+from pydantic_settings import BaseSettings
+
+from src.config import LazySettings
+
+
+class Config(BaseSettings):
+    SCHEDULER_PREFIX: str = Field("scheduler", description="定时任务相关key的前缀")
+    SCHEDULER_LOCK_TIMEOUT: float = Field(
+        60, description="任务执行锁的过期时间，单位秒，需要大于各进程之间的时钟偏差"
+    )
+    SCHEDULER_MISFIRE_GRACE_TIME: int = Field(
+        30, description="任务错过执行时间后仍允许执行的秒数"
+    )
+    SCHEDULER_REDIS_URL: Optional[RedisDsn] = Field(
+        None,
+        description="持久化任务存储使用的单机redis，为空时使用REDIS_URL；REDIS_URL为集群且未设置时只保存在内存中",
+    )
+
+
+@lru_cache
+def get_settings() -> Config:
+    return Config()
+
+
+setting: Config = LazySettings(get_settings)  # type: ignore[assignment]
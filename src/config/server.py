@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+# @Author: martinf fangjie.martin@gmail.com
+# @Date: 2026-10-19 01:10:44
+# @LastEditors: martinf fangjie.martin@gmail.com
+# @LastEditTime: 2026-10-19 01:10:44
+# @Description: 服务进程配置，见src/runner.py
+from functools import lru_cache
+from typing import Optional
+
+from pydantic import Field
+from pydantic_settings import BaseSettings
+
+from src.config import LazySettings
+
+
+class Config(BaseSettings):
+    SERVER_APP: str = Field("main:app", description="ASGI应用的导入路径")
+    SERVER_HOST: str = Field("0.0.0.0", description="监听地址")
+    SERVER_PORT: int = Field(8000, description="监听端口")
+    SERVER_WORKERS: Optional[int] = Field(
+        None,
+        ge=1,
+        description="worker进程数，不设置时等于可用CPU数(考虑cgroup配额和CPU亲和性)",
+    )
+    SERVER_LOOP: str = Field(
+        "auto", description="事件循环：auto(安装了uvloop时使用uvloop)、uvloop、asyncio"
+    )
+    SERVER_HTTP: str = Field(
+        "auto",
+        description="HTTP协议实现：auto(安装了httptools时使用httptools)、httptools、h11",
+    )
+    SERVER_MAX_REQUESTS: int = Field(
+        0,
+        ge=0,
+        description="worker处理该数量的请求后优雅退出并由主进程重新启动，0表示不回收",
+    )
+    SERVER_MAX_REQUESTS_JITTER: int = Field(
+        0,
+        ge=0,
+        description="在SERVER_MAX_REQUESTS基础上为每个worker随机增加的请求数，避免所有worker同时重启",
+    )
+    SERVER_BACKLOG: int = Field(2048, description="监听队列长度")
+    SERVER_KEEPALIVE: int = Field(5, description="keep-alive连接的空闲超时，单位秒")
+    SERVER_GRACEFUL_TIMEOUT: int = Field(
+        30, description="worker优雅退出的最长等待时间，单位秒"
+    )
+    SERVER_ACCESS_LOG: bool = Field(
+        False, description="是否输出uvicorn访问日志，日志中间件已经记录了每个请求"
+    )
+    SERVER_PROXY_HEADERS: bool = Field(True, description="是否信任X-Forwarded-*请求头")
+
+
+@lru_cache
+def get_settings() -> Config:
+    return Config()
+
+
+setting: Config = LazySettings(get_settings)  # type: ignore[assignment]
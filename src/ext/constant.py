@@ -1,3 +1,4 @@
 class Page:
     MIN = 1
     MAX = 1000
+    STREAM_CHUNK_SIZE = 500  # 流式返回时每次从游标读取的行数
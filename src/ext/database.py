@@ -4,36 +4,209 @@
 # @LastEditors: martinf fangjie.martin@gmail.com
 # @LastEditTime: 2023-09-13 18:22:08
 # @Description: 数据库
+import asyncio
+import itertools
+import time
+from contextlib import asynccontextmanager
 from contextvars import ContextVar
+from typing import AsyncIterator, Iterator, Optional
 
-from sqlalchemy.ext.asyncio import (AsyncAttrs, async_sessionmaker,
-                                    create_async_engine)
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import (AsyncAttrs, AsyncEngine,
+                                    async_sessionmaker, create_async_engine)
 from sqlalchemy.ext.asyncio.session import AsyncSession
-from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.orm import DeclarativeBase, Session
+from sqlalchemy.orm.session import SessionTransactionOrigin
 
-from src.config.database import setting
+from src.config.database import ReplicaStrategy, setting
 
 
 class Base(AsyncAttrs, DeclarativeBase):
     pass
 
 
-async_engine = create_async_engine(
-    str(setting.PG_URL),
-    echo=setting.PG_ECHO,
-    future=True,  # 使用 SQLAlchemy 2.0 API，向后兼容
-    pool_size=setting.PG_POOL_SIZE,
-    pool_recycle=setting.PG_RECYCLE,
+def _create_engine(url: str) -> AsyncEngine:
+    engine = create_async_engine(
+        url,
+        echo=setting.PG_ECHO,
+        future=True,  # 使用 SQLAlchemy 2.0 API，向后兼容
+        pool_size=setting.PG_POOL_SIZE,
+        pool_recycle=setting.PG_RECYCLE,
+    )
+    event.listen(engine.sync_engine, "checkout", _on_checkout)
+    event.listen(engine.sync_engine, "checkin", _on_checkin)
+    return engine
+
+
+# 引擎在首次使用时才创建(同时才导入数据库驱动)，导入本模块不读取配置、不创建连接池
+_engine: Optional[AsyncEngine] = None
+_replica_engines: Optional[list[AsyncEngine]] = None
+_replica_cycle: Optional[Iterator[AsyncEngine]] = None
+
+
+def get_engine() -> AsyncEngine:
+    """主库引擎"""
+    global _engine
+    if _engine is None:
+        _engine = _create_engine(str(setting.PG_URL))
+    return _engine
+
+
+def get_replica_engines() -> list[AsyncEngine]:
+    """从库引擎，没有配置从库时为空列表"""
+    global _replica_engines, _replica_cycle
+    if _replica_engines is None:
+        _replica_engines = [_create_engine(str(url)) for url in setting.PG_REPLICA_URLS]
+        _replica_cycle = itertools.cycle(_replica_engines)
+    return _replica_engines
+
+
+def set_engine(engine: AsyncEngine) -> None:
+    """替换主库引擎，用于测试或基准测试中使用本地数据库"""
+    global _engine
+    _engine = engine
+
+
+async def dispose_engines() -> None:
+    """在lifespan关闭时调用：关闭已创建的连接池"""
+    global _engine, _replica_engines, _replica_cycle
+    for engine in ([_engine] if _engine is not None else []) + (_replica_engines or []):
+        await engine.dispose()
+    _engine, _replica_engines, _replica_cycle = None, None, None
+
+
+def __getattr__(name: str):
+    """兼容原来的模块属性`async_engine`、`replica_engines`"""
+    if name == "async_engine":
+        return get_engine()
+    if name == "replica_engines":
+        return get_replica_engines()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _select_replica() -> AsyncEngine:
+    """按配置的策略选择一个从库"""
+    if setting.PG_REPLICA_STRATEGY is ReplicaStrategy.LEAST_CONNECTIONS:
+        return min(get_replica_engines(), key=lambda engine: engine.pool.checkedout())
+    return next(_replica_cycle)
+
+
+class RoutingSession(Session):
+    """
+    读写分离：事务外(或自动开启的事务中)的普通SELECT走从库，
+    写操作、flush、SELECT ... FOR UPDATE以及`session.begin()`显式开启的事务都走主库。
+    开启`PG_READ_YOUR_WRITES`时，会话发生写操作后后续的读也走主库
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if get_replica_engines() and self._is_replica_read(clause):
+            return _select_replica().sync_engine
+        if self._flushing or getattr(clause, "is_dml", False):
+            self.info["written"] = True
+        return get_engine().sync_engine
+
+    def _is_replica_read(self, clause) -> bool:
+        if self._flushing or not getattr(clause, "is_select", False):
+            return False
+        if clause._for_update_arg is not None:
+            return False
+        if setting.PG_READ_YOUR_WRITES and self.info.get("written"):
+            return False
+        transaction = self.get_transaction()
+        return (
+            transaction is None
+            or transaction.origin is SessionTransactionOrigin.AUTOBEGIN
+        )
+
+
+# 不绑定引擎，由RoutingSession.get_bind在执行sql时选择
+AsyncSessionLocal = async_sessionmaker(
+    sync_session_class=RoutingSession, expire_on_commit=False
 )
 
-AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
 
-__db_session: ContextVar[AsyncSession] = ContextVar("db_session")
+class ConnectionUsage(object):
+    """一个会话作用域内占用数据库连接的统计"""
+
+    __slots__ = ("checkouts", "held")
+
+    def __init__(self):
+        self.checkouts = 0  # 从连接池获取连接的次数
+        self.held = 0.0  # 占用连接的总时长，单位秒
+
+    @property
+    def held_ms(self) -> float:
+        return self.held * 1000
+
+
+_db_session: ContextVar[Optional[AsyncSession]] = ContextVar("db_session", default=None)
+_db_usage: ContextVar[Optional[ConnectionUsage]] = ContextVar("db_usage", default=None)
+
+
+def _on_checkout(_dbapi_connection, connection_record, _connection_proxy):
+    connection_record.info["checkout_at"] = time.perf_counter()
+
+
+def _on_checkin(_dbapi_connection, connection_record):
+    checkout_at = connection_record.info.pop("checkout_at", None)
+    usage = _db_usage.get()
+    if checkout_at is not None and usage is not None:
+        usage.checkouts += 1
+        usage.held += time.perf_counter() - checkout_at
+
+
+def pool_stats() -> dict[str, dict]:
+    """已创建的连接池的统计：primary为主库，replica-N为从库"""
+    engines = {"primary": _engine} if _engine is not None else {}
+    for i, engine in enumerate(_replica_engines or []):
+        engines[f"replica-{i}"] = engine
+    stats = {}
+    for name, engine in engines.items():
+        pool = engine.pool
+        if not hasattr(pool, "checkedout"):  # NullPool等不维护连接的连接池
+            continue
+        stats[name] = {
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": max(pool.overflow(), 0),
+        }
+    return stats
+
+
+@asynccontextmanager
+async def session_scope() -> AsyncIterator[AsyncSession]:
+    """
+    会话作用域：创建会话时不占用连接，首次执行sql时才从连接池获取连接。
+    出现异常时回滚事务，退出时始终关闭会话并把连接归还给连接池，
+    作用域内通过`get_session()`获取同一个会话，通过`get_usage()`获取连接占用统计
+    """
+    session = AsyncSessionLocal()
+    session_token = _db_session.set(session)
+    usage_token = _db_usage.set(ConnectionUsage())
+    try:
+        yield session
+    except BaseException:
+        await asyncio.shield(session.rollback())
+        raise
+    finally:
+        # shield：请求被取消时也要等待连接归还
+        await asyncio.shield(session.close())
+        # 恢复为进入作用域之前的值，嵌套的作用域退出后外层仍使用自己的会话
+        _db_usage.reset(usage_token)
+        _db_session.reset(session_token)
 
 
 def get_session() -> AsyncSession:
-    s = __db_session.get()
-    if not s:
-        s = AsyncSessionLocal()
-        __db_session.set(s)
-    return s
+    """获取当前作用域内的会话"""
+    session = _db_session.get()
+    if session is None:
+        raise RuntimeError(
+            "No database session in current context, use `session_scope()`"
+        )
+    return session
+
+
+def get_usage() -> Optional[ConnectionUsage]:
+    """获取当前会话作用域的连接占用统计"""
+    return _db_usage.get()
@@ -5,19 +5,118 @@
 # @LastEditTime: 2023-09-11 18:37:26
 # @Description: 装饰器
 
-from datetime import datetime
+import inspect
 from functools import wraps
+from time import perf_counter_ns
+from typing import Callable, Optional
 
 from loguru import logger
 
+from src.config.monitor import setting as monitor_setting
+from src.ext.histogram import LatencyHistogram
 
-def log_use_time(func):
-    """记录函数执行耗时"""
-    @wraps(func)
-    def wrapper(*args, **kwargs):
-        start_time = datetime.now()
-        result = func(*args, **kwargs)
-        logger.info(f"execute used time {(datetime.now() - start_time).total_seconds()} s")
-        return result
+# 函数名 -> 耗时直方图
+_histograms: dict[str, LatencyHistogram] = {}
 
-    return wrapper
\ No newline at end of file
+
+def _get_histogram(name: str) -> LatencyHistogram:
+    histogram = _histograms.get(name)
+    if histogram is None:
+        histogram = _histograms.setdefault(name, LatencyHistogram(name))
+    return histogram
+
+
+def profile(
+    func: Optional[Callable] = None,
+    *,
+    name: Optional[str] = None,
+    slow_ms: Optional[float] = None,
+):
+    """
+    记录函数执行耗时到进程内直方图，同时支持同步函数和异步函数，异常退出的调用同样计入
+
+    @profile
+    async def get_user(user_id): ...
+
+    @profile(name="order.export", slow_ms=500)
+    def export(): ...
+
+    - name: 直方图名称，默认为`模块.函数`
+    - slow_ms: 单次耗时超过该值时记录一条警告日志，默认为PROFILE_SLOW_MS
+    PROFILE_ENABLED和PROFILE_SLOW_MS在首次调用时读取，关闭时调用直接转发给原函数
+    统计结果通过`profile_stats()`或监控接口`/monitor/profile`读取
+    """
+
+    def decorator(fn: Callable) -> Callable:
+        histogram_name = name or f"{fn.__module__}.{fn.__qualname__}"
+        # 配置在首次调用时读取，导入被装饰的模块时不创建配置；关闭时只剩一次判断的开销
+        state: list = []
+
+        def resolve() -> Optional[tuple[LatencyHistogram, Optional[int]]]:
+            if not state:
+                if monitor_setting.PROFILE_ENABLED:
+                    threshold = slow_ms
+                    if threshold is None:
+                        threshold = monitor_setting.PROFILE_SLOW_MS
+                    slow_ns = int(threshold * 1e6) if threshold is not None else None
+                    state.append((_get_histogram(histogram_name), slow_ns))
+                else:
+                    state.append(None)
+            return state[0]
+
+        def finish(
+            profiling: tuple[LatencyHistogram, Optional[int]], start: int
+        ) -> None:
+            histogram, slow_ns = profiling
+            elapsed = perf_counter_ns() - start
+            histogram.record(elapsed)
+            if slow_ns is not None and elapsed > slow_ns:
+                logger.warning(
+                    f"{histogram.name} execute used time {elapsed / 1e6:.3f} ms"
+                )
+
+        if inspect.iscoroutinefunction(fn):
+
+            @wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                profiling = state[0] if state else resolve()
+                if profiling is None:
+                    return await fn(*args, **kwargs)
+                start = perf_counter_ns()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    finish(profiling, start)
+
+            return async_wrapper
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            profiling = state[0] if state else resolve()
+            if profiling is None:
+                return fn(*args, **kwargs)
+            start = perf_counter_ns()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                finish(profiling, start)
+
+        return wrapper
+
+    return decorator(func) if func is not None else decorator
+
+
+# 兼容旧名称
+log_use_time = profile
+
+
+def profile_stats() -> dict[str, dict]:
+    """所有被装饰函数的耗时统计，单位毫秒"""
+    return {
+        name: histogram.snapshot() for name, histogram in sorted(_histograms.items())
+    }
+
+
+def reset_profile_stats() -> None:
+    for histogram in list(_histograms.values()):
+        histogram.reset()
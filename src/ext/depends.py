@@ -5,121 +5,96 @@
 # @LastEditTime: 2023-09-14 17:56:03
 # @Description: depends
 
-from typing import Generator
+from typing import AsyncGenerator, Optional
 
-from fastapi import Header, Query, Request
+from fastapi import Header, Query, Request, params
+from loguru import logger
+from redis.asyncio import Redis
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.ext.constant import Page
-from src.ext.database import get_session
+from src.ext.database import get_usage, session_scope
+from src.ext.identity import Identity
 from src.ext.redis import get_client
 
 
-async def get_redis() -> Generator:
-    """获取redis连接"""
-    try:
-        client = await get_client()
-        yield await client.initialize()
-    finally:
-        await client.close()
+async def get_redis() -> Redis:
+    """获取redis客户端：复用进程内共享的连接池，命令执行完后连接自动归还，无需关闭"""
+    return await get_client()
 
 
-def get_db(request: Request) -> Generator:
-    """获取数据库连接"""
-    session = get_session()
-    request.app.state.db = session
-
-    try:
+async def get_db(request: Request) -> AsyncGenerator[AsyncSession, None]:
+    """获取请求级别的数据库会话，首次执行sql时才占用连接，请求结束后记录连接占用时长"""
+    async with session_scope() as session:
+        usage = get_usage()
+        request.state.db = session
         yield session
-    finally:
-        session.close()
 
+    if usage and usage.checkouts:
+        logger.debug(
+            f"db connection held {usage.held_ms:.2f}ms, checkouts {usage.checkouts}"
+        )
+
+
+class HeaderInfo(Identity):
+    """
+    请求头信息，路由函数中声明为`header: HeaderInfo = Depends()`。
+    请求头由FastAPI校验并写入文档，缺少必填请求头时返回422；
+    也可以直接创建，如`HeaderInfo(user_id="1", request_id="r1")`。
+    与`IdentityMiddleware`解析的`Identity`字段相同，`get_identity()`可以在路由函数之外获取
+    """
+
+    __slots__ = ()
 
-class HeaderInfo(object):
-    """请求头信息"""
     def __init__(
         self,
         user_id: str = Header(..., alias="user-id", description="用户ID"),
-        organization_id: str = Header(0, alias="organization-id", description="组织ID"),
+        organization_id: str = Header(
+            "0", alias="organization-id", description="组织ID"
+        ),
         sub_organization_id: str = Header(
-            "", alias="sub-organization-id", description="组织ID"
+            "", alias="sub-organization-id", description="子组织ID，逗号分隔"
         ),
         request_id: str = Header(..., alias="request-id", description="请求ID"),
         is_ad: bool = Header(False, alias="is-ad", description="是否为AD用户"),
         company_id: str = Header("", alias="company-id", description="公司ID"),
         write: int = Header(0, alias="write", description="是否有写权限"),
     ):
-        self.user_id = user_id
-        self.organization_id = organization_id
-        self.request_id = request_id
-        self.is_ad = is_ad
-        self.company_id = company_id
-        self.sub_organization_id = sub_organization_id.split(",")
-        self.write = write
-
-    @staticmethod
-    def keys():
-        return (
-            "user-id",
-            "organization-id",
-            "request-id",
-            "write",
-            "sub-organization-id",
-            "is-ad",
-            "company-id",
-        )
+        values = {
+            "user_id": user_id,
+            "organization_id": organization_id,
+            "sub_organization_id": sub_organization_id,
+            "request_id": request_id,
+            "is_ad": is_ad,
+            "company_id": company_id,
+            "write": write,
+        }
+        for name, value in values.items():
+            # 直接创建时未传入的参数是`Header`对象，取它的默认值
+            if isinstance(value, params.Header):
+                if value.is_required():
+                    raise TypeError(f"HeaderInfo() missing required argument: '{name}'")
+                values[name] = value.default
+        sub_organization_id = values["sub_organization_id"]
+        if isinstance(sub_organization_id, str):
+            values["sub_organization_id"] = (
+                tuple(sub_organization_id.split(",")) if sub_organization_id else ()
+            )
+        super().__init__(**values)
 
     def keys_underline(self):
-        return (
-            "user_id",
-            "organization_id",
-            "request_id",
-            "write",
-            "sub_organization_id",
-            "is_internal",
-            "company_id",
-        )
-
-    def __getitem__(self, item):
-        if item:
-            print(f"item -- {item}")
-            item = item.replace("-", "_")
-            if item in self.keys_underline():
-                return str(getattr(self, item))
-            else:
-                return None
-        else:
-            return None
-
-    def __str__(self):
-        return (
-            f"user-id:{self.user_id},organization-id:{self.organization_id},"
-            f"request-id:{self.request_id},write:{self.write},"
-            f"sub-organization-id:{self.sub_organization_id},"
-            f"is-ad:{self.is_ad},company-id:{self.company_id}"
-        )
-
-    def __repr__(self):
-        return self.__str__()
-
-    @property
-    def class_to_dict(self):
-        return {
-            "user-id": self.user_id,
-            "organization-id": self.organization_id,
-            "request-id": self.request_id,
-            "write": self.write,
-            "sub-organization-id": self.sub_organization_id,
-            "is-ad": self.is_ad,
-            "company-id": self.company_id,
-        }
+        return tuple(key.replace("-", "_") for key in self.keys())
 
 
 class PageInfo(object):
-    """分页信息"""
+    """分页信息，带`cursor`时使用keyset分页，见`src.ext.pagination.paginate`"""
     def __init__(
         self,
         page_size: int = Query(5, alias="page_size", description="每页大小"),
         current: int = Query(1, alias="current", description=f"页码，-1获取所有"),
+        cursor: Optional[str] = Query(
+            None, alias="cursor", description="上一页返回的next_cursor"
+        ),
     ):
         self.page_size = (
             Page.MIN
@@ -128,8 +103,12 @@ class PageInfo(object):
             if page_size < Page.MAX
             else Page.MAX
         )
-        self.page_size = page_size
-        self.current = -1 if current <= -1 else current
+        self.current = -1 if current <= -1 else max(current, 1)
+        self.cursor = cursor
+
+    @property
+    def offset(self) -> int:
+        return (self.current - 1) * self.page_size
 
     def __str__(self):
-        return f"page_size:{self.page_size},current:{self.current}"
+        return f"page_size:{self.page_size},current:{self.current},cursor:{self.cursor}"
@@ -6,17 +6,303 @@
 # @Description: 分布式锁
 
 import asyncio
+import time
+import uuid
+from collections import deque
 from typing import Optional, Union
 
+from loguru import logger
 from redis.asyncio import Redis, RedisCluster
 from redis.asyncio.lock import Lock
-from redis.exceptions import LockError
+from redis.exceptions import LockError, LockNotOwnedError, RedisError
+
+from src.ext.redis import hash_tag, is_shared_client, pubsub_client, shared_client
+
+
+class _Lease(object):
+    """一个已获取的锁的续约信息"""
+
+    __slots__ = ("lock", "token", "ttl", "interval", "renew_at", "expire_at")
+
+    def __init__(self, lock: "DistributeLock", token: bytes):
+        now = time.monotonic()
+        self.lock = lock
+        self.token = token
+        self.ttl = int(lock.timeout * 1000)
+        self.interval = lock.timeout / 3  # 每过1/3的过期时间续约一次
+        self.renew_at = now + self.interval
+        self.expire_at = now + lock.timeout
+
+
+class LeaseManager(object):
+    """
+    进程内共享的续约管理器：所有持有中的锁由同一个定时任务续约，
+    每次把到期(或即将到期)的锁按redis客户端分组，通过pipeline批量续约，
+    续约失败(锁已被他人持有或已过期)的锁不再续约，并标记为`lost`
+    """
+
+    def __init__(self):
+        self._leases: dict[DistributeLock, _Lease] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self.renewals = 0
+        self.failures = 0
+        self.lost = 0
+
+    def register(self, lock: "DistributeLock", token: bytes) -> None:
+        self._leases[lock] = _Lease(lock, token)
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+        else:
+            self._wakeup.set()
+
+    def unregister(self, lock: "DistributeLock") -> None:
+        if self._leases.pop(lock, None) is not None and not self._leases:
+            self._wakeup.set()  # 没有需要续约的锁，让定时任务退出
+
+    async def _run(self) -> None:
+        while self._leases:
+            now = time.monotonic()
+            # 提前半个续约间隔的锁也一起续约，让各个锁的续约时间趋于对齐，合并到同一批
+            due = [
+                lease
+                for lease in self._leases.values()
+                if lease.renew_at - now <= lease.interval / 2
+            ]
+            if due:
+                try:
+                    await self._renew(due)
+                except Exception:
+                    logger.exception("Lease renewal failed")
+                    await asyncio.sleep(min(lease.interval for lease in due) / 2)
+                continue
+
+            delay = min(lease.renew_at for lease in self._leases.values()) - now
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+        self._task = None
+
+    async def _renew(self, leases: list[_Lease]) -> None:
+        groups: dict[int, list[_Lease]] = {}
+        for lease in leases:
+            groups.setdefault(id(lease.lock.redis), []).append(lease)
+
+        for group in groups.values():
+            client = group[0].lock.redis
+            if isinstance(client, RedisCluster):
+                # 集群pipeline不会在EVALSHA之前加载脚本，节点上没有续约脚本时整批失败，
+                # 改为逐个执行脚本(NOSCRIPT时自动加载)，并发发送
+                results = await asyncio.gather(
+                    *(
+                        lease.lock.queue_renewal(client, lease.token, lease.ttl)
+                        for lease in group
+                    ),
+                    return_exceptions=True,
+                )
+            else:
+                pipe = client.pipeline(transaction=False)
+                for lease in group:
+                    await lease.lock.queue_renewal(pipe, lease.token, lease.ttl)
+                try:
+                    results = await pipe.execute(raise_on_error=False)
+                except RedisError as e:
+                    results = [e] * len(group)
+
+            now = time.monotonic()
+            for lease, result in zip(group, results):
+                if self._leases.get(lease.lock) is not lease:
+                    continue  # 续约期间已释放
+                if isinstance(result, Exception):
+                    # 网络错误等：稍后重试，直到确认锁已过期
+                    self.failures += 1
+                    if now < lease.expire_at:
+                        remaining = lease.expire_at - now
+                        lease.renew_at = now + min(lease.interval, remaining) / 2
+                        continue
+                    result = 0
+                if result:
+                    self.renewals += 1
+                    lease.renew_at = now + lease.interval
+                    lease.expire_at = now + lease.lock.timeout
+                else:
+                    self.lost += 1
+                    self._leases.pop(lease.lock, None)
+                    lease.lock.lost = True
+                    logger.warning(f"Lock '{lease.lock.name}' lost, stop renewing")
+
+    def stats(self) -> dict:
+        return {
+            "leases": len(self._leases),
+            "renewals": self.renewals,
+            "failures": self.failures,
+            "lost": self.lost,
+        }
+
+
+_lease_manager = LeaseManager()
+
+
+def lease_stats() -> dict:
+    """续约管理器的统计信息"""
+    return _lease_manager.stats()
+
+
+# 释放锁时发布锁名称的频道
+RELEASE_CHANNEL = "distribute-lock:release"
+
+
+class ReleaseNotifier(object):
+    """
+    进程内共享的释放通知：通过一个pub/sub连接订阅`RELEASE_CHANNEL`，
+    按锁名称维护等待队列，收到释放通知时按FIFO顺序唤醒队首的等待者。
+    所有等待者共用一个连接，不会像BLPOP那样每个等待者占用一个连接池中的连接
+    """
+
+    def __init__(self):
+        self._waiters: dict[str, deque[asyncio.Future]] = {}
+        self._blocked: dict[str, int] = {}  # 获取失败、正在等待通知的数量
+        self._task: Optional[asyncio.Task] = None
+        self._ready: Optional[asyncio.Future] = None
+
+    async def ensure_started(self, timeout: float) -> bool:
+        """首次调用时启动订阅并等待订阅成功，订阅不可用时返回False，调用方退化为轮询"""
+        if self._task is None or self._task.done():
+            self._ready = asyncio.get_running_loop().create_future()
+            self._task = asyncio.create_task(self._listen())
+            await asyncio.wait([self._ready], timeout=timeout)
+        return self._ready.done()
+
+    def enqueue(self, name: str, front: bool = False) -> asyncio.Future:
+        """加入等待队列，`front`为True时插入队首(被唤醒后没有抢到锁，保持原来的顺序)"""
+        future = asyncio.get_running_loop().create_future()
+        queue = self._waiters.setdefault(name, deque())
+        if front:
+            queue.appendleft(future)
+        else:
+            queue.append(future)
+        return future
+
+    def has_waiters(self, name: str) -> bool:
+        return name in self._blocked
+
+    async def wait(self, name: str, future: asyncio.Future, timeout: float) -> None:
+        """获取失败后等待唤醒，等待期间计入`has_waiters`"""
+        self._blocked[name] = self._blocked.get(name, 0) + 1
+        try:
+            await asyncio.wait([future], timeout=timeout)
+        finally:
+            count = self._blocked.pop(name) - 1
+            if count:
+                self._blocked[name] = count
+
+    def discard(self, name: str, future: asyncio.Future) -> None:
+        queue = self._waiters.get(name)
+        if queue is None:
+            return
+        try:
+            queue.remove(future)
+        except ValueError:
+            pass
+        if not queue:
+            del self._waiters[name]
+
+    def _wake(self, name: str) -> None:
+        queue = self._waiters.get(name)
+        while queue:
+            future = queue.popleft()
+            if not future.done():
+                future.set_result(True)
+                break
+        if queue is not None and not queue:
+            del self._waiters[name]
+
+    def _wake_all(self, name: Optional[str] = None) -> None:
+        """唤醒指定锁(为空时所有锁)的全部等待者"""
+        for key in [name] if name is not None else list(self._waiters):
+            for future in self._waiters.pop(key, ()):
+                if not future.done():
+                    future.set_result(True)
+
+    async def _listen(self) -> None:
+        while True:
+            pubsub = pubsub_client().pubsub()
+            try:
+                await pubsub.subscribe(RELEASE_CHANNEL)
+                async for message in pubsub.listen():
+                    if message["type"] == "subscribe" and not self._ready.done():
+                        self._ready.set_result(True)
+                    elif message["type"] == "message":
+                        name = message["data"].decode()
+                        if name.startswith("*"):
+                            self._wake_all(name[1:])
+                        else:
+                            self._wake(name)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # 断线期间可能错过通知：唤醒所有等待者重试，之后重新订阅
+                logger.warning("Lock release listener disconnected, retrying")
+                self._wake_all()
+                if self._ready.done():
+                    self._ready = asyncio.get_running_loop().create_future()
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.reset()
+
+    def stats(self) -> dict:
+        return {"waiters": sum(len(queue) for queue in self._waiters.values())}
+
+
+_release_notifier = ReleaseNotifier()
 
 
 class DistributeLock(Lock):
-    """分布式锁，继承自`redis.asyncio.lock.Lock`，增加了WatchDog机制，防止锁过期后，业务还在执行"""
+    """
+    分布式锁，继承自`redis.asyncio.lock.Lock`，增加了WatchDog机制，防止锁过期后，业务还在执行。
+    设置了timeout的锁获取成功后交给进程内共享的`LeaseManager`续约，续约失败时`lost`为True。
+    开启fencing时，每次获取成功都会得到一个单调递增的`fencing_token`，
+    下游写入时带上该值即可拒绝已经失去锁的旧持有者
+    """
+
+    # KEYS[1]: 锁, KEYS[2]: fencing计数器
+    # ARGV: token, 过期时间(ms，0表示不过期)
+    # 返回: 获取成功时返回新的fencing token，否则返回0
+    LUA_ACQUIRE_FENCED_SCRIPT = """
+        local ok
+        if ARGV[2] == "0" then
+            ok = redis.call('set', KEYS[1], ARGV[1], 'nx')
+        else
+            ok = redis.call('set', KEYS[1], ARGV[1], 'nx', 'px', ARGV[2])
+        end
+        if not ok then
+            return 0
+        end
+        return redis.call('incr', KEYS[2])
+    """
+
+    # KEYS[1]: 锁
+    # ARGV: token, 释放通知频道, 通知内容
+    # 返回: 释放成功返回1，锁已不属于当前持有者返回0
+    LUA_RELEASE_SCRIPT = """
+        local token = redis.call('get', KEYS[1])
+        if not token or token ~= ARGV[1] then
+            return 0
+        end
+        redis.call('del', KEYS[1])
+        redis.call('publish', ARGV[2], ARGV[3])
+        return 1
+    """
 
-    _watch_dog: Optional[asyncio.Task]
+    # 等待释放通知的最长时间，超过后重试一次获取，
+    # 防止错过通知(锁过期、订阅断线)时一直等待
+    NOTIFY_FALLBACK = 1.0
+
+    lua_release = None
+    lua_acquire_fenced = None
 
     def __init__(
         self,
@@ -27,6 +313,8 @@ class DistributeLock(Lock):
         blocking: bool = True,
         blocking_timeout: Optional[float] = None,
         thread_local: bool = True,
+        fencing: bool = False,
+        notify: bool = True,
     ):
         """
         创建一个新的分布式锁实例，
@@ -40,23 +328,64 @@ class DistributeLock(Lock):
             避免其他线程释放锁(如果设置了timeout，默认情况下，锁会在timeout秒后自动释放，
             其他线程可能会获取到锁。当第一个线程执行完任务后，可能会释放第二个线程的锁)。
             如果为False，则所有线程共享一个token
+        fencing：是否生成fencing token，计数器保存在`{name}:fence`，不会过期
+        notify：阻塞获取时是否等待释放通知，为False时按sleep间隔轮询。
+            释放通知只在共享客户端上订阅，使用其他客户端的锁总是按sleep间隔轮询
         """
+        # 等待队列和释放通知使用的名称
+        notify_name = name.decode() if isinstance(name, bytes) else str(name)
+        # 集群模式下redis中的key以`{name}`为hash tag，锁的各个key位于同一个slot；
+        # 单机模式下key就是name
         super().__init__(
-            redis, name, timeout, sleep, blocking, blocking_timeout, thread_local
+            redis,
+            hash_tag(notify_name),
+            timeout,
+            sleep,
+            blocking,
+            blocking_timeout,
+            thread_local,
         )
-        self._watch_dog = None
+        self.fencing = fencing
+        self.notify = notify
+        self.notify_name = notify_name
+        self.fencing_token: Optional[int] = None
+        self.lost = False
 
-    async def _watch(self) -> None:
-        """循环执行续约"""
-        while True:
-            await self.extend(self.timeout)
-            await asyncio.sleep(self.timeout / 3)
+    def register_scripts(self):
+        super().register_scripts()
+        cls = self.__class__
+        if cls.lua_acquire_fenced is None:
+            cls.lua_acquire_fenced = self.redis.register_script(
+                cls.LUA_ACQUIRE_FENCED_SCRIPT
+            )
 
-    def _cancel_watch_dog(self) -> None:
-        """取消正在运行的WatchDog协程"""
-        _old_watch_dog: Optional[asyncio.Future] = getattr(self, "_watch_dog", None)
-        if _old_watch_dog and not _old_watch_dog.cancelled():
-            _old_watch_dog.cancel()
+    def queue_renewal(self, pipe, token: bytes, ttl: int):
+        """
+        把续约命令加入续约管理器的pipeline，脚本返回1表示续约成功。
+        pipe也可以是redis客户端，此时直接执行并返回awaitable
+        """
+        return self.lua_reacquire(keys=[self.name], args=[token, ttl], client=pipe)
+
+    async def _pttl(self) -> int:
+        """获取失败时，距离锁可能被释放的毫秒数，未知时返回-1"""
+        return await self.redis.pttl(self.name)
+
+    def stop_renewal(self) -> None:
+        """停止续约，锁由过期时间自动释放"""
+        _lease_manager.unregister(self)
+
+    async def do_acquire(self, token: Union[str, bytes]) -> bool:
+        if not self.fencing:
+            return await super().do_acquire(token)
+        fencing_token = await self.lua_acquire_fenced(
+            keys=[self.name, f"{self.name}:fence"],
+            args=[token, int(self.timeout * 1000) if self.timeout else 0],
+            client=self.redis,
+        )
+        if not fencing_token:
+            return False
+        self.fencing_token = int(fencing_token)
+        return True
 
     async def acquire(
         self,
@@ -64,17 +393,89 @@ class DistributeLock(Lock):
         blocking_timeout: Optional[float] = None,
         token: Optional[Union[str, bytes]] = None,
     ) -> bool:
-        result = await super().acquire(blocking, blocking_timeout, token)
+        if blocking is None:
+            blocking = self.blocking
+        # 通知订阅在共享客户端(或同一集群)上，
+        # 其他客户端可能连接不同的redis，收不到释放通知
+        if blocking and self.notify and is_shared_client(self.redis):
+            result = await self._acquire_notified(blocking_timeout, token)
+        else:
+            result = await super().acquire(blocking, blocking_timeout, token)
         if result:
-            # 启动WatchDog机制：取消旧的WatchDog，再通过`asyncio.create_task`执行WatchDog
-            self._cancel_watch_dog()
-            self._watch_dog = asyncio.create_task(self._watch())
+            self.lost = False
+            # 不过期的锁不需要续约
+            if self.timeout:
+                _lease_manager.register(self, self.local.token)
         return result
 
+    async def _acquire_notified(
+        self, blocking_timeout: Optional[float], token: Optional[Union[str, bytes]]
+    ) -> bool:
+        """
+        阻塞获取锁：获取失败时加入等待队列，等待持有者释放锁时发布的通知，
+        同一进程内的等待者按FIFO顺序依次唤醒。
+        每次最多等待锁的剩余过期时间和`NOTIFY_FALLBACK`，之后重试一次，轮询只作为兜底
+        """
+        if token is None:
+            token = uuid.uuid1().hex.encode()
+        else:
+            try:
+                encoder = self.redis.connection_pool.get_encoder()
+            except AttributeError:
+                # Cluster
+                encoder = self.redis.get_encoder()
+            token = encoder.encode(token)
+        if blocking_timeout is None:
+            blocking_timeout = self.blocking_timeout
+        loop = asyncio.get_running_loop()
+        stop_trying_at = None
+        if blocking_timeout is not None:
+            stop_trying_at = loop.time() + blocking_timeout
+        name = self.notify_name
+
+        subscribed = await _release_notifier.ensure_started(self.NOTIFY_FALLBACK)
+        # 进程内已经有等待者时直接排队，不和队首的等待者抢锁
+        queued = subscribed and _release_notifier.has_waiters(name)
+        future: Optional[asyncio.Future] = None
+        try:
+            while True:
+                # 先加入队列再尝试获取，避免获取失败到开始等待之间的释放通知丢失。
+                # 等待超时时保留原来的位置，被唤醒但没有抢到锁时重新插入队首
+                if subscribed and (future is None or future.done()):
+                    future = _release_notifier.enqueue(name, front=future is not None)
+                if queued:
+                    queued = False
+                elif await self.do_acquire(token):
+                    self.local.token = token
+                    return True
+                wait = self.NOTIFY_FALLBACK if subscribed else self.sleep
+                pttl = await self._pttl()
+                if pttl >= 0:
+                    wait = min(wait, pttl / 1000)
+                if stop_trying_at is not None:
+                    remaining = stop_trying_at - loop.time()
+                    if remaining <= 0:
+                        return False
+                    wait = min(wait, remaining)
+                if future is not None:
+                    await _release_notifier.wait(name, future, wait)
+                else:
+                    await asyncio.sleep(wait)
+        finally:
+            if future is not None:
+                _release_notifier.discard(name, future)
+
     async def do_release(self, expected_token: bytes) -> None:
-        """释放锁：取消WatchDog，再调用父类的释放锁方法，释放失败，则由超时机制兜底"""
-        self._cancel_watch_dog()
-        return await super().do_release(expected_token)
+        """释放锁：停止续约，再删除锁并发布释放通知，释放失败，则由超时机制兜底"""
+        self.stop_renewal()
+        if not bool(
+            await self.lua_release(
+                keys=[self.name],
+                args=[expected_token, RELEASE_CHANNEL, self.notify_name],
+                client=self.redis,
+            )
+        ):
+            raise LockNotOwnedError("Cannot release a lock that's no longer owned")
 
     async def __aenter__(self) -> "Lock":
         if await self.acquire():
@@ -82,10 +483,442 @@ class DistributeLock(Lock):
         raise LockError("Unable to acquire lock within the time specified")
 
     async def __aexit__(self, exc_type, exc_value, traceback) -> None:
-        await self.do_release()
+        await self.release()
 
     def __del__(self) -> None:
         try:
-            self._cancel_watch_dog()
+            self.stop_renewal()
         except Exception:
             pass
+
+
+# 以下脚本中的公共片段
+# 使用redis服务端时间，避免各进程时钟不一致
+_LUA_NOW = """
+    local time = redis.call('time')
+    local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+"""
+# 持有者保存在有序集合中，score为过期时间(ms)，不过期时为inf。
+# refresh: 按最晚过期的持有者设置key的过期时间
+# hint: 获取失败时返回 -(最早的持有者过期的毫秒数)，都不过期时返回0
+_LUA_HOLDERS = """
+    local function refresh(key)
+        local last = redis.call('zrange', key, -1, -1, 'withscores')
+        if last[2] == nil then
+            return
+        end
+        if last[2] == 'inf' then
+            redis.call('persist', key)
+        else
+            redis.call('pexpire', key, math.max(math.ceil(tonumber(last[2]) - now), 1))
+        end
+    end
+    local function hint(key)
+        local first = redis.call('zrange', key, 0, 0, 'withscores')
+        if first[2] == nil or first[2] == 'inf' then
+            return 0
+        end
+        return -math.max(math.ceil(tonumber(first[2]) - now), 1)
+    end
+    local function add(key, token, ttl)
+        if ttl > 0 then
+            redis.call('zadd', key, now + ttl, token)
+        else
+            redis.call('zadd', key, 'inf', token)
+        end
+        refresh(key)
+    end
+"""
+
+
+class _HolderLock(DistributeLock):
+    """
+    基于Lua脚本的锁的公共部分：脚本获取失败时返回等待时间提示，不需要再查询PTTL；
+    续约、extend和reacquire都通过`queue_renewal`执行，与`DistributeLock`一样由`LeaseManager`续约
+    """
+
+    # KEYS[1]: 持有者集合
+    # ARGV: token, 过期时间(ms)
+    # 返回: 续约成功返回1，已不再持有返回0
+    LUA_HOLDER_RENEW_SCRIPT = _LUA_NOW + _LUA_HOLDERS + """
+        local score = redis.call('zscore', KEYS[1], ARGV[1])
+        if not score then
+            return 0
+        end
+        if score ~= 'inf' and tonumber(score) <= now then
+            redis.call('zrem', KEYS[1], ARGV[1])
+            return 0
+        end
+        add(KEYS[1], ARGV[1], tonumber(ARGV[2]))
+        return 1
+    """
+
+    # KEYS[1]: 持有者集合
+    # ARGV: token, 释放通知频道, 通知内容
+    LUA_HOLDER_RELEASE_SCRIPT = """
+        if redis.call('zrem', KEYS[1], ARGV[1]) == 0 then
+            return 0
+        end
+        redis.call('publish', ARGV[2], ARGV[3])
+        return 1
+    """
+
+    lua_holder_renew = None
+    lua_holder_release = None
+
+    def __init__(
+        self, redis: Union["Redis", "RedisCluster"], name: Union[str, bytes], **kwargs
+    ):
+        super().__init__(redis, name, **kwargs)
+        self._hint = -1
+
+    def register_scripts(self):
+        super().register_scripts()
+        cls = self.__class__
+        if cls.lua_holder_renew is None:
+            cls.lua_holder_renew = self.redis.register_script(
+                cls.LUA_HOLDER_RENEW_SCRIPT
+            )
+        if cls.lua_holder_release is None:
+            cls.lua_holder_release = self.redis.register_script(
+                cls.LUA_HOLDER_RELEASE_SCRIPT
+            )
+
+    def _timeout_ms(self) -> int:
+        """获取脚本使用的过期时间(ms)，0表示不过期"""
+        return int(self.timeout * 1000) if self.timeout else 0
+
+    def _acquired(self, result: int) -> bool:
+        """解析获取脚本的返回值，失败时记录等待时间提示"""
+        result = int(result)
+        if result == 1:
+            return True
+        self._hint = -result if result < 0 else -1
+        return False
+
+    async def _pttl(self) -> int:
+        return self._hint
+
+    async def do_extend(self, additional_time, replace_ttl) -> bool:
+        """持有者集合中只记录过期时间，extend总是把剩余时间设置为`additional_time`"""
+        return await self._renew_now(int(additional_time * 1000))
+
+    async def do_reacquire(self) -> bool:
+        return await self._renew_now(int(self.timeout * 1000))
+
+    async def _renew_now(self, ttl: int) -> bool:
+        if not await self.queue_renewal(self.redis, self.local.token, ttl):
+            raise LockNotOwnedError("Cannot extend a lock that's no longer owned")
+        return True
+
+
+class DistributeSemaphore(_HolderLock):
+    """
+    分布式计数信号量：最多`limit`个持有者同时持有，持有者保存在有序集合中，
+    过期的持有者在下一次获取时清理。续约、释放通知和FIFO唤醒与`DistributeLock`相同
+    """
+
+    # KEYS[1]: 持有者集合
+    # ARGV: token, 最大持有者数量, 过期时间(ms，0表示不过期)
+    LUA_SEMAPHORE_ACQUIRE_SCRIPT = _LUA_NOW + _LUA_HOLDERS + """
+        redis.call('zremrangebyscore', KEYS[1], '-inf', now)
+        if redis.call('zscore', KEYS[1], ARGV[1])
+            or redis.call('zcard', KEYS[1]) < tonumber(ARGV[2]) then
+            add(KEYS[1], ARGV[1], tonumber(ARGV[3]))
+            return 1
+        end
+        return hint(KEYS[1])
+    """
+
+    # KEYS[1]: 持有者集合
+    # ARGV: 最大持有者数量
+    # 返回: 未过期的持有者达到上限时返回1
+    LUA_SEMAPHORE_LOCKED_SCRIPT = _LUA_NOW + """
+        local count = redis.call('zcount', KEYS[1], string.format('(%d', now), '+inf')
+        if count >= tonumber(ARGV[1]) then
+            return 1
+        end
+        return 0
+    """
+
+    lua_semaphore_acquire = None
+    lua_semaphore_locked = None
+
+    def __init__(
+        self,
+        redis: Union["Redis", "RedisCluster"],
+        name: Union[str, bytes],
+        limit: int,
+        timeout: Optional[float] = None,
+        sleep: float = 0.1,
+        blocking: bool = True,
+        blocking_timeout: Optional[float] = None,
+        thread_local: bool = True,
+        notify: bool = True,
+    ):
+        """
+        limit：最多同时持有的数量，其余参数同`DistributeLock`
+        """
+        super().__init__(
+            redis,
+            name,
+            timeout=timeout,
+            sleep=sleep,
+            blocking=blocking,
+            blocking_timeout=blocking_timeout,
+            thread_local=thread_local,
+            notify=notify,
+        )
+        self.limit = limit
+
+    def register_scripts(self):
+        super().register_scripts()
+        cls = self.__class__
+        if cls.lua_semaphore_acquire is None:
+            cls.lua_semaphore_acquire = self.redis.register_script(
+                cls.LUA_SEMAPHORE_ACQUIRE_SCRIPT
+            )
+        if cls.lua_semaphore_locked is None:
+            cls.lua_semaphore_locked = self.redis.register_script(
+                cls.LUA_SEMAPHORE_LOCKED_SCRIPT
+            )
+
+    async def do_acquire(self, token: Union[str, bytes]) -> bool:
+        return self._acquired(
+            await self.lua_semaphore_acquire(
+                keys=[self.name],
+                args=[token, self.limit, self._timeout_ms()],
+                client=self.redis,
+            )
+        )
+
+    def queue_renewal(self, pipe, token: bytes, ttl: int):
+        return self.lua_holder_renew(keys=[self.name], args=[token, ttl], client=pipe)
+
+    async def do_release(self, expected_token: bytes) -> None:
+        self.stop_renewal()
+        if not await self.lua_holder_release(
+            keys=[self.name],
+            args=[expected_token, RELEASE_CHANNEL, self.notify_name],
+            client=self.redis,
+        ):
+            raise LockNotOwnedError("Cannot release a semaphore that's no longer owned")
+
+    async def locked(self) -> bool:
+        """是否已经没有剩余的名额，与获取脚本一样按redis服务端时间判断持有者是否过期"""
+        return bool(
+            await self.lua_semaphore_locked(
+                keys=[self.name], args=[self.limit], client=self.redis
+            )
+        )
+
+    async def owned(self) -> bool:
+        token = self.local.token
+        if token is None:
+            return False
+        return await self.redis.zscore(self.name, token) is not None
+
+
+class _ReadWriteHalf(_HolderLock):
+    """读写锁的一半，key：`{name}:write`写锁，`{name}:readers`读锁持有者，`{name}:write-wait`写等待"""
+
+    def __init__(
+        self, redis: Union["Redis", "RedisCluster"], name: Union[str, bytes], **kwargs
+    ):
+        super().__init__(redis, name, **kwargs)
+        base = hash_tag(self.notify_name)
+        self.write_key = f"{base}:write"
+        self.readers_key = f"{base}:readers"
+        self.intent_key = f"{base}:write-wait"
+
+    @property
+    def keys(self) -> list[str]:
+        return [self.write_key, self.readers_key, self.intent_key]
+
+
+class _ReadLock(_ReadWriteHalf):
+    # KEYS: 写锁, 读锁持有者, 写等待
+    # ARGV: token, 过期时间(ms，0表示不过期)
+    # 有写锁或者有写锁在等待时获取失败
+    LUA_READ_ACQUIRE_SCRIPT = _LUA_NOW + _LUA_HOLDERS + """
+        if redis.call('exists', KEYS[1]) == 1 or redis.call('exists', KEYS[3]) == 1 then
+            local pttl = math.max(
+                redis.call('pttl', KEYS[1]), redis.call('pttl', KEYS[3])
+            )
+            if pttl > 0 then
+                return -pttl
+            end
+            return 0
+        end
+        redis.call('zremrangebyscore', KEYS[2], '-inf', now)
+        add(KEYS[2], ARGV[1], tonumber(ARGV[2]))
+        return 1
+    """
+
+    lua_read_acquire = None
+
+    def register_scripts(self):
+        super().register_scripts()
+        cls = self.__class__
+        if cls.lua_read_acquire is None:
+            cls.lua_read_acquire = self.redis.register_script(
+                cls.LUA_READ_ACQUIRE_SCRIPT
+            )
+
+    async def do_acquire(self, token: Union[str, bytes]) -> bool:
+        return self._acquired(
+            await self.lua_read_acquire(
+                keys=self.keys,
+                args=[token, self._timeout_ms()],
+                client=self.redis,
+            )
+        )
+
+    def queue_renewal(self, pipe, token: bytes, ttl: int):
+        return self.lua_holder_renew(
+            keys=[self.readers_key], args=[token, ttl], client=pipe
+        )
+
+    async def do_release(self, expected_token: bytes) -> None:
+        # 释放读锁只唤醒一个等待者，通常是在等待的写锁
+        self.stop_renewal()
+        if not await self.lua_holder_release(
+            keys=[self.readers_key],
+            args=[expected_token, RELEASE_CHANNEL, self.notify_name],
+            client=self.redis,
+        ):
+            raise LockNotOwnedError("Cannot release a read lock that's no longer owned")
+
+    async def locked(self) -> bool:
+        return bool(await self.redis.exists(self.write_key))
+
+    async def owned(self) -> bool:
+        token = self.local.token
+        if token is None:
+            return False
+        return await self.redis.zscore(self.readers_key, token) is not None
+
+
+class _WriteLock(_ReadWriteHalf):
+    # KEYS: 写锁, 读锁持有者, 写等待
+    # ARGV: token, 过期时间(ms，0表示不过期), 写等待的过期时间(ms，0表示不声明写等待)
+    # 有读锁时声明写等待，之后新的读锁获取失败，防止持续的读请求让写锁一直拿不到
+    LUA_WRITE_ACQUIRE_SCRIPT = _LUA_NOW + _LUA_HOLDERS + """
+        if redis.call('exists', KEYS[1]) == 1 then
+            local pttl = redis.call('pttl', KEYS[1])
+            if pttl > 0 then
+                return -pttl
+            end
+            return 0
+        end
+        redis.call('zremrangebyscore', KEYS[2], '-inf', now)
+        if redis.call('zcard', KEYS[2]) > 0 then
+            if tonumber(ARGV[3]) > 0 then
+                redis.call('set', KEYS[3], ARGV[1], 'px', ARGV[3])
+            end
+            return hint(KEYS[2])
+        end
+        if tonumber(ARGV[2]) > 0 then
+            redis.call('set', KEYS[1], ARGV[1], 'px', ARGV[2])
+        else
+            redis.call('set', KEYS[1], ARGV[1])
+        end
+        if redis.call('get', KEYS[3]) == ARGV[1] then
+            redis.call('del', KEYS[3])
+        end
+        return 1
+    """
+
+    lua_write_acquire = None
+
+    def __init__(
+        self, redis: Union["Redis", "RedisCluster"], name: Union[str, bytes], **kwargs
+    ):
+        super().__init__(redis, name, **kwargs)
+        self._waiting = False
+
+    def register_scripts(self):
+        super().register_scripts()
+        cls = self.__class__
+        if cls.lua_write_acquire is None:
+            cls.lua_write_acquire = self.redis.register_script(
+                cls.LUA_WRITE_ACQUIRE_SCRIPT
+            )
+
+    async def acquire(
+        self,
+        blocking: Optional[bool] = None,
+        blocking_timeout: Optional[float] = None,
+        token: Optional[Union[str, bytes]] = None,
+    ) -> bool:
+        # 只有阻塞获取时才声明写等待
+        self._waiting = self.blocking if blocking is None else blocking
+        return await super().acquire(blocking, blocking_timeout, token)
+
+    async def do_acquire(self, token: Union[str, bytes]) -> bool:
+        intent = int(self.NOTIFY_FALLBACK * 2000) if self._waiting else 0
+        return self._acquired(
+            await self.lua_write_acquire(
+                keys=self.keys,
+                args=[token, self._timeout_ms(), intent],
+                client=self.redis,
+            )
+        )
+
+    def queue_renewal(self, pipe, token: bytes, ttl: int):
+        return self.lua_reacquire(keys=[self.write_key], args=[token, ttl], client=pipe)
+
+    async def do_release(self, expected_token: bytes) -> None:
+        # 释放写锁唤醒所有等待者，等待中的读锁可以同时获取
+        self.stop_renewal()
+        if not await self.lua_release(
+            keys=[self.write_key],
+            args=[expected_token, RELEASE_CHANNEL, f"*{self.notify_name}"],
+            client=self.redis,
+        ):
+            raise LockNotOwnedError(
+                "Cannot release a write lock that's no longer owned"
+            )
+
+    async def locked(self) -> bool:
+        return bool(await self.redis.exists(self.write_key)) or bool(
+            await self.redis.zcard(self.readers_key)
+        )
+
+    async def owned(self) -> bool:
+        token = self.local.token
+        stored = await self.redis.get(self.write_key)
+        return token is not None and stored == token
+
+
+class ReadWriteLock(object):
+    """
+    分布式读写锁：多个读者可以同时持有读锁，写锁与任何锁互斥。
+    写锁等待期间新的读锁不再获取成功，防止写锁饥饿
+
+    rw = get_rw_lock("article:1", timeout=10)
+    async with rw.read: ...
+    async with rw.write: ...
+    """
+
+    def __init__(
+        self, redis: Union["Redis", "RedisCluster"], name: Union[str, bytes], **kwargs
+    ):
+        """参数同`DistributeLock`，不支持fencing"""
+        self.read = _ReadLock(redis, name, **kwargs)
+        self.write = _WriteLock(redis, name, **kwargs)
+
+
+def get_lock(name: Union[str, bytes, memoryview], **kwargs) -> DistributeLock:
+    """基于进程内共享的redis客户端创建分布式锁，参数同`DistributeLock`"""
+    return DistributeLock(shared_client(), name, **kwargs)
+
+
+def get_semaphore(name: Union[str, bytes], limit: int, **kwargs) -> DistributeSemaphore:
+    """基于进程内共享的redis客户端创建分布式信号量，参数同`DistributeSemaphore`"""
+    return DistributeSemaphore(shared_client(), name, limit, **kwargs)
+
+
+def get_rw_lock(name: Union[str, bytes], **kwargs) -> ReadWriteLock:
+    """基于进程内共享的redis客户端创建分布式读写锁，参数同`ReadWriteLock`"""
+    return ReadWriteLock(shared_client(), name, **kwargs)
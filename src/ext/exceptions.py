@@ -47,9 +47,7 @@ class BadRequest(DetailedHTTPException):
 class NotAuthenticated(DetailedHTTPException):
     STATUS_CODE = status.HTTP_401_UNAUTHORIZED
     DETAIL = "User not authenticated"
-
-    def __init__(self) -> None:
-        super().__init__(headers={"WWW-Authenticate": "Bearer"})
+    HEADERS = {"WWW-Authenticate": "Bearer"}
 
 
 async def validation_exception_handler(
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# @Author: martinf fangjie.martin@gmail.com
+# @Date: 2026-10-18 23:30:48
+# @LastEditors: martinf fangjie.martin@gmail.com
+# @LastEditTime: 2026-10-18 23:30:48
+# @Description: 进程内HDR风格的延迟直方图
+
+from typing import Iterable, Optional
+
+# 每个2的幂区间再等分为2^SUB_BUCKET_BITS个子桶，相对误差不超过1/2^SUB_BUCKET_BITS
+SUB_BUCKET_BITS = 5
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+# 可记录的最大值为2^MAX_VALUE_BITS - 1纳秒(约18分钟)，超过的记入最后一个桶
+MAX_VALUE_BITS = 40
+BUCKET_COUNT = (MAX_VALUE_BITS - SUB_BUCKET_BITS + 1) << SUB_BUCKET_BITS
+
+DEFAULT_PERCENTILES = (50, 90, 99, 99.9)
+
+
+def bucket_index(value: int) -> int:
+    """值 -> 桶下标：小于SUB_BUCKET_COUNT的值精确记录，之后按对数-线性分桶"""
+    if value < SUB_BUCKET_COUNT:
+        return value if value > 0 else 0
+    exponent = value.bit_length() - SUB_BUCKET_BITS - 1
+    index = ((exponent + 1) << SUB_BUCKET_BITS) + (value >> exponent) - SUB_BUCKET_COUNT
+    return index if index < BUCKET_COUNT else BUCKET_COUNT - 1
+
+
+def bucket_range(index: int) -> tuple[int, int]:
+    """桶下标 -> 桶内的[最小值, 最大值]"""
+    if index < SUB_BUCKET_COUNT:
+        return index, index
+    exponent = (index >> SUB_BUCKET_BITS) - 1
+    mantissa = (index & (SUB_BUCKET_COUNT - 1)) + SUB_BUCKET_COUNT
+    return mantissa << exponent, ((mantissa + 1) << exponent) - 1
+
+
+class LatencyHistogram(object):
+    """
+    定长数组实现的延迟直方图，单位纳秒
+
+    记录只做一次下标计算和几次整数累加，可以在生产环境常开；分位数在读取时才计算。
+    多线程同时记录时不加锁，极少数计数可能丢失，对统计结果的影响可以忽略
+    """
+
+    __slots__ = ("name", "counts", "count", "total", "min", "max")
+
+    def __init__(self, name: str = ""):
+        self.name = name
+        self.reset()
+
+    def reset(self) -> None:
+        self.counts = [0] * BUCKET_COUNT
+        self.count = 0
+        self.total = 0
+        self.min: Optional[int] = None
+        self.max = 0
+
+    def record(self, value: int) -> None:
+        self.counts[bucket_index(value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        if self.min is None or value < self.min:
+            self.min = value
+
+    def percentiles(
+        self, percentiles: Iterable[float] = DEFAULT_PERCENTILES
+    ) -> dict[float, int]:
+        """一次遍历计算多个分位数，返回所在桶的最大值(与HdrHistogram一致，偏保守)"""
+        targets = sorted(percentiles)
+        result = dict.fromkeys(targets, 0)
+        if not self.count or not targets:
+            return result
+        thresholds = [max(1, -(-self.count * p // 100)) for p in targets]
+        seen, position = 0, 0
+        for index, count in enumerate(self.counts):
+            if not count:
+                continue
+            seen += count
+            while position < len(targets) and seen >= thresholds[position]:
+                result[targets[position]] = min(bucket_range(index)[1], self.max)
+                position += 1
+            if position == len(targets):
+                break
+        return result
+
+    def snapshot(self, percentiles: Iterable[float] = DEFAULT_PERCENTILES) -> dict:
+        """导出统计结果，时间单位为毫秒"""
+        values = self.percentiles(percentiles)
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count / 1e6, 4) if self.count else 0,
+            "min_ms": round((self.min or 0) / 1e6, 4),
+            "max_ms": round(self.max / 1e6, 4),
+            **{f"p{p:g}_ms": round(value / 1e6, 4) for p, value in values.items()},
+        }
+
+    def buckets(self) -> list[tuple[int, int]]:
+        """非空桶的(桶内最大值, 计数)，用于导出到外部监控系统"""
+        return [
+            (bucket_range(index)[1], count)
+            for index, count in enumerate(self.counts)
+            if count
+        ]
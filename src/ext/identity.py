@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+# @Author: martinf fangjie.martin@gmail.com
+# @Date: 2026-10-18 22:10:37
+# @LastEditors: martinf fangjie.martin@gmail.com
+# @LastEditTime: 2026-10-18 22:10:37
+# @Description: 请求身份信息：在ASGI层解析一次请求头，请求内通过上下文变量共享
+
+from contextvars import ContextVar, Token
+from typing import Optional
+
+from starlette.types import Scope
+
+
+class Identity(object):
+    """
+    请求身份信息，不可变。由`IdentityMiddleware`在每个请求开始时从请求头解析一次，
+    日志、缓存key、限流key和路由函数都读取同一个对象
+    """
+
+    __slots__ = (
+        "user_id",
+        "organization_id",
+        "sub_organization_id",
+        "request_id",
+        "is_ad",
+        "company_id",
+        "write",
+    )
+
+    # 请求头 -> 属性名
+    HEADERS = {
+        b"user-id": "user_id",
+        b"organization-id": "organization_id",
+        b"sub-organization-id": "sub_organization_id",
+        b"request-id": "request_id",
+        b"is-ad": "is_ad",
+        b"company-id": "company_id",
+        b"write": "write",
+    }
+
+    def __init__(
+        self,
+        user_id: str = "",
+        organization_id: str = "0",
+        sub_organization_id: tuple[str, ...] = (),
+        request_id: str = "",
+        is_ad: bool = False,
+        company_id: str = "",
+        write: int = 0,
+    ):
+        setattr_ = object.__setattr__
+        setattr_(self, "user_id", user_id)
+        setattr_(self, "organization_id", organization_id)
+        setattr_(self, "sub_organization_id", sub_organization_id)
+        setattr_(self, "request_id", request_id)
+        setattr_(self, "is_ad", is_ad)
+        setattr_(self, "company_id", company_id)
+        setattr_(self, "write", write)
+
+    @classmethod
+    def from_scope(cls, scope: Scope) -> "Identity":
+        """遍历一次ASGI请求头完成解析"""
+        values = {}
+        headers = cls.HEADERS
+        for key, value in scope["headers"]:
+            name = headers.get(key)
+            if name is not None:
+                values[name] = value.decode("latin-1")
+        if not values:
+            return ANONYMOUS
+
+        sub_organization_id = values.get("sub_organization_id")
+        write = values.get("write", "0")
+        return cls(
+            user_id=values.get("user_id", ""),
+            organization_id=values.get("organization_id", "0"),
+            sub_organization_id=(
+                tuple(sub_organization_id.split(",")) if sub_organization_id else ()
+            ),
+            request_id=values.get("request_id", ""),
+            is_ad=values.get("is_ad", "").lower() in ("1", "true", "yes", "on"),
+            company_id=values.get("company_id", ""),
+            write=int(write) if write.isdigit() else 0,
+        )
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+    def __delattr__(self, key):
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+    @staticmethod
+    def keys():
+        return (
+            "user-id",
+            "organization-id",
+            "request-id",
+            "write",
+            "sub-organization-id",
+            "is-ad",
+            "company-id",
+        )
+
+    def __getitem__(self, item: str) -> Optional[str]:
+        """兼容原`HeaderInfo`：按请求头名获取值，配合`keys()`可以直接`dict(identity)`"""
+        name = self.HEADERS.get(item.encode("latin-1")) if item else None
+        if name is None:
+            return None
+        return str(getattr(self, name))
+
+    def __bool__(self) -> bool:
+        return bool(self.user_id)
+
+    def __str__(self):
+        return (
+            f"user-id:{self.user_id},organization-id:{self.organization_id},"
+            f"request-id:{self.request_id},write:{self.write},"
+            f"sub-organization-id:{list(self.sub_organization_id)},"
+            f"is-ad:{self.is_ad},company-id:{self.company_id}"
+        )
+
+    def __repr__(self):
+        return self.__str__()
+
+    @property
+    def class_to_dict(self) -> dict:
+        return {
+            "user-id": self.user_id,
+            "organization-id": self.organization_id,
+            "request-id": self.request_id,
+            "write": self.write,
+            "sub-organization-id": list(self.sub_organization_id),
+            "is-ad": self.is_ad,
+            "company-id": self.company_id,
+        }
+
+
+# 没有身份请求头时共享同一个实例，不额外分配对象
+ANONYMOUS = Identity()
+
+_identity: ContextVar[Identity] = ContextVar("identity", default=ANONYMOUS)
+
+
+def get_identity() -> Identity:
+    """获取当前请求的身份信息，请求外(或没有身份请求头)时返回`ANONYMOUS`"""
+    return _identity.get()
+
+
+def set_identity(identity: Identity) -> Token:
+    return _identity.set(identity)
+
+
+def reset_identity(token: Token) -> None:
+    _identity.reset(token)
@@ -5,16 +5,647 @@
 # @LastEditTime: 2023-09-18 17:24:24
 # @Description: 接口缓存
 
+import asyncio
+import hashlib
+import inspect
+import time
+from collections import Counter, OrderedDict
+from functools import wraps
+from typing import (Any, Awaitable, Callable, Optional, ParamSpec, Sequence,
+                    Tuple, Type, TypeVar, Union)
+from urllib.parse import urlencode
+
+from fastapi.concurrency import run_in_threadpool
 from fastapi_cache import FastAPICache
 from fastapi_cache.backends.redis import RedisBackend
-from fastapi_cache.decorator import cache
+from fastapi_cache.coder import Coder
+from fastapi_cache.key_builder import default_key_builder
+from loguru import logger
+from redis.asyncio import Redis
+from redis.commands.core import AsyncScript
+from redis.exceptions import LockError, RedisError
+from starlette.requests import Request
+from starlette.responses import Response
+
+from src.config.cache import setting
+from src.ext.distribute_lock import get_lock
+from src.ext.identity import get_identity
+from src.ext.redis import (get_client, group_by_slot, is_cluster, pubsub_client,
+                          shared_client)
+
+P = ParamSpec("P")
+R = TypeVar("R")
+
+# 缓存key和标签集合不使用公共的hash tag
+# (否则同一个组织的所有缓存集中在集群的一个slot上)。
+# 单机模式下写入缓存和记录标签在一个脚本中完成；
+# 集群模式下按slot拆分为多次调用，见`_set_with_tags`
+
+# 把缓存key加入标签集合：标签集合的过期时间不短于其中任何一个缓存
+_LUA_ADD_TAGS = """
+local function add_tags(key, first, expire)
+    for i = first, #KEYS do
+        redis.call('SADD', KEYS[i], key)
+        if redis.call('TTL', KEYS[i]) < expire then
+            redis.call('EXPIRE', KEYS[i], expire)
+        end
+    end
+end
+"""
+
+# 写入缓存并记录标签
+# KEYS[1]: 缓存key, KEYS[2..]: 标签集合
+# ARGV: 值, 过期时间(秒)
+_SET_WITH_TAGS_SCRIPT = _LUA_ADD_TAGS + """
+local expire = tonumber(ARGV[2])
+redis.call('SET', KEYS[1], ARGV[1], 'EX', expire)
+add_tags(KEYS[1], 2, expire)
+return 1
+"""
+
+# 只记录标签，用于集群模式下缓存key与标签集合不在同一个slot的情况
+# KEYS: 标签集合
+# ARGV: 缓存key, 过期时间(秒)
+_ADD_TAGS_SCRIPT = _LUA_ADD_TAGS + """
+add_tags(ARGV[1], 1, tonumber(ARGV[2]))
+return 1
+"""
+
+# 取出并删除标签集合，返回其中记录的缓存key，由调用方删除，
+# 缓存key可以与标签集合不在同一个slot
+# KEYS: 标签集合
+_POP_TAGS_SCRIPT = """
+local keys = {}
+for i = 1, #KEYS do
+    for _, key in ipairs(redis.call('SMEMBERS', KEYS[i])) do
+        keys[#keys + 1] = key
+    end
+    redis.call('DEL', KEYS[i])
+end
+return keys
+"""
+
+_SCRIPTS = {
+    "set_with_tags": _SET_WITH_TAGS_SCRIPT,
+    "add_tags": _ADD_TAGS_SCRIPT,
+    "pop_tags": _POP_TAGS_SCRIPT,
+}
+_scripts: dict[str, AsyncScript] = {}
+_scripts_client: Optional[Redis] = None
+
+
+def _script(name: str) -> AsyncScript:
+    global _scripts, _scripts_client
+    client = shared_client()
+    if client is not _scripts_client:
+        _scripts_client = client
+        _scripts = {k: client.register_script(v) for k, v in _SCRIPTS.items()}
+    return _scripts[name]
+
+
+class LocalCache:
+    """
+    进程内的一级缓存：LRU淘汰 + 过期时间，按编码后数据的长度限制内存占用
+
+    不指定max_bytes时在首次使用时读取CACHE_LOCAL_MAX_BYTES，导入模块时不创建配置
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None):
+        self._max_bytes = max_bytes
+        self.size = 0
+        self.evictions = 0
+        self._data: OrderedDict[str, Tuple[float, Union[str, bytes]]] = OrderedDict()
+
+    @property
+    def max_bytes(self) -> int:
+        if self._max_bytes is None:
+            self._max_bytes = setting.CACHE_LOCAL_MAX_BYTES
+        return self._max_bytes
+
+    def get(self, key: str) -> Optional[Tuple[int, Union[str, bytes]]]:
+        """返回(剩余秒数, 值)，不存在或已过期时返回None"""
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expire_at, value = item
+        now = time.monotonic()
+        if expire_at <= now:
+            self.delete(key)
+            return None
+        self._data.move_to_end(key)
+        return int(expire_at - now), value
+
+    def set(self, key: str, value: Union[str, bytes], expire: int) -> None:
+        size = len(key) + len(value)
+        if expire <= 0 or size > self.max_bytes:
+            return
+        self.delete(key)
+        self._data[key] = (time.monotonic() + expire, value)
+        self.size += size
+        while self.size > self.max_bytes:
+            old_key, (_, old_value) = self._data.popitem(last=False)
+            self.size -= len(old_key) + len(old_value)
+            self.evictions += 1
 
-from src.ext.redis import get_client
+    def delete(self, key: str) -> None:
+        item = self._data.pop(key, None)
+        if item is not None:
+            self.size -= len(key) + len(item[1])
+
+    def clear(self, prefix: str = "") -> None:
+        """清理以prefix开头的条目，prefix为空时清理全部"""
+        if not prefix:
+            self._data.clear()
+            self.size = 0
+            return
+        for key in [k for k in self._data if k.startswith(prefix)]:
+            self.delete(key)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._data),
+            "size": self.size,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+        }
+
+
+local_cache = LocalCache()
+_listener: Optional[asyncio.Task] = None
+_inflight: dict[str, asyncio.Future] = {}  # 正在重建的缓存key
+_LOCK_POLL_INTERVAL = 0.05  # 等待其他进程重建缓存时的轮询间隔，单位秒
+# 查询结果计数：local_hit(一级缓存命中)、hit(redis命中)、miss、error(读取redis出错)
+_lookups: Counter[str] = Counter()
+
+
+def cache_stats() -> dict:
+    """本进程的缓存命中统计以及一级缓存的占用情况"""
+    return {"lookups": dict(_lookups), "local": local_cache.stats()}
+
+
+async def _listen_invalidation() -> None:
+    """订阅失效通知，丢弃本进程一级缓存中的对应条目"""
+    while True:
+        pubsub = pubsub_client().pubsub()
+        try:
+            await pubsub.subscribe(setting.CACHE_INVALIDATE_CHANNEL)
+            async for message in pubsub.listen():
+                if message["type"] != "message":
+                    continue
+                for target in message["data"].decode().split("\n"):
+                    _drop_local(target)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # 断线期间可能错过失效通知，清空一级缓存后重新订阅
+            logger.warning("cache invalidation listener disconnected, retrying")
+            local_cache.clear()
+            await asyncio.sleep(1)
+        finally:
+            await pubsub.reset()
+
+
+def _drop_local(target: str) -> None:
+    """target以`*`结尾时按前缀清理，否则按key清理"""
+    if target.endswith("*"):
+        local_cache.clear(target[:-1])
+    else:
+        local_cache.delete(target)
 
 
 async def init_cache():
+    """
+    初始化接口缓存，使用共享的redis连接池，默认使用`tenant_key_builder`生成key，
+    开启一级缓存时订阅失效通知
+    """
+    global _listener
     client = await get_client()
-    FastAPICache.init(RedisBackend(client), prefix="fastapi-cache")
+    FastAPICache.init(
+        RedisBackend(client),
+        prefix=setting.CACHE_PREFIX,
+        key_builder=tenant_key_builder,
+    )
+    if local_cache.max_bytes > 0 and _listener is None:
+        _listener = asyncio.create_task(_listen_invalidation())
+
+
+async def close_cache():
+    """停止失效通知订阅"""
+    global _listener
+    if _listener is not None:
+        _listener.cancel()
+        _listener = None
+    local_cache.clear()
+
+
+async def clear_cache(
+    namespace: Optional[str] = None, key: Optional[str] = None
+) -> int:
+    """
+    清理redis中的缓存，并通过pub/sub通知所有进程丢弃一级缓存
+    * **namespace**: 清理该命名空间下的所有缓存，为空时清理全部
+    * **key**: 清理指定的缓存key，优先于namespace
+    """
+    backend = FastAPICache.get_backend()
+    if key:
+        target = key
+        count = await backend.clear(key=key)
+    else:
+        pattern = f":{namespace}:*" if namespace else ":*"
+        target = FastAPICache.get_prefix() + pattern
+        if is_cluster():
+            count = await _clear_cluster(target)
+        else:
+            count = await backend.clear(namespace=target[:-2])
+    _drop_local(target)
+    await pubsub_client().publish(setting.CACHE_INVALIDATE_CHANNEL, target)
+    return count
+
+
+async def _clear_cluster(pattern: str, batch: int = 500) -> int:
+    """集群模式下KEYS只在一个节点上执行，改为在所有主节点上SCAN，再按批删除"""
+    client = shared_client()
+    count, keys = 0, []
+    async for key in client.scan_iter(match=pattern, count=batch):
+        keys.append(key)
+        if len(keys) >= batch:
+            count += await client.delete(*keys)
+            keys = []
+    if keys:
+        count += await client.delete(*keys)
+    return count
+
+
+def _build_key(
+    namespace: Optional[str], request: Request, per_user: bool
+) -> Optional[str]:
+    identity = get_identity()
+    # 匿名请求不缓存：没有用户ID时无法按用户隔离，
+    # 没有组织ID时各调用方会共用默认组织"0"的缓存
+    if per_user:
+        identified = bool(identity.user_id)
+    else:
+        identified = identity.organization_id not in ("", "0")
+    if not identified:
+        return None
+    query = request.scope["query_string"]
+    if query:
+        # 参数顺序不影响key，过长时取摘要
+        query = urlencode(sorted(request.query_params.multi_items()))
+        if len(query) > setting.CACHE_KEY_MAX_QUERY:
+            query = hashlib.blake2b(query.encode(), digest_size=16).hexdigest()
+    user_id = identity.user_id if per_user else "*"
+    return (
+        f"{FastAPICache.get_prefix()}:{namespace}:{request.scope['path']}:"
+        f"{identity.organization_id}:{user_id}?{query or ''}"
+    )
+
+
+def tenant_key_builder(
+    func: Callable,
+    namespace: Optional[str] = "",
+    request: Optional[Request] = None,
+    response: Optional[Response] = None,
+    args: Optional[tuple] = None,
+    kwargs: Optional[dict] = None,
+) -> Optional[str]:
+    """
+    按`路由路径 + 组织ID + 用户ID + 查询参数`生成缓存key，
+    身份信息读取`IdentityMiddleware`解析的结果。
+    不对依赖注入的参数(会话、请求对象等)取hash，key可读且可以按前缀清理。
+    请求没有用户ID时返回None，该请求不使用缓存；
+    不在请求中调用时退化为`fastapi_cache`默认的key生成方式
+    """
+    if request is None:
+        return default_key_builder(func, namespace, request, response, args, kwargs)
+    return _build_key(namespace, request, per_user=True)
+
+
+def organization_key_builder(
+    func: Callable,
+    namespace: Optional[str] = "",
+    request: Optional[Request] = None,
+    response: Optional[Response] = None,
+    args: Optional[tuple] = None,
+    kwargs: Optional[dict] = None,
+) -> Optional[str]:
+    """同`tenant_key_builder`，但同一组织内的用户共享缓存，请求没有组织ID时不使用缓存"""
+    if request is None:
+        return default_key_builder(func, namespace, request, response, args, kwargs)
+    return _build_key(namespace, request, per_user=False)
+
+
+def organization_tag(organization_id: str) -> str:
+    """组织标签，`cache`装饰器写入的缓存都会带上当前请求的组织标签"""
+    return f"org:{organization_id}"
+
+
+def _tag_key(tag: str) -> str:
+    return f"{FastAPICache.get_prefix()}:tag:{tag}"
+
+
+def _resolve_tags(tags: Sequence[str], kwargs: dict) -> list[str]:
+    """标签模板使用路由函数的参数以及当前请求的组织ID、用户ID格式化"""
+    identity = get_identity()
+    values = {
+        **kwargs,
+        "organization_id": identity.organization_id,
+        "user_id": identity.user_id,
+    }
+    return [_tag_key(organization_tag(identity.organization_id))] + [
+        _tag_key(tag.format_map(values)) for tag in tags
+    ]
+
+
+async def _set_with_tags(
+    key: str, value: Union[str, bytes], expire: int, tags: list[str]
+) -> None:
+    """
+    写入缓存并记录标签。集群模式下缓存key与标签集合通常不在同一个slot，
+    先写入缓存，再按slot分组记录标签，此时两步不是原子的
+    """
+    if len(group_by_slot([key, *tags])) == 1:
+        await _script("set_with_tags")(keys=[key, *tags], args=[value, expire])
+        return
+    await shared_client().set(key, value, ex=expire)
+    for group in group_by_slot(tags):
+        await _script("add_tags")(keys=group, args=[key, expire])
+
+
+async def invalidate_tags(*tags: str) -> int:
+    """
+    删除带有任一标签的缓存，并通过pub/sub通知所有进程丢弃一级缓存，返回删除的数量。
+    例如写操作后调用`invalidate_tags(organization_tag(org_id))`清理整个组织的缓存
+    """
+    keys = []
+    for group in group_by_slot(_tag_key(tag) for tag in tags):
+        keys.extend(await _script("pop_tags")(keys=group))
+    if not keys:
+        return 0
+    targets = list({key.decode() if isinstance(key, bytes) else key for key in keys})
+    # 集群模式下按slot拆分为多个DEL
+    deleted = await shared_client().delete(*targets)
+    for target in targets:
+        _drop_local(target)
+    await pubsub_client().publish(setting.CACHE_INVALIDATE_CHANNEL, "\n".join(targets))
+    return deleted
+
+
+async def _single_flight(
+    cache_key: str,
+    backend: RedisBackend,
+    compute: Callable[[], Awaitable[Union[str, bytes]]],
+) -> Union[str, bytes]:
+    """
+    合并同一个key的并发未命中请求，返回编码后的结果
+    * 进程内：第一个请求执行compute，其余请求等待同一个Future
+    * 跨进程：拿到分布式锁的进程执行compute，其余进程轮询redis等待新值，超时后自行执行
+    """
+    future = _inflight.get(cache_key)
+    if future is not None:
+        # 不直接await Future，避免执行compute的请求被取消时连带取消等待的请求
+        await asyncio.wait([future])
+        if not future.cancelled():
+            return future.result()
+        return await _single_flight(cache_key, backend, compute)
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[cache_key] = future
+    try:
+        encoded_ret = await _load_with_lock(cache_key, backend, compute)
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        future.exception()  # 标记异常已被读取，没有等待者时不输出警告
+        raise
+    else:
+        future.set_result(encoded_ret)
+        return encoded_ret
+    finally:
+        _inflight.pop(cache_key, None)
+
+
+async def _load_with_lock(
+    cache_key: str,
+    backend: RedisBackend,
+    compute: Callable[[], Awaitable[Union[str, bytes]]],
+) -> Union[str, bytes]:
+    lock = get_lock(
+        f"{cache_key}:lock", timeout=setting.CACHE_LOCK_TIMEOUT, blocking=False
+    )
+    try:
+        acquired = await lock.acquire()
+    except RedisError:
+        logger.warning(f"Error acquiring cache lock for '{cache_key}'")
+        return await compute()
+
+    if acquired:
+        try:
+            return await compute()
+        finally:
+            try:
+                await lock.release()
+            except (LockError, RedisError):
+                pass  # 锁已过期或释放失败，由过期时间兜底
+
+    # 其他进程正在重建缓存：等待新值写入，超时后自行执行
+    deadline = time.monotonic() + setting.CACHE_LOCK_WAIT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(_LOCK_POLL_INTERVAL)
+        try:
+            ret = await backend.get(cache_key)
+        except RedisError:
+            break
+        if ret is not None:
+            return ret
+    return await compute()
+
+
+def cache(
+    expire: Optional[int] = None,
+    coder: Optional[Type[Coder]] = None,
+    key_builder: Optional[Callable[..., Any]] = None,
+    namespace: Optional[str] = "",
+    local: bool = False,
+    single_flight: bool = True,
+    tags: Optional[Sequence[str]] = None,
+):
+    """
+    缓存路由函数的返回值，参数同`fastapi_cache.decorator.cache`
+    * **expire**: 过期时间，单位秒
+    * **coder**: 编解码器
+    * **key_builder**: 缓存key生成函数，默认`tenant_key_builder`，
+      返回None时该请求不使用缓存
+    * **namespace**: 命名空间
+    * **local**: 是否在redis之前启用进程内一级缓存，适用于读多写少的热点接口
+    * **single_flight**: 缓存未命中时是否合并并发请求，只由一个请求执行路由函数
+    * **tags**: 缓存标签模板，如`"article:{article_id}"`，可以使用路由函数的参数以及
+      `organization_id`、`user_id`，之后通过`invalidate_tags`批量删除。
+      所有缓存都会带上当前组织的标签`organization_tag(organization_id)`
+    """
+
+    def wrapper(func: Callable[P, Awaitable[R]]) -> Callable[P, Awaitable[R]]:
+        """为路由函数注入request和response参数"""
+        signature = inspect.signature(func)
+        request_param = next(
+            (
+                param
+                for param in signature.parameters.values()
+                if param.annotation is Request
+            ),
+            None,
+        )
+        response_param = next(
+            (
+                param
+                for param in signature.parameters.values()
+                if param.annotation is Response
+            ),
+            None,
+        )
+        parameters = []
+        extra_params = []
+        for p in signature.parameters.values():
+            if p.kind <= inspect.Parameter.KEYWORD_ONLY:
+                parameters.append(p)
+            else:
+                extra_params.append(p)
+        if not request_param:
+            parameters.append(
+                inspect.Parameter(
+                    name="request",
+                    annotation=Request,
+                    kind=inspect.Parameter.KEYWORD_ONLY,
+                ),
+            )
+        if not response_param:
+            parameters.append(
+                inspect.Parameter(
+                    name="response",
+                    annotation=Response,
+                    kind=inspect.Parameter.KEYWORD_ONLY,
+                ),
+            )
+        parameters.extend(extra_params)
+        if parameters:
+            signature = signature.replace(parameters=parameters)
+        func.__signature__ = signature
+
+        @wraps(func)
+        async def inner(*args: P.args, **kwargs: P.kwargs) -> R:
+            async def ensure_async_func(*args: P.args, **kwargs: P.kwargs) -> R:
+                """Run cached sync functions in thread pool just like FastAPI."""
+                if not request_param:
+                    kwargs.pop("request", None)
+                if not response_param:
+                    kwargs.pop("response", None)
+
+                if inspect.iscoroutinefunction(func):
+                    return await func(*args, **kwargs)
+                else:
+                    return await run_in_threadpool(func, *args, **kwargs)
+
+            copy_kwargs = kwargs.copy()
+            request: Optional[Request] = copy_kwargs.pop("request", None)
+            response: Optional[Response] = copy_kwargs.pop("response", None)
+            if (
+                request
+                and request.headers.get("Cache-Control") in ("no-store", "no-cache")
+            ) or not FastAPICache.get_enable():
+                return await ensure_async_func(*args, **kwargs)
+            if request and request.method != "GET":
+                return await ensure_async_func(*args, **kwargs)
+
+            _coder = coder or FastAPICache.get_coder()
+            _expire = expire or FastAPICache.get_expire()
+            _key_builder = key_builder or FastAPICache.get_key_builder()
+            backend = FastAPICache.get_backend()
+
+            cache_key = _key_builder(
+                func,
+                namespace,
+                request=request,
+                response=response,
+                args=args,
+                kwargs=copy_kwargs,
+            )
+            if inspect.isawaitable(cache_key):
+                cache_key = await cache_key
+            if cache_key is None:  # key生成函数返回None(如匿名请求)时不使用缓存
+                return await ensure_async_func(*args, **kwargs)
+
+            # 先查一级缓存，未命中再查redis，
+            # 命中redis时按redis剩余的过期时间回填一级缓存。
+            # 一级缓存的大小在调用时读取，装饰路由函数时(导入模块时)不创建配置
+            use_local = local and local_cache.max_bytes > 0
+            hit = local_cache.get(cache_key) if use_local else None
+            if hit is not None:
+                ttl, ret = hit
+                _lookups["local_hit"] += 1
+            else:
+                try:
+                    ttl, ret = await backend.get_with_ttl(cache_key)
+                except Exception:
+                    logger.warning(
+                        f"Error retrieving cache key '{cache_key}' from backend"
+                    )
+                    ttl, ret = 0, None
+                    _lookups["error"] += 1
+                else:
+                    _lookups["miss" if ret is None else "hit"] += 1
+                if use_local and ret is not None:
+                    local_cache.set(cache_key, ret, ttl)
+
+            if ret is not None:
+                if response:
+                    response.headers["Cache-Control"] = f"max-age={ttl}"
+                    etag = f"W/{hash(ret)}"
+                    if request and request.headers.get("if-none-match") == etag:
+                        response.status_code = 304
+                        return response
+                    response.headers["ETag"] = etag
+                return _coder.decode(ret)
+
+            # 未命中：进程内合并同一个key的并发请求，
+            # 跨进程由分布式锁保证只有一个请求重建缓存
+            computed = []
+
+            async def compute() -> Union[str, bytes]:
+                ret = await ensure_async_func(*args, **kwargs)
+                computed.append(ret)
+                encoded_ret = _coder.encode(ret)
+                try:
+                    if _expire:
+                        await _set_with_tags(
+                            cache_key,
+                            encoded_ret,
+                            _expire,
+                            _resolve_tags(tags or (), copy_kwargs),
+                        )
+                    else:
+                        await backend.set(cache_key, encoded_ret, _expire)
+                except Exception:
+                    logger.warning(f"Error setting cache key '{cache_key}' in backend")
+                if use_local and _expire:
+                    if isinstance(encoded_ret, str):
+                        local_cache.set(cache_key, encoded_ret.encode(), _expire)
+                    else:
+                        local_cache.set(cache_key, encoded_ret, _expire)
+                return encoded_ret
+
+            if single_flight:
+                encoded_ret = await _single_flight(cache_key, backend, compute)
+            else:
+                encoded_ret = await compute()
+            ret = computed[0] if computed else _coder.decode(encoded_ret)
+
+            if response:
+                response.headers["Cache-Control"] = f"max-age={_expire}"
+                response.headers["ETag"] = f"W/{hash(encoded_ret)}"
+            return ret
 
+        return inner
 
-cache = cache
+    return wrapper
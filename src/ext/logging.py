@@ -6,12 +6,24 @@
 # @Description: 提供日志中间件
 
 import logging
+import random
+import sys
+import threading
+import traceback
 import uuid
-from contextvars import ContextVar
+from collections import Counter, deque
+from contextvars import ContextVar, Token
+from typing import TYPE_CHECKING, BinaryIO, Optional, TextIO
 
+import orjson
 from loguru import logger
 
 from src.config.common import EnvEnum, setting
+from src.config.logging import LogFormatEnum
+from src.config.logging import setting as log_setting
+
+if TYPE_CHECKING:
+    from loguru import Message
 
 _x_trace_id: ContextVar[str] = ContextVar("x_trace_id", default="")  # 追踪子任务
 _x_request_id: ContextVar[str] = ContextVar("x_request_id", default="")  # 追踪请求
@@ -29,43 +41,285 @@ class TraceID:
         return _x_request_id.get()
     
     @staticmethod
-    def set_trace_id(trace_id: str) -> ContextVar[str]:
+    def set_trace_id(trace_id: str) -> Token[str]:
         """设置trace_id"""
-        trace_id = trace_id or uuid.uuid4().hex()
+        trace_id = trace_id or uuid.uuid4().hex
         return _x_trace_id.set(trace_id)
 
     @staticmethod
-    def set_request_id(request_id: str) -> ContextVar[str]:
+    def set_request_id(request_id: str) -> Token[str]:
         """设置request_id"""
-        request_id = request_id or uuid.uuid4().hex()
+        request_id = request_id or uuid.uuid4().hex
         return _x_request_id.set(request_id)
 
+    @staticmethod
+    def reset(request_token: Token[str], trace_token: Token[str]) -> None:
+        """恢复为设置前的值"""
+        _x_request_id.reset(request_token)
+        _x_trace_id.reset(trace_token)
+
+
+class BufferedSink(object):
+    """
+    loguru日志输出端：日志先写入进程内有界环形缓冲区，由独立的写线程批量写到标准输出
+
+    - 调用线程做采样判断、loguru的消息格式化和入队，JSON序列化和IO在写线程完成。
+      loguru在调用线程中格式化异常堆栈(与format无关)，记录异常的日志在调用线程中开销较大
+    - 缓冲区占用超过`sampling_threshold`时，按级别的`sampling_rates`采样，
+      未配置的级别全部保留
+    - 缓冲区写满时丢弃最旧的日志，被采样和被丢弃的条数按级别计数，见`stats()`；
+      无法序列化和写出失败的日志分别计入`RENDER_ERROR`和`WRITE_ERROR`，不影响其他日志
+    - 未传入的参数在创建时读取日志配置
+    """
+
+    def __init__(
+        self,
+        serialize: bool = True,
+        buffer_size: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        flush_interval: Optional[float] = None,
+        sampling_threshold: Optional[float] = None,
+        sampling_rates: Optional[dict[str, float]] = None,
+        stream: Optional[BinaryIO] = None,
+    ):
+        if buffer_size is None:
+            buffer_size = log_setting.LOG_BUFFER_SIZE
+        if sampling_threshold is None:
+            sampling_threshold = log_setting.LOG_SAMPLING_THRESHOLD
+        self.serialize = serialize
+        self.batch_size = (
+            log_setting.LOG_BATCH_SIZE if batch_size is None else batch_size
+        )
+        self.flush_interval = (
+            log_setting.LOG_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        )
+        self.sampling_size = int(buffer_size * sampling_threshold)
+        if sampling_rates is None:
+            sampling_rates = log_setting.LOG_SAMPLING_RATES
+        self.sampling_rates = {
+            level.upper(): rate for level, rate in sampling_rates.items() if rate < 1
+        }
+        self._stream = (
+            stream or getattr(sys.stdout, "buffer", None) or _TextStream(sys.stdout)
+        )
+        # 元素为(级别名, loguru消息)，deque的append/popleft是线程安全的
+        self._buffer: deque[tuple[str, "Message"]] = deque(maxlen=buffer_size)
+        self._written = 0
+        self._sampled: Counter[str] = Counter()
+        self._dropped: Counter[str] = Counter()
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = threading.Thread(
+            target=self._run, name="log-writer", daemon=True
+        )
+        self._thread.start()
+
+    def filter(self, record: dict) -> bool:
+        """在调用线程中、格式化之前执行：补充追踪信息，高负载时按级别采样"""
+        record["request_id"] = _x_request_id.get()
+        record["trace_id"] = _x_trace_id.get()
+        if self.sampling_rates and len(self._buffer) >= self.sampling_size:
+            level = record["level"].name
+            rate = self.sampling_rates.get(level)
+            if rate is not None and random.random() >= rate:
+                self._sampled[level] += 1
+                return False
+        return True
+
+    def write(self, message: "Message") -> None:
+        buffer = self._buffer
+        if len(buffer) == buffer.maxlen:
+            # 写满时deque会挤掉最旧的一条
+            self._dropped[buffer[0][0]] += 1
+        buffer.append((message.record["level"].name, message))
+        if len(buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    def _render(self, message: "Message") -> bytes:
+        if not self.serialize:
+            return message.encode("utf-8", "replace")
+        record = message.record
+        data = {
+            "time": record["time"].isoformat(),
+            "level": record["level"].name,
+            "message": record["message"],
+            "request_id": record.get("request_id", ""),
+            "trace_id": record.get("trace_id", ""),
+            "logger": record["name"],
+            "function": record["function"],
+            "line": record["line"],
+            "process": record["process"].id,
+            "thread": record["thread"].name,
+        }
+        if record["extra"]:
+            data["extra"] = record["extra"]
+        exception = record["exception"]
+        if exception is not None:
+            data["exception"] = "".join(
+                traceback.format_exception(
+                    exception.type, exception.value, exception.traceback
+                )
+            )
+        try:
+            return orjson.dumps(data, default=str, option=orjson.OPT_APPEND_NEWLINE)
+        except TypeError:  # extra中有无法序列化的内容(如非字符串的key)
+            data["extra"] = repr(record["extra"])
+            return orjson.dumps(data, default=str, option=orjson.OPT_APPEND_NEWLINE)
+
+    def drain(self) -> None:
+        """把缓冲区中的日志全部写出，写线程和关闭流程都会调用"""
+        buffer, pop = self._buffer, self._buffer.popleft
+        with self._write_lock:
+            while buffer:
+                batch = []
+                for _ in range(self.batch_size):
+                    try:
+                        _, message = pop()
+                    except IndexError:
+                        break
+                    try:
+                        batch.append(self._render(message))
+                    except Exception:
+                        # 单条日志无法序列化(如含有孤立代理字符)时只丢弃该条
+                        self._dropped["RENDER_ERROR"] += 1
+                try:
+                    self._stream.write(b"".join(batch))
+                except Exception:  # 标准输出不可用时不能影响业务，只计数
+                    self._dropped["WRITE_ERROR"] += len(batch)
+                    continue
+                self._written += len(batch)
+            try:
+                self._stream.flush()
+            except Exception:
+                pass
+
+    def _run(self) -> None:
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.drain()
+            except Exception:  # 兜底：写线程退出后日志会一直堆积在缓冲区中
+                self._dropped["DRAIN_ERROR"] += 1
+        self.drain()
+
+    def stop(self) -> None:
+        """loguru移除该输出端时调用(包括进程退出时)，写出剩余日志后停止写线程"""
+        if self._stopped:
+            return
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+        self.drain()
+
+    def stats(self) -> dict:
+        return {
+            "buffered": len(self._buffer),
+            "capacity": self._buffer.maxlen,
+            "written": self._written,
+            "sampled": dict(self._sampled),
+            "dropped": dict(self._dropped),
+        }
+
+
+class _TextStream(object):
+    """标准输出没有二进制buffer时(如被测试框架替换)的适配"""
+
+    def __init__(self, stream: TextIO):
+        self._stream = stream
+
+    def write(self, data: bytes) -> None:
+        self._stream.write(data.decode("utf-8", "replace"))
+
+    def flush(self) -> None:
+        self._stream.flush()
+
+
+_sink: Optional[BufferedSink] = None
+
+
+def log_stats() -> dict:
+    """日志缓冲区的写出、采样和丢弃计数"""
+    return _sink.stats() if _sink is not None else {}
+
+
+def flush_log() -> None:
+    """立即写出缓冲区中的日志"""
+    if _sink is not None:
+        _sink.drain()
+
 
 class InterceptHandler(logging.Handler):
     """将logging的日志转换为loguru的日志"""
 
+    # 调用位置(文件, 行号) -> loguru需要回溯的栈帧层数，
+    # 同一调用位置经过的logging栈帧层数是固定的
+    _depths: dict[tuple[str, int], int] = {}
+    _MAX_CALL_SITES = 4096
+
     def emit(self, record):
         try:  # 获取真实日志级别
             level = logger.level(record.levelname).name
         except ValueError:
             level = record.levelno
 
-        # 从当前栈帧开始追溯，直到找到第一个不是logging模块的栈帧
-        # 2表示默认向上回溯两层，即当前代码所在的函数或方法的调用者栈帧
-        frame, depth = logging.currentframe(), 2
-        while frame.f_code.co_filename == logging.__file__:
-            frame = frame.f_back
-            depth += 1
+        key = (record.pathname, record.lineno)
+        depth = self._depths.get(key)
+        if depth is None:
+            # 从当前栈帧开始追溯，直到找到第一个不是logging模块的栈帧，即真正的调用者
+            frame, depth = sys._getframe(), 0
+            while frame and (
+                depth == 0 or frame.f_code.co_filename == logging.__file__
+            ):
+                frame = frame.f_back
+                depth += 1
+            if len(self._depths) >= self._MAX_CALL_SITES:
+                self._depths.clear()
+            self._depths[key] = depth
         # 调用loguru，记录日志信息
-        logger.opt(depth=(depth + 1), exception=record.exc_info).log(
+        logger.opt(depth=depth, exception=record.exc_info).log(
             level, record.getMessage()
         )
 
 
 def init_log() -> None:
+    global _sink
+
+    log_format = log_setting.LOG_FORMAT or (
+        LogFormatEnum.TEXT if setting.ENV is EnvEnum.LOCAL else LogFormatEnum.JSON
+    )
+    serialize = log_format is LogFormatEnum.JSON
+    sink = BufferedSink(serialize=serialize)
+    # 配置loguru输出格式，替换默认的handler(旧的输出端会被stop，剩余日志写出后退出)
+    logger.configure(
+        handlers=[
+            {
+                "sink": sink,
+                "level": "INFO" if setting.ENV is EnvEnum.PROD else "DEBUG",
+                "enqueue": False,  # 由BufferedSink的写线程异步写出，不再经过多进程队列
+                "backtrace": True
+                if setting.ENV != EnvEnum.PROD
+                else False,  # 开启错误追踪
+                "colorize": not serialize and sys.stdout.isatty(),
+                "filter": sink.filter,
+                "format": "{message}"  # JSON由BufferedSink序列化
+                if serialize
+                else (
+                    "{time:YYYY-MM-DD HH:mm:ss.SSS} | {level: <8} | "
+                    "{request_id} | {trace_id} | {name}:{function}:{line} - {message}"
+                ),
+            }
+        ]
+    )
+    _sink = sink
+
     # 拦截所有日志输出
     logging.root.handlers = [InterceptHandler()]
-    logging.root.setLevel(logging.INFO if setting.ENV == EnvEnum.PROD else logging.DEBUG)
+    logging.root.setLevel(
+        logging.INFO if setting.ENV == EnvEnum.PROD else logging.DEBUG
+    )
 
     # 移除相关的logger的handlers，使其使用root logger的handlers
     for name in logging.root.manager.loggerDict.keys():
@@ -0,0 +1,439 @@
+# -*- coding: utf-8 -*-
+# @Author: martinf fangjie.martin@gmail.com
+# @Date: 2026-10-18 23:58:21
+# @LastEditors: martinf fangjie.martin@gmail.com
+# @LastEditTime: 2026-10-18 23:58:21
+# @Description: 请求指标与Prometheus文本格式导出，支持多进程汇总
+
+import asyncio
+import os
+from bisect import bisect_left
+from pathlib import Path
+from typing import Any, Callable, Iterable, Optional
+
+import orjson
+from loguru import logger
+
+from src.config.monitor import setting
+
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+
+Labels = tuple[tuple[str, str], ...]
+
+
+class MetricFamily(object):
+    """
+    同名指标的所有样本。直方图样本的值为[各桶计数..., +Inf桶计数, 总和]，桶计数不累加
+    """
+
+    __slots__ = ("name", "kind", "help", "samples")
+
+    def __init__(self, name: str, kind: str, help: str):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.samples: dict[Labels, Any] = {}
+
+    def add(self, value: Any, **labels: str) -> "MetricFamily":
+        self.samples[tuple(labels.items())] = value
+        return self
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "kind": self.kind,
+            "help": self.help,
+            "samples": [
+                [list(labels), value] for labels, value in self.samples.items()
+            ],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "MetricFamily":
+        family = cls(data["name"], data["kind"], data["help"])
+        for labels, value in data["samples"]:
+            family.samples[tuple(tuple(label) for label in labels)] = value
+        return family
+
+
+class _RouteTiming(object):
+    __slots__ = ("counts", "sum")
+
+    def __init__(self, size: int):
+        self.counts = [0] * size
+        self.sum = 0.0
+
+
+class RequestMetrics(object):
+    """
+    按路由模板记录请求数(按状态码类别)、处理中的请求数和耗时直方图。
+    路由模板而不是实际路径作为标签，避免路径参数导致标签数量无限增长。
+    不指定buckets时在首次记录时读取METRICS_BUCKETS
+    """
+
+    def __init__(self, buckets: Optional[Iterable[float]] = None):
+        self._buckets = tuple(sorted(buckets)) if buckets is not None else None
+        self.in_progress = 0
+        self.requests: dict[tuple[str, str, str], int] = {}
+        self.timings: dict[tuple[str, str], _RouteTiming] = {}
+
+    @property
+    def buckets(self) -> tuple[float, ...]:
+        if self._buckets is None:
+            self._buckets = tuple(sorted(setting.METRICS_BUCKETS))
+        return self._buckets
+
+    def observe(
+        self, method: str, route: str, status_code: int, seconds: float
+    ) -> None:
+        key = (method, route, f"{status_code // 100}xx")
+        self.requests[key] = self.requests.get(key, 0) + 1
+        timing = self.timings.get((method, route))
+        if timing is None:
+            timing = self.timings.setdefault(
+                (method, route), _RouteTiming(len(self.buckets) + 1)
+            )
+        timing.counts[bisect_left(self.buckets, seconds)] += 1
+        timing.sum += seconds
+
+    def collect(self) -> list[MetricFamily]:
+        requests = MetricFamily("http_requests_total", COUNTER, "HTTP请求数")
+        for (method, route, status), count in list(self.requests.items()):
+            requests.add(count, method=method, route=route, status=status)
+        duration = MetricFamily(
+            "http_request_duration_seconds", HISTOGRAM, "HTTP请求耗时"
+        )
+        for (method, route), timing in list(self.timings.items()):
+            duration.add([*timing.counts, timing.sum], method=method, route=route)
+        in_progress = MetricFamily(
+            "http_requests_in_progress", GAUGE, "处理中的HTTP请求数"
+        )
+        in_progress.add(self.in_progress)
+        return [requests, duration, in_progress]
+
+
+request_metrics = RequestMetrics()
+
+
+def _redis_metrics() -> list[MetricFamily]:
+    from src.ext.redis import pool_stats
+
+    stats = pool_stats()
+    if not stats:
+        return []
+    return [
+        MetricFamily("redis_pool_max_connections", GAUGE, "redis连接池上限").add(
+            stats["max_connections"]
+        ),
+        MetricFamily("redis_pool_connections", GAUGE, "redis连接池中的连接数")
+        .add(stats["in_use"], state="in_use")
+        .add(stats["idle"], state="idle"),
+        MetricFamily("redis_pool_created_total", COUNTER, "redis连接创建次数").add(
+            stats["created_total"]
+        ),
+        MetricFamily("redis_pool_waits_total", COUNTER, "等待空闲redis连接的次数").add(
+            stats["wait_count"]
+        ),
+    ]
+
+
+def _database_metrics() -> list[MetricFamily]:
+    from src.ext.database import pool_stats
+
+    size = MetricFamily("db_pool_size", GAUGE, "数据库连接池大小")
+    connections = MetricFamily("db_pool_connections", GAUGE, "数据库连接池中的连接数")
+    for engine, stats in pool_stats().items():
+        size.add(stats["size"], engine=engine)
+        connections.add(stats["checked_out"], engine=engine, state="checked_out")
+        connections.add(stats["checked_in"], engine=engine, state="checked_in")
+        connections.add(stats["overflow"], engine=engine, state="overflow")
+    return [size, connections]
+
+
+def _cache_metrics() -> list[MetricFamily]:
+    from src.ext.interface_cache import cache_stats
+
+    stats = cache_stats()
+    lookups = MetricFamily("cache_lookups_total", COUNTER, "接口缓存查询次数")
+    for result, count in stats["lookups"].items():
+        lookups.add(count, result=result)
+    local = stats["local"]
+    return [
+        lookups,
+        MetricFamily("cache_local_bytes", GAUGE, "一级缓存占用字节数").add(
+            local["size"]
+        ),
+        MetricFamily("cache_local_entries", GAUGE, "一级缓存条目数").add(
+            local["entries"]
+        ),
+        MetricFamily("cache_local_evictions_total", COUNTER, "一级缓存淘汰次数").add(
+            local["evictions"]
+        ),
+    ]
+
+
+def _scheduler_metrics() -> list[MetricFamily]:
+    from src.tasks.scheduler import job_stats
+
+    families = [
+        MetricFamily(f"scheduler_job_{field}_total", COUNTER, help)
+        for field, help in (
+            ("runs", "定时任务执行次数"),
+            ("skipped", "定时任务因其他进程执行而跳过的次数"),
+            ("failures", "定时任务失败次数"),
+            ("overruns", "定时任务执行超过间隔的次数"),
+        )
+    ]
+    for job, stats in job_stats().items():
+        for family, field in zip(families, ("runs", "skipped", "failures", "overruns")):
+            family.add(stats[field], job=job)
+    return families
+
+
+def _lock_metrics() -> list[MetricFamily]:
+    from src.ext.distribute_lock import lease_stats
+
+    stats = lease_stats()
+    return [
+        MetricFamily("lock_leases", GAUGE, "续约中的分布式锁数量").add(stats["leases"]),
+        MetricFamily("lock_renewals_total", COUNTER, "分布式锁续约次数").add(
+            stats["renewals"]
+        ),
+        MetricFamily(
+            "lock_renewal_failures_total", COUNTER, "分布式锁续约失败次数"
+        ).add(stats["failures"]),
+        MetricFamily("lock_lost_total", COUNTER, "续约时发现已丢失的分布式锁数量").add(
+            stats["lost"]
+        ),
+    ]
+
+
+def _log_metrics() -> list[MetricFamily]:
+    from src.ext.logging import log_stats
+
+    stats = log_stats()
+    if not stats:
+        return []
+    sampled = MetricFamily("log_sampled_total", COUNTER, "高负载时被采样丢弃的日志条数")
+    for level, count in stats["sampled"].items():
+        sampled.add(count, level=level)
+    dropped = MetricFamily(
+        "log_dropped_total", COUNTER, "缓冲区写满等原因丢弃的日志条数"
+    )
+    for level, count in stats["dropped"].items():
+        dropped.add(count, level=level)
+    return [
+        MetricFamily("log_buffered", GAUGE, "缓冲区中等待写出的日志条数").add(
+            stats["buffered"]
+        ),
+        MetricFamily("log_written_total", COUNTER, "已写出的日志条数").add(
+            stats["written"]
+        ),
+        sampled,
+        dropped,
+    ]
+
+
+_collectors: list[Callable[[], list[MetricFamily]]] = [
+    request_metrics.collect,
+    _redis_metrics,
+    _database_metrics,
+    _cache_metrics,
+    _scheduler_metrics,
+    _lock_metrics,
+    _log_metrics,
+]
+
+
+def register_collector(collector: Callable[[], list[MetricFamily]]) -> None:
+    """注册额外的指标收集函数，收集函数在每次导出时调用"""
+    _collectors.append(collector)
+
+
+def collect() -> list[MetricFamily]:
+    """收集本进程的所有指标，单个收集函数出错不影响其他指标"""
+    families = []
+    for collector in _collectors:
+        try:
+            families.extend(collector())
+        except Exception:
+            logger.exception(f"Error collecting metrics from {collector.__name__}")
+    return families
+
+
+# ---------------------------- 多进程汇总 ----------------------------
+# 每个worker定期把自己的指标快照写入METRICS_MULTIPROC_DIR，导出时汇总目录下所有快照：
+# counter和histogram累加所有进程(包括已退出的进程，保证单调递增)，
+# gauge只累加存活的进程。
+# 目录需要在主进程启动前清空，否则会累加上一次运行的数据
+
+
+def _snapshot_path(directory: str, pid: int) -> Path:
+    return Path(directory) / f"metrics-{pid}.json"
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def write_snapshot(alive: bool = True) -> None:
+    """原子写入本进程的指标快照，alive为False表示进程正在退出，其gauge不再参与汇总"""
+    directory = setting.METRICS_MULTIPROC_DIR
+    if not directory:
+        return
+    pid = os.getpid()
+    path = _snapshot_path(directory, pid)
+    data = {"pid": pid, "alive": alive, "families": [f.to_dict() for f in collect()]}
+    tmp = path.with_suffix(".tmp")
+    tmp.write_bytes(orjson.dumps(data))
+    os.replace(tmp, path)
+
+
+def _read_snapshots(directory: str) -> Iterable[dict]:
+    current = os.getpid()
+    for path in Path(directory).glob("metrics-*.json"):
+        try:
+            data = orjson.loads(path.read_bytes())
+        except (OSError, orjson.JSONDecodeError):
+            continue
+        if data["pid"] != current:
+            yield data
+
+
+def _merge(
+    into: dict[str, MetricFamily], families: Iterable[MetricFamily], gauges: bool
+) -> None:
+    for family in families:
+        if family.kind == GAUGE and not gauges:
+            continue
+        target = into.get(family.name)
+        if target is None:
+            target = MetricFamily(family.name, family.kind, family.help)
+            into[family.name] = target
+        for labels, value in family.samples.items():
+            existing = target.samples.get(labels)
+            if existing is None:
+                if family.kind == HISTOGRAM:
+                    value = list(value)
+                target.samples[labels] = value
+            elif family.kind == HISTOGRAM and len(existing) == len(value):
+                target.samples[labels] = [a + b for a, b in zip(existing, value)]
+            elif family.kind != HISTOGRAM:
+                target.samples[labels] = existing + value
+
+
+def collect_all() -> list[MetricFamily]:
+    """本进程的实时指标，配置了多进程目录时再合并其他进程最近一次写入的快照"""
+    merged: dict[str, MetricFamily] = {}
+    _merge(merged, collect(), gauges=True)
+    directory = setting.METRICS_MULTIPROC_DIR
+    if directory:
+        for data in _read_snapshots(directory):
+            alive = data["alive"] and _pid_alive(data["pid"])
+            families = (MetricFamily.from_dict(f) for f in data["families"])
+            _merge(merged, families, gauges=alive)
+    return list(merged.values())
+
+
+def clear_snapshots(directory: Optional[str] = None) -> None:
+    """清空多进程目录中的快照，在主进程启动worker之前调用"""
+    directory = directory or setting.METRICS_MULTIPROC_DIR
+    if not directory:
+        return
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    for path in Path(directory).glob("metrics-*"):
+        path.unlink(missing_ok=True)
+
+
+_sync_task: Optional[asyncio.Task] = None
+
+
+async def _sync_snapshot() -> None:
+    while True:
+        await asyncio.sleep(setting.METRICS_SYNC_INTERVAL)
+        try:
+            await asyncio.to_thread(write_snapshot)
+        except Exception:
+            logger.exception("Error writing metrics snapshot")
+
+
+async def init_metrics() -> None:
+    """配置了多进程目录时，定期写入本进程的指标快照"""
+    global _sync_task
+    if _sync_task is not None:
+        return
+    if not setting.METRICS_ENABLED or not setting.METRICS_MULTIPROC_DIR:
+        return
+    Path(setting.METRICS_MULTIPROC_DIR).mkdir(parents=True, exist_ok=True)
+    await asyncio.to_thread(write_snapshot)
+    _sync_task = asyncio.create_task(_sync_snapshot())
+
+
+async def close_metrics() -> None:
+    """停止定期写入，写入最后一次快照，已退出进程的counter仍参与汇总"""
+    global _sync_task
+    if _sync_task is None:
+        return
+    _sync_task.cancel()
+    _sync_task = None
+    try:
+        await asyncio.to_thread(write_snapshot, False)
+    except Exception:
+        logger.exception("Error writing metrics snapshot")
+
+
+# ---------------------------- Prometheus文本格式 ----------------------------
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Labels, extra: str = "") -> str:
+    parts = [f'{key}="{_escape(str(value))}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def render(
+    families: Iterable[MetricFamily], buckets: Optional[Iterable[float]] = None
+) -> bytes:
+    """渲染为Prometheus文本格式(text/plain; version=0.0.4)"""
+    bounds = [_format_value(float(b)) for b in (buckets or request_metrics.buckets)]
+    bounds.append("+Inf")
+    lines = []
+    for family in families:
+        if not family.samples:
+            continue
+        lines.append(f"# HELP {family.name} {family.help}")
+        lines.append(f"# TYPE {family.name} {family.kind}")
+        name = family.name
+        for labels, value in family.samples.items():
+            if family.kind != HISTOGRAM:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                continue
+            *counts, total = value
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{name}_bucket{_format_labels(labels, le)} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+    lines.append("")
+    return "\n".join(lines).encode()
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+# @Author: martinf fangjie.martin@gmail.com
+# @Date: 2026-10-18 21:05:12
+# @LastEditors: martinf fangjie.martin@gmail.com
+# @LastEditTime: 2026-10-18 21:05:12
+# @Description: 分页：基于游标的keyset分页，以及`current=-1`时的流式响应
+
+import base64
+import binascii
+import datetime
+import decimal
+import typing
+import uuid
+
+import orjson
+from fastapi.responses import StreamingResponse
+from loguru import logger
+from sqlalchemy import Select, and_, false, inspect, or_
+from sqlalchemy.engine import Row
+from sqlalchemy.sql import ColumnElement
+
+from src.ext.constant import Page
+from src.ext.database import AsyncSessionLocal, get_session
+from src.ext.depends import PageInfo
+from src.ext.exceptions import BadRequest
+from src.ext.response import _OPTIONS, _SUCCESS_PREFIX, _default
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# 游标中的值经json序列化后类型会丢失，按列类型还原
+_PARSERS: dict[type, typing.Callable[[typing.Any], typing.Any]] = {
+    datetime.datetime: datetime.datetime.fromisoformat,
+    datetime.date: datetime.date.fromisoformat,
+    datetime.time: datetime.time.fromisoformat,
+    uuid.UUID: uuid.UUID,
+    decimal.Decimal: decimal.Decimal,
+}
+
+
+def encode_cursor(values: typing.Sequence[typing.Any]) -> str:
+    """把排序键的值编码为游标"""
+    data = orjson.dumps(list(values), default=_default, option=_OPTIONS)
+    return base64.urlsafe_b64encode(data).decode()
+
+
+def decode_cursor(cursor: str, keys: typing.Sequence[ColumnElement]) -> list:
+    """解析游标，并按排序键的列类型还原值"""
+    try:
+        values = orjson.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, ValueError):
+        raise BadRequest()
+    if not isinstance(values, list) or len(values) != len(keys):
+        raise BadRequest()
+
+    result = []
+    for key, value in zip(keys, values):
+        try:
+            parser = _PARSERS.get(key.type.python_type)
+        except NotImplementedError:
+            parser = None
+        if parser is not None and value is not None:
+            try:
+                value = parser(value)
+            except (TypeError, ValueError):
+                raise BadRequest()
+        result.append(value)
+    return result
+
+
+def _keyset_condition(
+    keys: typing.Sequence[ColumnElement],
+    values: typing.Sequence[typing.Any],
+    desc: bool,
+) -> ColumnElement:
+    """
+    展开为 (a > x) OR (a = x AND b > y) ...，
+    不使用行值比较是为了兼容不支持`(a, b) > (x, y)`的数据库
+    """
+    clauses = []
+    for i, key in enumerate(keys):
+        compare = key < values[i] if desc else key > values[i]
+        clauses.append(and_(*(keys[j] == values[j] for j in range(i)), compare))
+    return or_(*clauses) if clauses else false()
+
+
+def row_to_dict(row: Row) -> dict:
+    """查询结果转为dict：ORM实体取映射的列属性，其余按列名转换"""
+    if len(row) == 1:
+        state = inspect(row[0], raiseerr=False)
+        if state is not None and getattr(state, "mapper", None) is not None:
+            return {
+                attr.key: getattr(row[0], attr.key)
+                for attr in state.mapper.column_attrs
+            }
+    return row._asdict()
+
+
+async def paginate(
+    stmt: Select,
+    page: PageInfo,
+    keys: typing.Sequence[ColumnElement],
+    desc: bool = False,
+    ndjson: bool = False,
+) -> typing.Union[dict, StreamingResponse]:
+    """
+    分页查询，`keys`为排序键，需要能唯一确定一行(通常最后一个为主键)。
+
+    - 请求带`cursor`时使用keyset分页，从上一页最后一行之后开始读取，查询耗时与页码无关
+    - 不带`cursor`时按`current`做offset分页，兼容旧的调用方式
+    - `current=-1`时返回流式响应，见`stream_rows`
+
+    返回`{"items", "page_size", "next_cursor"}`，`next_cursor`为None表示没有下一页
+    """
+    if page.current == -1:
+        return stream_rows(stmt.order_by(*_order_by(keys, desc)), ndjson=ndjson)
+
+    stmt = stmt.order_by(*_order_by(keys, desc)).limit(page.page_size + 1)
+    if page.cursor:
+        values = decode_cursor(page.cursor, keys)
+        stmt = stmt.where(_keyset_condition(keys, values, desc))
+    else:
+        stmt = stmt.offset(page.offset)
+
+    result = await get_session().execute(stmt)
+    items = [row_to_dict(row) for row in result]
+
+    next_cursor = None
+    if len(items) > page.page_size:
+        items = items[: page.page_size]
+        next_cursor = encode_cursor([items[-1][key.key] for key in keys])
+    return {"items": items, "page_size": page.page_size, "next_cursor": next_cursor}
+
+
+def _order_by(keys: typing.Sequence[ColumnElement], desc: bool) -> list:
+    return [key.desc() if desc else key.asc() for key in keys]
+
+
+def stream_rows(
+    stmt: Select, ndjson: bool = False, chunk_size: int = Page.STREAM_CHUNK_SIZE
+) -> StreamingResponse:
+    """
+    流式返回查询结果：通过服务端游标(`stream_results`)每次读取`chunk_size`行，
+    序列化后立即写出，内存占用与总行数无关。
+
+    默认输出与普通接口相同的`{code, message, data: [...]}`结构，
+    `ndjson=True`时每行一个json对象。
+    响应头发出后无法再修改状态码，中途出错时记录日志并中断响应，客户端会收到不完整的内容
+    """
+    media_type = NDJSON_MEDIA_TYPE if ndjson else "application/json"
+    return StreamingResponse(
+        _iter_rows(stmt, ndjson, chunk_size), media_type=media_type
+    )
+
+
+async def _iter_rows(
+    stmt: Select, ndjson: bool, chunk_size: int
+) -> typing.AsyncIterator[bytes]:
+    # 响应体在依赖退出后才开始发送，不能使用请求级别的会话，单独创建一个
+    async with AsyncSessionLocal() as session:
+        try:
+            result = await session.stream(stmt.execution_options(yield_per=chunk_size))
+            if not ndjson:
+                yield _SUCCESS_PREFIX + b"["
+            first = True
+            async for partition in result.partitions():
+                rows = [
+                    orjson.dumps(row_to_dict(row), default=_default, option=_OPTIONS)
+                    for row in partition
+                ]
+                if ndjson:
+                    yield b"\n".join(rows) + b"\n"
+                else:
+                    yield (b"" if first else b",") + b",".join(rows)
+                first = False
+            if not ndjson:
+                yield b"]}"
+        except Exception:
+            logger.exception("Streaming query failed, response truncated")
+            raise
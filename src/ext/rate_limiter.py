@@ -5,20 +5,360 @@
 # @LastEditTime: 2023-09-11 17:57:17
 # @Description: 接口频率限制
 
+import asyncio
 import inspect
+import math
+import time
 from functools import wraps
-from typing import (Awaitable, Callable, List, Optional, ParamSpec, TypeVar,
-                    Union)
+from typing import (Awaitable, Callable, List, NamedTuple, Optional, ParamSpec,
+                    TypeVar, Union)
 
 from fastapi import Request
 from fastapi.concurrency import run_in_threadpool
-from slowapi import Limiter
+from limits import RateLimitItem
+from loguru import logger
+from redis.asyncio import Redis
+from redis.commands.core import AsyncScript
+from redis.exceptions import RedisError
+from slowapi.errors import RateLimitExceeded
 from slowapi.wrappers import Limit, LimitGroup
 from starlette.responses import Response
 
+from src.config.rate_limit import RateLimitStrategy, setting
+from src.ext.identity import get_identity
+from src.ext.redis import hash_tag, shared_client
+
 P = ParamSpec("P")
 R = TypeVar("R")
 
+# 使用redis服务端时间(ms)，
+# 各worker的时钟不一致时对同一个key的窗口和补充速度的判断仍然相同
+_LUA_NOW = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+"""
+
+# 滑动窗口计数：按上一个窗口的剩余占比加权，hash中只保存两个窗口的计数
+# KEYS[1]: 限流key
+# ARGV: 限制次数, 窗口大小(ms), 本次消耗
+# 返回: {是否通过, 剩余次数, 距离窗口重置的时间(ms), 服务端当前时间(ms)}
+_SLIDING_WINDOW_SCRIPT = _LUA_NOW + """
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local start = now - (now % window)
+local data = redis.call('HMGET', KEYS[1], 'start', 'cur', 'prev')
+local cur_start = tonumber(data[1]) or start
+local cur = tonumber(data[2]) or 0
+local prev = tonumber(data[3]) or 0
+if cur_start ~= start then
+    if start - cur_start == window then
+        prev = cur
+    else
+        prev = 0
+    end
+    cur = 0
+end
+local count = prev * (window - (now - start)) / window + cur
+local reset = start + window - now
+if count + cost > limit then
+    return {0, math.max(math.floor(limit - count), 0), reset, now}
+end
+cur = cur + cost
+redis.call('HSET', KEYS[1], 'start', start, 'cur', cur, 'prev', prev)
+redis.call('PEXPIRE', KEYS[1], window * 2)
+return {1, math.floor(limit - count - cost), reset, now}
+"""
+
+# 令牌桶：容量为限制次数，每个窗口匀速补满
+# KEYS[1]: 限流key
+# ARGV: 限制次数, 窗口大小(ms), 本次消耗
+# 返回: {是否通过, 剩余令牌数, 下一次可通过的等待时间(ms), 服务端当前时间(ms)}
+_TOKEN_BUCKET_SCRIPT = _LUA_NOW + """
+local capacity = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local rate = capacity / window
+local data = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(data[1]) or capacity
+local ts = tonumber(data[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], window)
+local reset = 0
+if tokens < cost then
+    reset = math.ceil((cost - tokens) / rate)
+end
+return {allowed, math.floor(tokens), reset, now}
+"""
+
+_SCRIPTS = {
+    RateLimitStrategy.SLIDING_WINDOW: _SLIDING_WINDOW_SCRIPT,
+    RateLimitStrategy.TOKEN_BUCKET: _TOKEN_BUCKET_SCRIPT,
+}
+
+
+class RateLimitResult(NamedTuple):
+    """一次限流检查的结果"""
+
+    limit: RateLimitItem
+    allowed: bool
+    remaining: int
+    reset_at: float  # 窗口重置的时间戳，单位秒
+    reset_after: float = 0.0  # 距离窗口重置的秒数，不受本机与redis时钟偏差的影响
+
+
+class RateLimiter:
+    """基于redis的异步限流引擎，每次检查只执行一个lua脚本，复用进程内共享的redis连接池"""
+
+    def __init__(self) -> None:
+        self._enabled: Optional[bool] = None
+        self._client: Optional[Redis] = None
+        self._scripts: dict[RateLimitStrategy, AsyncScript] = {}
+
+    @property
+    def enabled(self) -> bool:
+        """首次使用时读取RATE_LIMIT_ENABLED，导入模块时不创建配置"""
+        if self._enabled is None:
+            self._enabled = setting.RATE_LIMIT_ENABLED
+        return self._enabled
+
+    @enabled.setter
+    def enabled(self, value: bool) -> None:
+        self._enabled = value
+
+    def _script(self, strategy: RateLimitStrategy) -> AsyncScript:
+        client = shared_client()
+        if client is not self._client:
+            self._client = client
+            self._scripts = {k: client.register_script(v) for k, v in _SCRIPTS.items()}
+        return self._scripts[strategy]
+
+    @staticmethod
+    def key_for(limit: RateLimitItem, *identifiers: str) -> str:
+        """
+        `{RATE_LIMIT_PREFIX}:{路由}:{调用方}:{限制}`，
+        集群模式下`路由:调用方`作为hash tag，
+        同一个调用方在同一个路由上的各个限制(以及本地计数的各个窗口)位于同一个slot
+        """
+        return (
+            f"{setting.RATE_LIMIT_PREFIX}:{hash_tag(':'.join(identifiers))}:"
+            f"{limit.amount}/{limit.multiples}{limit.GRANULARITY.name}"
+        )
+
+    async def hit(
+        self,
+        limit: RateLimitItem,
+        *identifiers: str,
+        cost: int = 1,
+        strategy: Optional[RateLimitStrategy] = None,
+    ) -> RateLimitResult:
+        """
+        消耗cost次访问额度并返回检查结果，strategy默认使用配置`RATE_LIMIT_STRATEGY`。
+        窗口按redis服务端时间计算，重置时间同样以服务端时间为准
+        """
+        script = self._script(strategy or setting.RATE_LIMIT_STRATEGY)
+        allowed, remaining, reset, now = await script(
+            keys=[self.key_for(limit, *identifiers)],
+            args=[limit.amount, limit.get_expiry() * 1000, cost],
+        )
+        reset_at = (int(now) + int(reset)) / 1000
+        return RateLimitResult(
+            limit, bool(allowed), int(remaining), reset_at, int(reset) / 1000
+        )
+
+    async def check(
+        self,
+        request: Request,
+        endpoint: str,
+        limits: List[Limit],
+        strategy: Optional[RateLimitStrategy] = None,
+        local: Optional["LocalRateLimiter"] = None,
+    ) -> Optional[RateLimitResult]:
+        """
+        依次检查路由的所有限制，超过任一限制时抛出`RateLimitExceeded`，
+        返回剩余额度最少的检查结果，用于生成响应头。
+        传入`local`时使用本地计数的近似限流，不访问redis
+        """
+        current: Optional[RateLimitResult] = None
+        for lim in limits:
+            if lim.is_exempt:
+                continue
+            if lim.methods is not None and request.method.lower() not in lim.methods:
+                continue
+            limit_scope = endpoint
+            if lim.per_method:
+                limit_scope += f":{request.method}"
+
+            if "request" in inspect.signature(lim.key_func).parameters.keys():
+                limit_key = lim.key_func(request)
+            else:
+                limit_key = lim.key_func()
+            if not limit_key:
+                logger.error(
+                    f"Skipping limit: {lim.limit}. Empty value found in parameters."
+                )
+                continue
+
+            cost = lim.cost(request) if callable(lim.cost) else lim.cost
+            try:
+                if local is not None:
+                    result = await local.hit(
+                        lim.limit, limit_scope, limit_key, cost=cost
+                    )
+                else:
+                    result = await self.hit(
+                        lim.limit, limit_scope, limit_key, cost=cost, strategy=strategy
+                    )
+            except RedisError:
+                # 限流存储不可用时放行请求，避免redis故障导致接口整体不可用
+                logger.warning(
+                    f"Rate limit storage unreachable, skipping limit {lim.limit}"
+                )
+                continue
+            if not result.allowed:
+                logger.warning(
+                    f"ratelimit {lim.limit} ({limit_key}) exceeded at endpoint: "
+                    f"{limit_scope}"
+                )
+                raise RateLimitExceeded(lim)
+            if current is None or result.remaining < current.remaining:
+                current = result
+        return current
+
+    @staticmethod
+    def inject_headers(response: Response, current: Optional[RateLimitResult]) -> None:
+        """在响应头中返回限流信息，与slowapi的响应头保持一致"""
+        if not setting.RATE_LIMIT_HEADERS_ENABLED or current is None:
+            return
+        if not isinstance(response, Response):
+            raise Exception(
+                "parameter `response` must be an instance of "
+                "starlette.responses.Response"
+            )
+        response.headers.append("X-RateLimit-Limit", str(current.limit.amount))
+        response.headers.append("X-RateLimit-Remaining", str(current.remaining))
+        response.headers.append("X-RateLimit-Reset", str(math.ceil(current.reset_at)))
+        response.headers["Retry-After"] = str(max(math.ceil(current.reset_after), 0))
+
+
+class _LocalCounter:
+    """一个限流key在当前窗口内的计数"""
+
+    __slots__ = ("key", "window", "window_id", "pending", "synced")
+
+    def __init__(self, key: str, window: int, window_id: int) -> None:
+        self.key = key
+        self.window = window
+        self.window_id = window_id
+        self.pending = 0  # 本进程尚未同步到redis的计数
+        self.synced = 0  # 最近一次同步时redis中的全局计数
+
+
+class LocalRateLimiter:
+    """
+    本地优先的近似限流：在进程内按固定窗口计数，后台任务每隔`RATE_LIMIT_SYNC_INTERVAL`毫秒
+    通过一次pipeline把所有key的增量同步到redis，并取回全局计数。
+    每个进程未同步的计数不超过限制次数的`RATE_LIMIT_LOCAL_ERROR`倍，超过时立即同步，
+    因此全局最多超出 进程数 * RATE_LIMIT_LOCAL_ERROR * 限制次数
+    """
+
+    def __init__(self) -> None:
+        self._counters: dict[str, _LocalCounter] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def hit(
+        self, limit: RateLimitItem, *identifiers: str, cost: int = 1
+    ) -> RateLimitResult:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._sync_loop())
+
+        window = limit.get_expiry()
+        now = time.time()
+        window_id = int(now // window)
+        key = RateLimiter.key_for(limit, *identifiers)
+        counter = self._counters.get(key)
+        if counter is None or counter.window_id != window_id:
+            counter = self._counters[key] = _LocalCounter(key, window, window_id)
+        elif counter.pending >= max(
+            int(limit.amount * setting.RATE_LIMIT_LOCAL_ERROR), 1
+        ):
+            try:
+                await self.flush()
+            except RedisError:
+                # redis不可用时退化为单进程限流
+                logger.warning(
+                    "Rate limit storage unreachable, local counters not synchronized"
+                )
+
+        count = counter.synced + counter.pending
+        reset_at = (window_id + 1) * window
+        if count + cost > limit.amount:
+            remaining = max(limit.amount - count, 0)
+            return RateLimitResult(limit, False, remaining, reset_at, reset_at - now)
+        counter.pending += cost
+        remaining = limit.amount - count - cost
+        return RateLimitResult(limit, True, remaining, reset_at, reset_at - now)
+
+    async def flush(self) -> None:
+        """把本地计数批量同步到redis，并取回各个key的全局计数"""
+        window_id = {}
+        counters = []
+        for key, counter in list(self._counters.items()):
+            current = window_id.setdefault(
+                counter.window, int(time.time() // counter.window)
+            )
+            if counter.window_id != current:
+                del self._counters[key]  # 窗口已结束，redis中的计数也会随之过期
+            else:
+                counters.append(counter)
+        if not counters:
+            return
+
+        sent = []
+        pipe = shared_client().pipeline(transaction=False)
+        for counter in counters:
+            sent.append(counter.pending)
+            redis_key = f"{counter.key}:{counter.window_id}"
+            pipe.incrby(redis_key, counter.pending)
+            pipe.expire(redis_key, counter.window * 2)
+            counter.pending = 0
+        try:
+            results = await pipe.execute()
+        except RedisError:
+            for counter, pending in zip(counters, sent):
+                counter.pending += pending
+            raise
+        for counter, total in zip(counters, results[::2]):
+            counter.synced = int(total)
+
+    async def _sync_loop(self) -> None:
+        interval = setting.RATE_LIMIT_SYNC_INTERVAL / 1000
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush()
+            except RedisError:
+                logger.warning(
+                    "Rate limit storage unreachable, local counters not synchronized"
+                )
+
+    async def close(self) -> None:
+        """停止后台同步任务，并尽量把剩余的计数同步到redis"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        try:
+            await self.flush()
+        except RedisError:
+            pass
+        self._counters.clear()
+
 
 def _get_ipaddr(request: Request) -> str:
     if "x-forwarded-for" in request.headers:
@@ -31,7 +371,18 @@ def _get_ipaddr(request: Request) -> str:
     return addr
 
 
-_limiter = Limiter(key_func=_get_ipaddr)
+def get_user_key(request: Request) -> str:
+    """按用户限流：读取`IdentityMiddleware`解析好的用户ID，没有时退化为按IP"""
+    return get_identity().user_id or _get_ipaddr(request)
+
+
+_limiter = RateLimiter()
+_local_limiter = LocalRateLimiter()
+
+
+async def close_rate_limiter() -> None:
+    """在lifespan关闭时调用，同步本地计数"""
+    await _local_limiter.close()
 
 
 def http_limit(
@@ -43,6 +394,8 @@ def http_limit(
     exempt_when: Optional[Callable[..., bool]] = None,
     cost: Union[int, Callable[..., int]] = 1,
     override_defaults: bool = True,
+    strategy: Optional[RateLimitStrategy] = None,
+    local: bool = False,
 ):
     """
     限制HTTP路由函数的访问频率
@@ -54,16 +407,27 @@ def http_limit(
     * **exempt_when**: 豁免函数，返回True时不限制
     * **cost**: 每次请求的消耗
     * **override_defaults**: 是否覆盖默认配置
+    * **strategy**: 限流算法，默认使用配置`RATE_LIMIT_STRATEGY`
+    * **local**: 是否使用本地计数的近似限流(固定窗口)，定期批量同步到redis，
+      适用于高QPS接口
     """
     def wrapper(func: Callable[P, Awaitable[R]]) -> Callable[P, Awaitable[R]]:
         """为路由函数注入request和response参数"""
         signature = inspect.signature(func)
         request_param = next(
-            (param for param in signature.parameters.values() if param.annotation is Request),
+            (
+                param
+                for param in signature.parameters.values()
+                if param.annotation is Request
+            ),
             None,
         )
         response_param = next(
-            (param for param in signature.parameters.values() if param.annotation is Response),
+            (
+                param
+                for param in signature.parameters.values()
+                if param.annotation is Response
+            ),
             None,
         )
         parameters = []
@@ -96,7 +460,7 @@ def http_limit(
 
         _scope = None
 
-        keyfunc = key_func or _limiter._key_func
+        keyfunc = key_func or _get_ipaddr
         name = f"{func.__module__}.{func.__name__}"
         dynamic_limit = None
         static_limits: List[Limit] = []
@@ -128,23 +492,24 @@ def http_limit(
                     )
                 )
             except ValueError as e:
-                _limiter.logger.error(
-                    "Failed to configure throttling for %s (%s)",
-                    name,
-                    e,
-                )
-        _limiter._Limiter__marked_for_limiting.setdefault(name, []).append(func)
-        if dynamic_limit:
-            _limiter._dynamic_route_limits.setdefault(name, []).append(dynamic_limit)
-        else:
-            _limiter._route_limits.setdefault(name, []).extend(static_limits)
+                logger.error(f"Failed to configure throttling for {name} ({e})")
+
+        def route_limits(request: Request) -> List[Limit]:
+            if not dynamic_limit:
+                return static_limits
+            try:
+                return list(dynamic_limit.with_request(request))
+            except ValueError as e:
+                logger.error(f"failed to load ratelimit for view function {name} ({e})")
+                return []
 
         @wraps(func)
         async def inner(*args: P.args, **kwargs: P.kwargs) -> R:
             async def ensure_async_func(*args: P.args, **kwargs: P.kwargs) -> R:
                 """Run cached sync functions in thread pool just like FastAPI."""
-                # if the wrapped function does NOT have request or response in its function signature,
-                # make sure we don't pass them in as keyword arguments
+                # if the wrapped function does NOT have request or response in its
+                # function signature, make sure we don't pass them in as keyword
+                # arguments
                 if not request_param:
                     kwargs.pop("request", None)
                 if not response_param:
@@ -154,36 +519,40 @@ def http_limit(
                     return await func(*args, **kwargs)
                 else:
                     return await run_in_threadpool(func, *args, **kwargs)
-                
+
+            current = None
             if _limiter.enabled:
-                copy_kwargs = kwargs.copy()
-                request: Optional[Request] = copy_kwargs.pop("request", None)
-                    
+                request: Optional[Request] = kwargs.get("request", None)
+
                 if not isinstance(request, Request):
                     raise Exception(
-                        "parameter `request` must be an instance of starlette.requests.Request"
+                        "parameter `request` must be an instance of "
+                        "starlette.requests.Request"
                     )
 
-                if _limiter._auto_check and not getattr(
-                    request.state, "_rate_limiting_complete", False
-                ):
-                    _limiter._check_request_limit(request, func, False)
+                if not getattr(request.state, "_rate_limiting_complete", False):
+                    current = await _limiter.check(
+                        request,
+                        name,
+                        route_limits(request),
+                        strategy,
+                        _local_limiter if local else None,
+                    )
                     request.state._rate_limiting_complete = True
+                    request.state.view_rate_limit = current
 
             response = await ensure_async_func(*args, **kwargs)
-            
-            if _limiter.enabled:
+
+            if current is not None:
                 if not isinstance(response, Response):
                     # get the response object from the decorated endpoint function
-                    _limiter._inject_headers(
-                        kwargs.get("response"), request.state.view_rate_limit  # type: ignore
+                    _limiter.inject_headers(
+                        kwargs.get("response"), current  # type: ignore
                     )
                 else:
-                    _limiter._inject_headers(
-                        response, request.state.view_rate_limit
-                    )
+                    _limiter.inject_headers(response, current)
             return response
-        
+
         return inner
-    
-    return wrapper
\ No newline at end of file
+
+    return wrapper
@@ -5,17 +5,201 @@
 # @LastEditTime: 2023-09-13 16:08:25
 # @Description: redis 客户端
 
-import redis
+import time
+from collections import deque
+from typing import Iterable, Optional, Union
+
+from redis.asyncio import BlockingConnectionPool, Redis, RedisCluster
+from redis.crc import key_slot
 
 from src.config.redis import setting
 
 
-async def get_client() -> redis.asyncio.Redis:
-    pool = redis.asyncio.ConnectionPool.from_url(
-        str(setting.REDIS_URL), 
-        encoding="utf8",
-        max_connections=setting.REDIS_POOL_SIZE
-        )
-    client = redis.asyncio.Redis(connection_pool=pool)
+class MetricsConnectionPool(BlockingConnectionPool):
+    """带统计信息的阻塞连接池，连接耗尽时等待而不是直接报错"""
+
+    # 计算连接创建速率的时间窗口，单位秒
+    CREATION_WINDOW = 60
+
+    def reset(self):
+        super().reset()
+        # 已借出的连接：get_connection中连接失败时父类会先release再抛出异常，
+        # 此时连接还没有计入，按连接对象记录可以避免使用中的数量漂移
+        self._checked_out: set = set()
+        self._created_total = 0
+        self._created_at: deque = deque()
+        self._wait_count = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def make_connection(self):
+        self._created_total += 1
+        self._created_at.append(time.monotonic())
+        return super().make_connection()
+
+    async def get_connection(self, command_name, *keys, **options):
+        start = time.perf_counter()
+        connection = await super().get_connection(command_name, *keys, **options)
+        wait = time.perf_counter() - start
+        self._checked_out.add(connection)
+        self._wait_count += 1
+        self._wait_total += wait
+        if wait > self._wait_max:
+            self._wait_max = wait
+        return connection
+
+    async def release(self, connection):
+        self._checked_out.discard(connection)
+        await super().release(connection)
+
+    def stats(self) -> dict:
+        """连接池统计：使用中、空闲、等待耗时、创建速率"""
+        now = time.monotonic()
+        while self._created_at and now - self._created_at[0] > self.CREATION_WINDOW:
+            self._created_at.popleft()
+        in_use = len(self._checked_out)
+        return {
+            "max_connections": self.max_connections,
+            "created": len(self._connections),
+            "in_use": in_use,
+            "idle": max(len(self._connections) - in_use, 0),
+            "created_total": self._created_total,
+            "creation_rate": len(self._created_at) / self.CREATION_WINDOW,
+            "wait_count": self._wait_count,
+            "wait_avg_ms": (self._wait_total / self._wait_count * 1000)
+            if self._wait_count
+            else 0.0,
+            "wait_max_ms": self._wait_max * 1000,
+        }
+
+
+def is_cluster() -> bool:
+    """REDIS_URL使用redis+cluster://或rediss+cluster://时为集群模式"""
+    return setting.REDIS_URL.scheme.endswith("+cluster")
+
+
+def _node_url() -> str:
+    """去掉集群标记后的连接串，集群模式下用于连接REDIS_URL中的节点"""
+    return str(setting.REDIS_URL).replace("+cluster://", "://", 1)
+
+
+def hash_tag(key: str) -> str:
+    """
+    集群模式下为key加上hash tag：集群按key中第一个`{...}`内的部分计算slot，
+    以同一个hash tag开头的key在同一个slot，可以在同一个lua脚本中访问。
+    key中已经有hash tag时原样返回；单机模式下原样返回，key与升级前保持一致
+    """
+    if not is_cluster():
+        return key
+    start = key.find("{")
+    if start != -1 and key.find("}", start + 1) > start + 1:
+        return key
+    return f"{{{key}}}"
+
+
+def group_by_slot(keys: Iterable[str]) -> list[list[str]]:
+    """按slot分组，单机模式下所有key为一组"""
+    keys = list(keys)
+    if not is_cluster():
+        return [keys] if keys else []
+    groups: dict[int, list[str]] = {}
+    for key in keys:
+        groups.setdefault(key_slot(key.encode()), []).append(key)
+    return list(groups.values())
+
+
+_pool: Optional[MetricsConnectionPool] = None
+_client: Optional[Union[Redis, RedisCluster]] = None
+_pubsub_client: Optional[Redis] = None
+
+
+def shared_client() -> Union[Redis, RedisCluster]:
+    """
+    获取进程内共享的redis客户端，首次调用时创建连接池(不会建立连接)。
+    集群模式下返回`RedisCluster`，由它为每个节点维护连接并按slot路由命令
+    """
+    global _pool, _client
+    if _client is None:
+        if is_cluster():
+            # 集群客户端的连接数达到上限时直接报错而不是等待，因此不设置上限
+            _client = RedisCluster.from_url(_node_url(), encoding="utf8")
+        else:
+            _pool = MetricsConnectionPool.from_url(
+                str(setting.REDIS_URL),
+                encoding="utf8",
+                max_connections=setting.REDIS_POOL_SIZE,
+                timeout=setting.REDIS_POOL_TIMEOUT,
+            )
+            _client = Redis(connection_pool=_pool)
+    return _client
+
+
+def is_shared_client(client: Union[Redis, RedisCluster]) -> bool:
+    """是否为进程内共享的redis客户端，不会创建客户端"""
+    return client is not None and client is _client
+
+
+def pubsub_client() -> Redis:
+    """
+    发布订阅使用的客户端：单机模式下就是共享客户端。
+    集群客户端不支持发布订阅，此时单独连接REDIS_URL中的节点，
+    集群内PUBLISH的消息会广播到所有节点，订阅任一节点即可收到
+    """
+    global _pubsub_client
+    if not is_cluster():
+        return shared_client()
+    if _pubsub_client is None:
+        _pubsub_client = Redis.from_url(_node_url(), encoding="utf8")
+    return _pubsub_client
+
+
+async def init_client() -> Union[Redis, RedisCluster]:
+    """在lifespan启动时调用：创建共享客户端并检查连通性"""
+    client = shared_client()
     await client.ping()
     return client
+
+
+async def get_client() -> Union[Redis, RedisCluster]:
+    """获取共享的redis客户端，调用方不要关闭"""
+    return shared_client()
+
+
+async def close_client() -> None:
+    """在lifespan关闭时调用：关闭共享客户端并断开连接池中的所有连接"""
+    global _pool, _client, _pubsub_client
+    if _pubsub_client is not None:
+        await _pubsub_client.close()
+        _pubsub_client = None
+    if _client is None:
+        return
+    await _client.close()
+    if _pool is not None:
+        await _pool.disconnect()
+    _pool, _client = None, None
+
+
+def pool_stats() -> dict:
+    """共享连接池的统计信息，未初始化时返回空字典"""
+    if isinstance(_client, RedisCluster):
+        return _cluster_stats(_client)
+    return _pool.stats() if _pool is not None else {}
+
+
+def _cluster_stats(client: RedisCluster) -> dict:
+    """集群模式下汇总各节点的连接数，max_connections为0表示不限制"""
+    nodes = client.get_nodes()
+    created = sum(len(node._connections) for node in nodes)
+    idle = sum(len(node._free) for node in nodes)
+    return {
+        "nodes": len(nodes),
+        "max_connections": 0,
+        "created": created,
+        "in_use": created - idle,
+        "idle": idle,
+        "created_total": created,
+        "creation_rate": 0.0,
+        "wait_count": 0,
+        "wait_avg_ms": 0.0,
+        "wait_max_ms": 0.0,
+    }
@@ -7,8 +7,17 @@
 
 import typing
 
-from fastapi.responses import JSONResponse
+import orjson
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel, Field
+from starlette.background import BackgroundTask
+
+SUCCESS_CODE = 0
+SUCCESS_MESSAGE = "成功"
+
+# 成功响应的公共前缀，只需要拼接data部分
+_SUCCESS_PREFIX = b'{"code":0,"message":' + orjson.dumps(SUCCESS_MESSAGE) + b',"data":'
 
 
 class BaseResponse(BaseModel):
@@ -17,8 +26,55 @@ class BaseResponse(BaseModel):
     data: typing.Any = Field(description="数据")
 
 
-class APIResponse(JSONResponse):
-    def __init__(self, status_code: int, api_code: int, message: str,  data: str | dict = None):
-        super(APIResponse,self).__init__(
-            {"code": api_code, "message": message, "data": data}, status_code=status_code
+# 与标准库json一致：非字符串的key(int、UUID等)转为字符串，而不是抛出TypeError
+_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+def _default(obj: typing.Any) -> typing.Any:
+    """orjson无法直接序列化的类型：pydantic模型转为dict，其余交给FastAPI的jsonable_encoder"""
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    return jsonable_encoder(obj)
+
+
+def dumps_envelope(
+    data: typing.Any, api_code: int = SUCCESS_CODE, message: str = SUCCESS_MESSAGE
+) -> bytes:
+    """
+    把数据序列化为`{code, message, data}`结构，datetime、UUID等类型由orjson直接处理
+    """
+    if api_code == SUCCESS_CODE and message == SUCCESS_MESSAGE:
+        body = orjson.dumps(data, default=_default, option=_OPTIONS)
+        return _SUCCESS_PREFIX + body + b"}"
+    return orjson.dumps(
+        {"code": api_code, "message": message, "data": data},
+        default=_default,
+        option=_OPTIONS,
+    )
+
+
+class APIResponse(Response):
+    media_type = "application/json"
+
+    def __init__(
+        self,
+        http_status_code: int = 200,
+        api_code: int = SUCCESS_CODE,
+        message: str = SUCCESS_MESSAGE,
+        data: typing.Any = None,
+        headers: typing.Optional[typing.Mapping[str, str]] = None,
+        background: typing.Optional[BackgroundTask] = None,
+    ):
+        super(APIResponse, self).__init__(
+            dumps_envelope(data, api_code, message),
+            status_code=http_status_code,
+            headers=headers,
+            background=background,
         )
+
+
+class EnvelopeResponse(JSONResponse):
+    """作为FastAPI的`default_response_class`：把路由函数的返回值包装为统一的响应结构"""
+
+    def render(self, content: typing.Any) -> bytes:
+        return dumps_envelope(content)
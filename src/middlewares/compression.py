@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+# @Author: martinf fangjie.martin@gmail.com
+# @Date: 2026-10-18 21:40:26
+# @LastEditors: martinf fangjie.martin@gmail.com
+# @LastEditTime: 2026-10-18 21:40:26
+# @Description: 响应压缩中间件，支持zstd/brotli/gzip
+
+import typing
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src.config.compression import setting
+
+try:
+    import brotli
+except ImportError:  # 未安装时不提供br编码
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # 未安装时不提供zstd编码
+    zstandard = None
+
+
+class GzipCompressor(object):
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+
+    def compress(self, data: bytes) -> bytes:
+        # SYNC_FLUSH：每个分块压缩后立即输出，流式响应不会被缓冲
+        compressor = self._compressor
+        return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliCompressor(object):
+    def __init__(self, level: int):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class ZstdCompressor(object):
+    def __init__(self, level: int):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(
+            zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        )
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+# 编码 -> (压缩器, 默认级别的配置项)，按服务端优先级排列，级别在创建中间件时读取
+_COMPRESSORS: dict[str, tuple[typing.Callable[[int], typing.Any], str]] = {}
+if zstandard is not None:
+    _COMPRESSORS["zstd"] = (ZstdCompressor, "COMPRESSION_ZSTD_LEVEL")
+if brotli is not None:
+    _COMPRESSORS["br"] = (BrotliCompressor, "COMPRESSION_BROTLI_QUALITY")
+_COMPRESSORS["gzip"] = (GzipCompressor, "COMPRESSION_GZIP_LEVEL")
+
+
+class CompressionOptions(typing.NamedTuple):
+    """路由级别的压缩配置，未设置的项使用全局配置"""
+
+    enabled: bool = True
+    levels: typing.Mapping[str, int] = {}
+    minimum_size: typing.Optional[int] = None
+
+
+def compression(
+    enabled: bool = True,
+    gzip_level: typing.Optional[int] = None,
+    brotli_quality: typing.Optional[int] = None,
+    zstd_level: typing.Optional[int] = None,
+    minimum_size: typing.Optional[int] = None,
+):
+    """
+    路由级别的压缩配置，需要放在路由装饰器下面
+
+    @router.get("/export")
+    @compression(zstd_level=10, gzip_level=9)
+    async def export(): ...
+    """
+    levels = {
+        coding: level
+        for coding, level in (
+            ("gzip", gzip_level),
+            ("br", brotli_quality),
+            ("zstd", zstd_level),
+        )
+        if level is not None
+    }
+    options = CompressionOptions(enabled, levels, minimum_size)
+
+    def decorator(func):
+        func.__compression__ = options
+        return func
+
+    return decorator
+
+
+def _negotiate(accept_encoding: str) -> typing.Optional[str]:
+    """按服务端优先级选择客户端接受(q不为0)的编码"""
+    accepted = set()
+    for item in accept_encoding.lower().split(","):
+        coding, _, params = item.strip().partition(";")
+        params = params.replace(" ", "")
+        if params.startswith("q=") and not params[2:].strip("0.").strip():
+            continue
+        accepted.add(coding.strip())
+    for coding in _COMPRESSORS:
+        if coding in accepted or "*" in accepted:
+            return coding
+    return None
+
+
+class CompressionMiddleware:
+    """
+    纯ASGI响应压缩中间件
+
+    - 根据Accept-Encoding协商zstd/brotli/gzip
+    - 小于`minimum_size`的响应、已经设置Content-Encoding的响应
+      以及已压缩格式(图片、压缩包等)不压缩
+    - 流式响应逐块压缩并立即发送，不会缓冲整个响应体
+    - 路由可以通过`compression`装饰器调整压缩级别、阈值或关闭压缩
+    - 未传入的参数使用全局配置，starlette在应用收到第一个请求(或lifespan)时才创建中间件
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: typing.Optional[int] = None,
+        excluded_types: typing.Optional[typing.Sequence[str]] = None,
+        levels: typing.Optional[typing.Mapping[str, int]] = None,
+    ) -> None:
+        self.app = app
+        self.minimum_size = (
+            setting.COMPRESSION_MINIMUM_SIZE if minimum_size is None else minimum_size
+        )
+        if excluded_types is None:
+            excluded_types = setting.COMPRESSION_EXCLUDED_TYPES
+        self.excluded_types = tuple(excluded_types)
+        self.levels = {
+            coding: getattr(setting, name) for coding, (_, name) in _COMPRESSORS.items()
+        }
+        self.levels.update(levels or {})
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+        coding = _negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if coding is None:
+            await self.app(scope, receive, send)
+            return
+        await _CompressionResponder(self, coding, scope, send).run(receive)
+
+
+class _CompressionResponder(object):
+    def __init__(
+        self, middleware: CompressionMiddleware, coding: str, scope: Scope, send: Send
+    ):
+        self.middleware = middleware
+        self.coding = coding
+        self.scope = scope
+        self.send = send
+        self.start_message: typing.Optional[Message] = None
+        self.compressor = None
+        self.passthrough = False
+
+    async def run(self, receive: Receive) -> None:
+        await self.middleware.app(self.scope, receive, self.send_wrapper)
+
+    def _options(self) -> CompressionOptions:
+        # 路由匹配后starlette会把endpoint写入同一个scope
+        endpoint = self.scope.get("endpoint")
+        return getattr(endpoint, "__compression__", None) or CompressionOptions()
+
+    def _should_compress(self, headers: Headers, options: CompressionOptions) -> bool:
+        if not options.enabled or "content-encoding" in headers:
+            return False
+        status = self.start_message["status"]
+        if status < 200 or status in (204, 304):
+            return False
+        content_type = headers.get("content-type", "").lower()
+        return not content_type.startswith(self.middleware.excluded_types)
+
+    async def send_wrapper(self, message: Message) -> None:
+        if self.passthrough:
+            await self.send(message)
+            return
+
+        if message["type"] == "http.response.start":
+            # 等到第一个响应体分块才能决定是否压缩
+            self.start_message = message
+            options = self._options()
+            headers = Headers(raw=message["headers"])
+            if not self._should_compress(headers, options):
+                self.passthrough = True
+                await self.send(message)
+            return
+
+        if message["type"] != "http.response.body":
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.compressor is None:
+            options = self._options()
+            minimum_size = (
+                self.middleware.minimum_size
+                if options.minimum_size is None
+                else options.minimum_size
+            )
+            if not more_body and len(body) < minimum_size:
+                self.passthrough = True
+                await self.send(self.start_message)
+                await self.send(message)
+                return
+
+            factory = _COMPRESSORS[self.coding][0]
+            level = options.levels.get(self.coding, self.middleware.levels[self.coding])
+            self.compressor = factory(level)
+            headers = MutableHeaders(raw=self.start_message["headers"])
+            headers["Content-Encoding"] = self.coding
+            headers.add_vary_header("Accept-Encoding")
+            if more_body:
+                del headers["Content-Length"]
+            else:
+                body = self.compressor.compress(body) + self.compressor.finish()
+                headers["Content-Length"] = str(len(body))
+                await self.send(self.start_message)
+                await self.send({"type": "http.response.body", "body": body})
+                return
+            await self.send(self.start_message)
+
+        data = self.compressor.compress(body) if body else b""
+        if not more_body:
+            data += self.compressor.finish()
+        if data or not more_body:
+            await self.send(
+                {"type": "http.response.body", "body": data, "more_body": more_body}
+            )
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# @Author: martinf fangjie.martin@gmail.com
+# @Date: 2026-10-18 22:10:37
+# @LastEditors: martinf fangjie.martin@gmail.com
+# @LastEditTime: 2026-10-18 22:10:37
+# @Description: 请求身份信息中间件
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from src.ext.identity import Identity, reset_identity, set_identity
+
+
+class IdentityMiddleware:
+    """
+    纯ASGI实现：每个请求解析一次身份请求头，写入上下文变量和`request.state.identity`，
+    请求结束后恢复上下文变量
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        identity = Identity.from_scope(scope)
+        scope.setdefault("state", {})["identity"] = identity
+        token = set_identity(identity)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            reset_identity(token)
@@ -6,28 +6,23 @@
 # @Description: 提供日志中间件
 
 import logging
-import sys
-import uuid
+import time
 
 from loguru import logger
-from starlette.middleware.base import (BaseHTTPMiddleware,
-                                       RequestResponseEndpoint)
-from starlette.requests import Request
-from starlette.responses import Response
-from starlette.types import ASGIApp
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
-from src.config.common import EnvEnum, setting
 from src.ext.logging import TraceID
 
 
-def _log_filter(record: dict):
-    """日志过滤器"""
-    record["trace_msg"] = f"{TraceID.get_request_id()} | {TraceID.get_trace_id()}"
-    return record["trace_msg"]
+class LoguruLoggerWithRequestIDMiddleware:
+    """
+    Loguru logger middleware with request id.
 
-
-class LoguruLoggerWithRequestIDMiddleware(BaseHTTPMiddleware):
-    """Loguru logger middleware with request id."""
+    纯ASGI实现：设置请求的request_id/trace_id，在响应头中回写request_id，
+    请求结束后记录一条包含耗时的访问日志。不会像`BaseHTTPMiddleware`那样额外创建任务和内存流，
+    流式响应可以正常透传。
+    """
 
     def __init__(
         self, app: ASGIApp, header: str = "X-Request-ID", level=logging.DEBUG
@@ -37,35 +32,44 @@ class LoguruLoggerWithRequestIDMiddleware(BaseHTTPMiddleware):
         :param header: request header name
         :param level: log level
         """
-        super().__init__(app)
-        logger.remove()  # 移除默认的logger
-
+        self.app = app
         self.header = header
+        self._header_key = header.lower().encode("latin-1")
+        self.level = logging.getLevelName(level) if isinstance(level, int) else level
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = ""
+        for key, value in scope["headers"]:
+            if key == self._header_key:
+                request_id = value.decode("latin-1")
+                break
+        request_token = TraceID.set_request_id(request_id)
+        request_id = TraceID.get_request_id()
+        trace_token = TraceID.set_trace_id(request_id)
+        scope.setdefault("state", {})["request_id"] = request_id
+
+        status_code = 500
+        start = time.perf_counter()
 
-        # 配置logger输出格式
-        logger.configure(
-            handlers=[
-                {
-                    "sink": sys.stdout,
-                    "level": "INFO" if setting.ENV is EnvEnum.PROD else "DEBUG",
-                    "encoding": "utf-8",
-                    "enqueue": True,  # 开启异步
-                    "backtrace": True
-                    if setting.ENV != EnvEnum.PROD
-                    else False,  # 开启错误追踪
-                    "filter": _log_filter,
-                    "format": (
-                        "{time:YYYY-MM-DD HH:mm:ss.SSS} | {level: <8} | {trace_msg} | "
-                        "{name}:{function}:{line} - {message}"
-                    ),
-                }
-            ]
-        )
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                MutableHeaders(scope=message).append(self.header, request_id)
+            await send(message)
 
-    async def dispatch(
-        self, request: Request, call_next: RequestResponseEndpoint
-    ) -> Response:
-        request_id = request.headers.get(self.header, uuid.uuid4())
-        TraceID.set_request_id(request_id)
-        request.state.request_id = request_id
-        return await call_next(request)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            identity = scope["state"].get("identity")
+            logger.log(
+                self.level,
+                f'{scope["method"]} {scope["path"]} {status_code} '
+                f"{(time.perf_counter() - start) * 1000:.2f}ms"
+                + (f" user:{identity.user_id}" if identity else ""),
+            )
+            TraceID.reset(request_token, trace_token)
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# @Author: martinf fangjie.martin@gmail.com
+# @Date: 2026-10-18 23:58:21
+# @LastEditors: martinf fangjie.martin@gmail.com
+# @LastEditTime: 2026-10-18 23:58:21
+# @Description: 请求指标中间件
+from time import perf_counter
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src.ext.metrics import RequestMetrics, request_metrics
+
+# 没有匹配到路由的请求(如404)统一使用该标签
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+class MetricsMiddleware:
+    """
+    纯ASGI实现：记录每个请求的路由模板、状态码类别和耗时，以及处理中的请求数。
+    路由匹配后FastAPI会把route写入同一个scope，请求结束时读取其路径模板
+    """
+
+    def __init__(self, app: ASGIApp, metrics: RequestMetrics = request_metrics) -> None:
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500  # 没有发送响应就抛出异常时按500统计
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        metrics = self.metrics
+        metrics.in_progress += 1
+        start = perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            metrics.in_progress -= 1
+            route = scope.get("route")
+            metrics.observe(
+                scope["method"],
+                getattr(route, "path", UNMATCHED_ROUTE),
+                status_code,
+                perf_counter() - start,
+            )
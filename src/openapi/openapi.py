@@ -11,24 +11,146 @@ from src.config.openapi import setting
 router = APIRouter()
 
 if setting.OPEN_DOC:
+    import gzip
+    import hashlib
+    import mimetypes
+    import threading
     from pathlib import Path
+    from typing import Optional
 
+    import orjson
     from fastapi.openapi.docs import get_swagger_ui_html
-    from fastapi.staticfiles import StaticFiles
+    from fastapi.responses import Response
+    from starlette.concurrency import run_in_threadpool
+
+    from src.ext.exceptions import NotFound
+
+    try:
+        import brotli
+    except ImportError:  # 未安装时只提供gzip
+        brotli = None
 
     local_file = Path(__file__)
+    directory = local_file.parent / "swagger"
+
+    # 文件名带内容hash作为版本号，内容不变时浏览器直接使用缓存，无需再请求
+    IMMUTABLE = "public, max-age=31536000, immutable"
+    # 文档随部署变化，每次都需要通过ETag校验
+    REVALIDATE = "no-cache"
+
+    class CompressedAsset(object):
+        """预压缩的静态资源：原始内容与gzip/brotli压缩版本，每种编码有各自的强ETag"""
+
+        __slots__ = ("media_type", "cache_control", "version", "variants")
+
+        def __init__(self, body: bytes, media_type: str, cache_control: str):
+            self.media_type = media_type
+            self.cache_control = cache_control
+            self.version = hashlib.sha256(body).hexdigest()[:16]
+            # 编码 -> (内容, ETag)，优先级从高到低
+            self.variants: dict[str, tuple[bytes, str]] = {}
+            if brotli is not None:
+                self._add("br", brotli.compress(body, quality=11), body)
+            self._add("gzip", gzip.compress(body, compresslevel=9, mtime=0), body)
+            self.variants["identity"] = (body, f'"{self.version}"')
+
+        def _add(self, encoding: str, compressed: bytes, body: bytes) -> None:
+            if len(compressed) < len(body):
+                self.variants[encoding] = (compressed, f'"{self.version}-{encoding}"')
+
+        def response(self, request: Request) -> Response:
+            accept_encoding = request.headers.get("accept-encoding", "")
+            encoding = _negotiate(accept_encoding, self.variants)
+            body, etag = self.variants[encoding]
+            headers = {
+                "ETag": etag,
+                "Cache-Control": self.cache_control,
+                "Vary": "Accept-Encoding",
+            }
+            if encoding != "identity":
+                headers["Content-Encoding"] = encoding
+            if _not_modified(request.headers.get("if-none-match"), self.variants):
+                return Response(status_code=304, headers=headers)
+            return Response(body, media_type=self.media_type, headers=headers)
 
-    file = StaticFiles(directory=local_file.parent / "swagger")
+    def _negotiate(accept_encoding: str, variants: dict) -> str:
+        """按服务端优先级选择客户端接受(q不为0)的编码"""
+        accepted = set()
+        for item in accept_encoding.lower().split(","):
+            coding, _, params = item.strip().partition(";")
+            if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+                continue
+            accepted.add(coding.strip())
+        for encoding in variants:
+            if encoding in accepted or "*" in accepted:
+                return encoding
+        return "identity"
+
+    def _not_modified(if_none_match: Optional[str], variants: dict) -> bool:
+        """If-None-Match使用弱比较：同一内容的任一编码版本都视为匹配"""
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        etags = {etag for _, etag in variants.values()}
+        return any(
+            tag.strip().removeprefix("W/") in etags for tag in if_none_match.split(",")
+        )
+
+    _assets: dict[str, CompressedAsset] = {}
+    _assets_lock = threading.Lock()
+
+    def _load_asset(name: str) -> Optional[CompressedAsset]:
+        """首次访问时读取并压缩，结果在进程内缓存"""
+        with _assets_lock:
+            if name not in _assets:
+                path = directory / name
+                if path.parent != directory or not path.is_file():
+                    return None
+                media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+                _assets[name] = CompressedAsset(
+                    path.read_bytes(), media_type, IMMUTABLE
+                )
+            return _assets[name]
+
+    async def _get_asset(name: str) -> Optional[CompressedAsset]:
+        asset = _assets.get(name)
+        if asset is None:
+            # 压缩几MB的文件耗时较长，放到线程池中执行，避免阻塞事件循环
+            asset = await run_in_threadpool(_load_asset, name)
+        return asset
+
+    def _openapi_asset(request: Request) -> CompressedAsset:
+        """openapi文档在每个进程内只生成、序列化和压缩一次"""
+        with _assets_lock:
+            if "openapi.json" not in _assets:
+                body = orjson.dumps(request.app.openapi())
+                _assets["openapi.json"] = CompressedAsset(
+                    body, "application/json", REVALIDATE
+                )
+            return _assets["openapi.json"]
 
     @router.get("/static/{name:str}", include_in_schema=False)
     async def static(request: Request, name: str):
-        return await file.get_response(name, request.scope)
+        asset = await _get_asset(name)
+        if asset is None:
+            raise NotFound()
+        return asset.response(request)
+
+    @router.get("/openapi.json", include_in_schema=False)
+    async def openapi_json(request: Request):
+        asset = _assets.get("openapi.json")
+        if asset is None:
+            asset = await run_in_threadpool(_openapi_asset, request)
+        return asset.response(request)
 
     @router.get("/docs", include_in_schema=False)
     async def custom_swagger_ui_html():
+        js = await _get_asset("swagger-ui-bundle.js")
+        css = await _get_asset("swagger-ui.css")
         return get_swagger_ui_html(
             openapi_url="/openapi.json",
             title=setting.DOC_TITLE + " - Swagger UI",
-            swagger_js_url="/static/swagger-ui-bundle.js",
-            swagger_css_url="/static/swagger-ui.css",
+            swagger_js_url=f"/static/swagger-ui-bundle.js?v={js.version}",
+            swagger_css_url=f"/static/swagger-ui.css?v={css.version}",
         )
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+# @Author: martinf fangjie.martin@gmail.com
+# @Date: 2026-10-19 01:10:44
+# @LastEditors: martinf fangjie.martin@gmail.com
+# @LastEditTime: 2026-10-19 01:10:44
+# @Description: 多进程服务入口：python -m src.runner
+#   主进程只监听端口和管理worker，不导入应用；每个worker独立导入应用，
+#   在各自的lifespan中初始化redis连接池、缓存和定时任务
+
+import math
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import tempfile
+import time
+from multiprocessing.connection import wait
+from multiprocessing.process import BaseProcess
+from typing import Optional
+
+import uvicorn
+from loguru import logger
+
+from src.config import load_settings
+from src.config.server import setting
+from src.ext.logging import init_log
+
+# worker启动后在该时间内退出视为启动失败，连续失败时延迟重启，避免空转
+_CRASH_WINDOW = 5.0
+_CRASH_BACKOFF_MAX = 30.0
+
+
+def cpu_count() -> int:
+    """可用CPU数：取CPU亲和性和cgroup v2配额中较小的值"""
+    try:
+        count = len(os.sched_getaffinity(0))
+    except AttributeError:  # macOS等不支持亲和性的平台
+        count = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            count = min(count, max(math.ceil(int(quota) / int(period)), 1))
+    except (OSError, ValueError):
+        pass
+    return count
+
+
+def _resolve_loop(loop: str) -> str:
+    if loop != "auto":
+        return loop
+    try:
+        import uvloop  # noqa: F401
+    except ImportError:
+        return "asyncio"
+    return "uvloop"
+
+
+def _resolve_http(http: str) -> str:
+    if http != "auto":
+        return http
+    try:
+        import httptools  # noqa: F401
+    except ImportError:
+        return "h11"
+    return "httptools"
+
+
+def build_config(max_requests: Optional[int] = None) -> uvicorn.Config:
+    return uvicorn.Config(
+        setting.SERVER_APP,
+        host=setting.SERVER_HOST,
+        port=setting.SERVER_PORT,
+        loop=_resolve_loop(setting.SERVER_LOOP),
+        http=_resolve_http(setting.SERVER_HTTP),
+        backlog=setting.SERVER_BACKLOG,
+        timeout_keep_alive=setting.SERVER_KEEPALIVE,
+        timeout_graceful_shutdown=setting.SERVER_GRACEFUL_TIMEOUT,
+        limit_max_requests=max_requests,
+        access_log=setting.SERVER_ACCESS_LOG,
+        proxy_headers=setting.SERVER_PROXY_HEADERS,
+    )
+
+
+def _serve(config: uvicorn.Config, sockets: list[socket.socket]) -> None:
+    """worker进程入口：在主进程监听的socket上运行uvicorn"""
+    config.configure_logging()
+    uvicorn.Server(config).run(sockets=sockets)
+
+
+class Supervisor(object):
+    """
+    管理worker进程：
+
+    - 启动时按CPU数创建worker，所有worker共享主进程监听的socket
+    - worker处理SERVER_MAX_REQUESTS(加随机抖动)个请求后优雅退出，
+      主进程立即补上新的worker
+    - worker异常退出时重新启动，启动即崩溃时逐步延迟重启，
+      延迟期间主进程照常处理信号和其他worker
+    - 收到SIGTERM/SIGINT时通知所有worker优雅退出，超时后强制结束；
+      收到SIGHUP时逐个重启worker，重启由主循环逐步推进，
+      期间主进程照常处理信号和回收崩溃的worker
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.sockets: list[socket.socket] = []
+        # sentinel -> (进程, 启动时间)
+        self.processes: dict[int, tuple[BaseProcess, float]] = {}
+        self.crashes = 0
+        self.pending: list[float] = []  # 延迟重启的worker的启动时间(monotonic)
+        self.should_exit = False
+        self.should_reload = False
+        self.reload_queue: list[BaseProcess] = []  # 等待替换的旧worker
+        # sentinel -> (正在退出的旧worker, 强制结束时间)
+        self.retiring: dict[int, tuple[BaseProcess, float]] = {}
+        self._context = multiprocessing.get_context("spawn")
+
+    def _max_requests(self) -> Optional[int]:
+        if not setting.SERVER_MAX_REQUESTS:
+            return None
+        jitter = random.randint(0, setting.SERVER_MAX_REQUESTS_JITTER)
+        return setting.SERVER_MAX_REQUESTS + jitter
+
+    def spawn(self) -> None:
+        config = build_config(self._max_requests())
+        process = self._context.Process(
+            target=_serve,
+            kwargs={"config": config, "sockets": self.sockets},
+            daemon=False,
+        )
+        process.start()
+        self.processes[process.sentinel] = (process, time.monotonic())
+        logger.info(
+            f"Started worker {process.pid} (loop={config.loop}, http={config.http}, "
+            f"max_requests={config.limit_max_requests})"
+        )
+
+    def _handle_exit(self, _sig, _frame) -> None:
+        self.should_exit = True
+
+    def _handle_reload(self, _sig, _frame) -> None:
+        self.should_reload = True
+
+    def _reap(self, sentinels: list[int]) -> None:
+        for sentinel in sentinels:
+            if sentinel not in self.processes:
+                continue
+            process, started_at = self.processes.pop(sentinel)
+            process.join()
+            if self.should_exit:
+                continue
+            if time.monotonic() - started_at < _CRASH_WINDOW and process.exitcode != 0:
+                self.crashes += 1
+                delay = min(2 ** (self.crashes - 1), _CRASH_BACKOFF_MAX)
+                logger.error(
+                    f"Worker {process.pid} exited early with code {process.exitcode}, "
+                    f"restarting in {delay:.0f}s"
+                )
+                # 不在主循环中sleep，到时间后由主循环启动
+                self.pending.append(time.monotonic() + delay)
+            else:
+                self.crashes = 0
+                logger.info(
+                    f"Worker {process.pid} exited with code {process.exitcode}, "
+                    "restarting"
+                )
+                self.spawn()
+
+    def _spawn_pending(self) -> None:
+        """启动已经到时间的延迟重启"""
+        now = time.monotonic()
+        due = [at for at in self.pending if at <= now]
+        if not due:
+            return
+        self.pending = [at for at in self.pending if at > now]
+        for _ in due:
+            self.spawn()
+
+    def _wait_timeout(self) -> float:
+        deadlines = self.pending + [deadline for _, deadline in self.retiring.values()]
+        if not deadlines:
+            return 0.5
+        return min(max(min(deadlines) - time.monotonic(), 0), 0.5)
+
+    def _reload(self) -> None:
+        """开始逐个替换当前的worker，由主循环调用`_advance_reload`推进，不阻塞主循环"""
+        self.should_reload = False
+        self.reload_queue = [process for process, _ in self.processes.values()]
+        self._advance_reload()
+
+    def _advance_reload(self) -> None:
+        """上一个旧worker退出后替换下一个：先启动新worker，再让旧worker优雅退出"""
+        while not self.retiring and self.reload_queue:
+            process = self.reload_queue.pop(0)
+            # 等待期间已经退出的旧worker由`_reap`补上，不需要再替换
+            if self.processes.pop(process.sentinel, None) is None:
+                continue
+            self.spawn()
+            process.terminate()  # uvicorn收到SIGTERM后处理完当前请求再退出
+            deadline = time.monotonic() + setting.SERVER_GRACEFUL_TIMEOUT
+            self.retiring[process.sentinel] = (process, deadline)
+
+    def _retire(self, sentinels: list[int]) -> None:
+        """回收已经退出的旧worker，超时未退出的强制结束，然后继续替换下一个"""
+        for sentinel in sentinels:
+            if sentinel in self.retiring:
+                process, _ = self.retiring.pop(sentinel)
+                process.join()
+        now = time.monotonic()
+        for sentinel, (process, deadline) in list(self.retiring.items()):
+            if deadline <= now:
+                logger.warning(f"Worker {process.pid} did not exit in time, killing")
+                process.kill()
+                process.join()
+                del self.retiring[sentinel]
+        self._advance_reload()
+
+    def _shutdown(self) -> None:
+        self.reload_queue = []
+        processes = [process for process, _ in self.processes.values()]
+        processes += [process for process, _ in self.retiring.values()]
+        for process in processes:
+            process.terminate()
+        deadline = time.monotonic() + setting.SERVER_GRACEFUL_TIMEOUT + 5
+        for process in processes:
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                logger.warning(f"Worker {process.pid} did not exit in time, killing")
+                process.kill()
+                process.join()
+        self.processes.clear()
+        self.retiring.clear()
+
+    def run(self) -> None:
+        config = build_config()
+        self.sockets = [config.bind_socket()]
+        signal.signal(signal.SIGTERM, self._handle_exit)
+        signal.signal(signal.SIGINT, self._handle_exit)
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, self._handle_reload)
+
+        logger.info(
+            f"Master {os.getpid()} listening on "
+            f"{setting.SERVER_HOST}:{setting.SERVER_PORT} with {self.workers} workers"
+        )
+        for _ in range(self.workers):
+            self.spawn()
+        try:
+            while not self.should_exit:
+                sentinels = list(self.processes) + list(self.retiring)
+                ready = wait(sentinels, timeout=self._wait_timeout())
+                if self.should_exit:
+                    break
+                if ready:
+                    self._reap(ready)
+                self._retire(ready)
+                self._spawn_pending()
+                if self.should_reload:
+                    self._reload()
+        finally:
+            logger.info("Shutting down workers")
+            self._shutdown()
+            for sock in self.sockets:
+                sock.close()
+
+
+def _prepare_metrics_dir(workers: int) -> None:
+    """多个worker时，各worker的指标通过快照目录汇总；目录由主进程在启动worker前清空"""
+    if workers <= 1:
+        return
+    directory = os.environ.get("METRICS_MULTIPROC_DIR")
+    if not directory:
+        directory = tempfile.mkdtemp(prefix="metrics-")
+        os.environ["METRICS_MULTIPROC_DIR"] = directory  # spawn的worker会继承环境变量
+    from src.ext.metrics import clear_snapshots
+
+    clear_snapshots(directory)
+
+
+def main() -> None:
+    load_settings()  # 配置错误时在启动worker之前失败，避免worker反复启动即崩溃
+    init_log()
+    workers = setting.SERVER_WORKERS or cpu_count()
+    _prepare_metrics_dir(workers)
+    Supervisor(workers).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,8 +3,279 @@
 # @Date: 2023-09-08 14:58:16
 # @LastEditors: martinf fangjie.martin@gmail.com
 # @LastEditTime: 2023-09-08 14:58:51
-# @Description: 
+# @Description: 定时任务：asyncio调度器 + 内存/redis任务存储，
+#   每次执行通过分布式锁保证集群内只执行一次
 
-from apscheduler.schedulers.background import BackgroundScheduler
+import sys
+import time
+from datetime import datetime
 
-scheduler = BackgroundScheduler()
\ No newline at end of file
+from apscheduler.events import EVENT_JOB_ERROR
+from apscheduler.executors.asyncio import AsyncIOExecutor
+from apscheduler.executors.base import run_job
+from apscheduler.executors.base_py3 import run_coroutine_job
+from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.jobstores.redis import RedisJobStore
+from apscheduler.schedulers.asyncio import AsyncIOScheduler, run_in_event_loop
+from apscheduler.schedulers.base import STATE_STOPPED
+from apscheduler.util import iscoroutinefunction_partial, obj_to_ref, undefined
+from loguru import logger
+from pytz import utc
+from redis import ConnectionPool
+from redis.exceptions import RedisError
+
+from src.config.redis import setting as redis_setting
+from src.config.scheduler import setting
+from src.ext.distribute_lock import get_lock
+from src.ext.redis import is_cluster
+
+
+class JobStats(object):
+    """单个任务的执行统计"""
+
+    __slots__ = ("runs", "skipped", "failures", "overruns", "total", "max", "last")
+
+    def __init__(self):
+        self.runs = 0  # 本进程执行的次数
+        self.skipped = 0  # 由其他进程执行而跳过的次数
+        self.failures = 0
+        self.overruns = 0  # 执行结束时已经超过下一次计划执行时间的次数
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "runs": self.runs,
+            "skipped": self.skipped,
+            "failures": self.failures,
+            "overruns": self.overruns,
+            "avg_ms": self.total / self.runs * 1000 if self.runs else 0.0,
+            "max_ms": self.max * 1000,
+            "last_ms": self.last * 1000,
+        }
+
+
+_job_stats: dict[str, JobStats] = {}
+
+
+def job_stats() -> dict:
+    """本进程内所有任务的执行统计"""
+    return {job_id: stats.to_dict() for job_id, stats in _job_stats.items()}
+
+
+class ClusterAsyncIOExecutor(AsyncIOExecutor):
+    """
+    集群单例执行器：每次计划执行前以`任务ID + 计划执行时间`为key获取分布式锁，
+    只有拿到锁的进程执行任务。执行结束后不释放锁，由过期时间自动清理，
+    避免时钟稍慢的进程在锁释放后重复执行同一次计划
+    """
+
+    def _do_submit_job(self, job, run_times):
+        def callback(f):
+            self._pending_futures.discard(f)
+            try:
+                events = f.result()
+            except BaseException:
+                self._run_job_error(job.id, *sys.exc_info()[1:])
+            else:
+                self._run_job_success(job.id, events)
+
+        def submit():
+            f = self._eventloop.create_task(self._run_once(job, run_times))
+            f.add_done_callback(callback)
+            self._pending_futures.add(f)
+
+        # 调度器在线程池中处理任务存储，提交任务时切回事件循环
+        self._eventloop.call_soon_threadsafe(submit)
+
+    async def _run_once(self, job, run_times) -> list:
+        events = []
+        stats = _job_stats.setdefault(job.id, JobStats())
+        for run_time in run_times:
+            lock = get_lock(
+                f"{setting.SCHEDULER_PREFIX}:lock:{job.id}:{int(run_time.timestamp())}",
+                timeout=setting.SCHEDULER_LOCK_TIMEOUT,
+                blocking=False,
+            )
+            try:
+                acquired = await lock.acquire()
+            except RedisError:
+                logger.warning(f'Unable to acquire lock for job "{job}", skipped')
+                acquired = False
+            if not acquired:
+                stats.skipped += 1
+                continue
+
+            start = time.perf_counter()
+            try:
+                if iscoroutinefunction_partial(job.func):
+                    result = await run_coroutine_job(
+                        job, job._jobstore_alias, [run_time], self._logger.name
+                    )
+                else:
+                    result = await self._eventloop.run_in_executor(
+                        None,
+                        run_job,
+                        job,
+                        job._jobstore_alias,
+                        [run_time],
+                        self._logger.name,
+                    )
+            finally:
+                lock.stop_renewal()
+            used = time.perf_counter() - start
+
+            stats.runs += 1
+            stats.total += used
+            stats.last = used
+            stats.max = max(stats.max, used)
+            stats.failures += sum(1 for e in result if e.code == EVENT_JOB_ERROR)
+            if job.next_run_time and datetime.now(utc) > job.next_run_time:
+                stats.overruns += 1
+                logger.warning(
+                    f'Job "{job}" overran its next run time, used {used:.3f} s'
+                )
+            events.extend(result)
+        return events
+
+
+# 代码中注册的任务保存在进程内存中，运行时动态添加、需要持久化的任务保存在redis中
+PERSISTENT_JOBSTORE = "persistent"
+
+
+class _CodeJobStore(MemoryJobStore):
+    """代码中注册的任务：调度器停止时保留，重新启动后继续执行"""
+
+    def shutdown(self):
+        pass
+
+
+class ClusterAsyncIOScheduler(AsyncIOScheduler):
+    """
+    - 代码中注册的任务保存在各进程的内存任务存储中，每个进程启动时重新添加，
+      不会在共享存储中冲突或累积。
+      没有指定id时以函数路径作为id，同一个任务在所有进程中id相同，执行锁才能互斥；
+      同一个函数注册多次时需要分别指定id
+    - 任务存储的读写(redis任务存储使用同步客户端)在线程池中执行，不阻塞事件循环
+    """
+
+    _processing = False
+    _wakeup_pending = False
+
+    def add_job(
+        self,
+        func,
+        trigger=None,
+        args=None,
+        kwargs=None,
+        id=None,
+        name=None,
+        misfire_grace_time=undefined,
+        coalesce=undefined,
+        max_instances=undefined,
+        next_run_time=undefined,
+        jobstore="default",
+        executor="default",
+        replace_existing=False,
+        **trigger_args,
+    ):
+        if id is None:
+            try:
+                id = obj_to_ref(func)
+            except (TypeError, ValueError):
+                pass  # lambda、偏函数等没有稳定的路径，使用随机id
+        return super().add_job(
+            func,
+            trigger,
+            args,
+            kwargs,
+            id,
+            name,
+            misfire_grace_time,
+            coalesce,
+            max_instances,
+            next_run_time,
+            jobstore,
+            executor,
+            replace_existing,
+            **trigger_args,
+        )
+
+    def start(self, paused=False):
+        # 启动时才读取配置，在此之前注册的任务在启动时才填充默认值
+        self._job_defaults["misfire_grace_time"] = setting.SCHEDULER_MISFIRE_GRACE_TIME
+        super().start(paused)
+
+    @run_in_event_loop
+    def wakeup(self):
+        self._stop_timer()
+        if self._processing:
+            self._wakeup_pending = True
+            return
+        self._processing = True
+        future = self._eventloop.run_in_executor(None, self._process_jobs)
+        future.add_done_callback(self._processed)
+
+    def _processed(self, future) -> None:
+        self._processing = False
+        if future.cancelled() or self.state == STATE_STOPPED:
+            return
+        try:
+            wait_seconds = future.result()
+        except Exception:
+            logger.exception("Error processing scheduled jobs")
+            wait_seconds = self.jobstore_retry_interval
+        if self._wakeup_pending:
+            self._wakeup_pending = False
+            wait_seconds = 0
+        self._start_timer(wait_seconds)
+
+
+# 任务模块可以在导入时通过`@scheduler.scheduled_job`注册任务，
+# 任务在启动时写入内存任务存储。
+# 运行时通过`scheduler.add_job(..., jobstore=PERSISTENT_JOBSTORE)`添加持久化的任务
+# (重复添加时传入replace_existing=True)，
+# 在异步代码中调用时放到线程池中执行，避免redis读写阻塞事件循环
+scheduler = ClusterAsyncIOScheduler(
+    executors={"default": ClusterAsyncIOExecutor()},
+    jobstores={"default": _CodeJobStore()},
+    job_defaults={"coalesce": True, "max_instances": 1},
+)
+
+
+def _create_jobstore():
+    """
+    RedisJobStore使用MULTI事务同时写两个key，不支持集群。REDIS_URL为集群且没有设置
+    SCHEDULER_REDIS_URL时持久化任务也只保存在内存中
+    """
+    url = setting.SCHEDULER_REDIS_URL
+    if url is None:
+        if is_cluster():
+            logger.warning(
+                "Redis cluster is not supported by the job store, "
+                "jobs are kept in memory"
+            )
+            return MemoryJobStore()
+        url = redis_setting.REDIS_URL
+    return RedisJobStore(
+        jobs_key=f"{setting.SCHEDULER_PREFIX}:jobs",
+        run_times_key=f"{setting.SCHEDULER_PREFIX}:run_times",
+        connection_pool=ConnectionPool.from_url(str(url)),
+    )
+
+
+def init_scheduler() -> None:
+    """在lifespan启动时调用：创建持久化任务存储并启动调度器"""
+    if scheduler.running:
+        return
+    scheduler.add_jobstore(_create_jobstore(), alias=PERSISTENT_JOBSTORE)
+    scheduler.start()
+
+
+def close_scheduler() -> None:
+    """在lifespan关闭时调用：移除持久化任务存储(同时关闭其连接池)并停止调度器"""
+    if not scheduler.running:
+        return
+    scheduler.remove_jobstore(PERSISTENT_JOBSTORE, shutdown=True)
+    scheduler.shutdown()  # AsyncIOScheduler在事件循环的下一轮才真正停止
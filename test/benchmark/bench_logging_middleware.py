@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# @Author: martinf fangjie.martin@gmail.com
+# @Date: 2026-10-18 11:20:05
+# @LastEditors: martinf fangjie.martin@gmail.com
+# @LastEditTime: 2026-10-18 11:20:05
+# @Description: 日志中间件单请求开销对比：BaseHTTPMiddleware vs 纯ASGI
+#   运行：PYTHONPATH=. python test/benchmark/bench_logging_middleware.py
+
+import asyncio
+import time
+import uuid
+
+from loguru import logger
+from starlette.applications import Starlette
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+
+from src.ext.logging import TraceID
+from src.middlewares.logging import LoguruLoggerWithRequestIDMiddleware
+
+REQUESTS = 20000
+
+
+class BaseHTTPRequestIDMiddleware(BaseHTTPMiddleware):
+    """旧版基于BaseHTTPMiddleware的实现，作为对比基线"""
+
+    async def dispatch(self, request, call_next):
+        start = time.perf_counter()
+        request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+        TraceID.set_request_id(request_id)
+        request.state.request_id = request_id
+        response = await call_next(request)
+        response.headers["X-Request-ID"] = request_id
+        logger.debug(
+            f"{request.method} {request.url.path} {response.status_code} "
+            f"{(time.perf_counter() - start) * 1000:.2f}ms"
+        )
+        return response
+
+
+async def homepage(_request):
+    return PlainTextResponse("ok")
+
+
+def build_app(middleware=None) -> Starlette:
+    app = Starlette(routes=[Route("/", homepage)])
+    if middleware:
+        app.add_middleware(middleware)
+    return app
+
+
+async def run(app, requests: int) -> float:
+    """直接调用ASGI接口，返回每个请求的平均耗时(微秒)"""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/",
+        "raw_path": b"/",
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"bench"), (b"x-request-id", b"bench-request")],
+        "client": ("127.0.0.1", 10000),
+        "server": ("bench", 80),
+    }
+
+    async def call() -> None:
+        # 模拟服务器行为：请求体只返回一次，之后阻塞到响应结束再返回断开事件
+        done = asyncio.Event()
+        received = False
+
+        async def receive():
+            nonlocal received
+            if not received:
+                received = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            await done.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.body" and not message.get("more_body"):
+                done.set()
+
+        await app(dict(scope), receive, send)
+
+    for _ in range(requests // 10):  # 预热
+        await call()
+    start = time.perf_counter()
+    for _ in range(requests):
+        await call()
+    return (time.perf_counter() - start) / requests * 1_000_000
+
+
+async def main() -> None:
+    logger.remove()  # 只比较中间件本身的开销，不输出日志
+    results = {
+        "no middleware": await run(build_app(), REQUESTS),
+        "BaseHTTPMiddleware": await run(
+            build_app(BaseHTTPRequestIDMiddleware), REQUESTS
+        ),
+        "pure ASGI": await run(
+            build_app(LoguruLoggerWithRequestIDMiddleware), REQUESTS
+        ),
+    }
+    baseline = results["no middleware"]
+    for name, cost in results.items():
+        print(f"{name:<20} {cost:8.2f} us/req  overhead {cost - baseline:8.2f} us/req")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
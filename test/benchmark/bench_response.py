@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# @Author: martinf fangjie.martin@gmail.com
+# @Date: 2026-10-18 13:40:26
+# @LastEditors: martinf fangjie.martin@gmail.com
+# @LastEditTime: 2026-10-18 13:40:26
+# @Description: 响应序列化对比：JSONResponse + jsonable_encoder vs orjson信封
+#   运行：PYTHONPATH=. python test/benchmark/bench_response.py
+
+import datetime
+import timeit
+import uuid
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+from src.ext.response import APIResponse, EnvelopeResponse
+
+NUMBER = 2000
+
+
+class Item(BaseModel):
+    id: uuid.UUID
+    name: str
+    price: float
+    created_at: datetime.datetime
+
+
+class LegacyAPIResponse(JSONResponse):
+    """旧版实现：每次构造信封dict，经过jsonable_encoder和标准库json序列化，作为对比基线"""
+
+    def __init__(self, status_code: int, api_code: int, message: str, data=None):
+        super().__init__(
+            jsonable_encoder({"code": api_code, "message": message, "data": data}),
+            status_code=status_code,
+        )
+
+
+def payloads() -> dict:
+    now = datetime.datetime.now()
+    rows = [
+        {"id": uuid.uuid4(), "name": f"item-{i}", "price": i * 1.5, "created_at": now}
+        for i in range(100)
+    ]
+    return {
+        "small dict": {"id": 1, "name": "martin"},
+        "100 dict rows": rows,
+        "100 pydantic rows": [Item(**row) for row in rows],
+    }
+
+
+def main() -> None:
+    for name, data in payloads().items():
+        legacy = timeit.timeit(
+            lambda: LegacyAPIResponse(200, 0, "成功", data), number=NUMBER
+        )
+        current = timeit.timeit(lambda: APIResponse(data=data), number=NUMBER)
+        # default_response_class收到的是FastAPI已经jsonable_encoder处理过的数据
+        encoded = jsonable_encoder(data)
+        envelope = timeit.timeit(lambda: EnvelopeResponse(encoded), number=NUMBER)
+        print(
+            f"{name:<18} legacy {legacy / NUMBER * 1e6:9.2f} us"
+            f"  APIResponse {current / NUMBER * 1e6:9.2f} us"
+            f"  EnvelopeResponse {envelope / NUMBER * 1e6:9.2f} us"
+            f"  speedup x{legacy / current:.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -19,7 +19,9 @@ async def index(request:Request):
 
 @app.on_event("startup")
 async def startup():
-    pool = redis.ConnectionPool.from_url("redis://:vastai@10.23.4.247:31379/0", encoding="utf8")
+    pool = redis.ConnectionPool.from_url(
+        "redis://:vastai@10.23.4.247:31379/0", encoding="utf8"
+    )
     client = redis.Redis(connection_pool=pool)
     # redis = await redis.R.("redis://localhost", encoding="utf8")
     FastAPICache.init(RedisBackend(client), prefix="fastapi-cache")
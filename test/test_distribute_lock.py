@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+# @Author: martinf fangjie.martin@gmail.com
+# @Date: 2026-10-19 04:25:37
+# @LastEditors: martinf fangjie.martin@gmail.com
+# @LastEditTime: 2026-10-19 04:25:37
+# @Description: 分布式锁、信号量和读写锁测试：fakeredis代替redis，Lua脚本由lupa执行
+import asyncio
+import time
+
+import pytest
+from fakeredis import FakeServer
+from fakeredis.aioredis import FakeRedis
+from redis.exceptions import LockNotOwnedError
+
+from src.ext import redis as redis_ext
+from src.ext.distribute_lock import (
+    DistributeLock,
+    get_lock,
+    get_rw_lock,
+    get_semaphore,
+    lease_stats,
+)
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    client = FakeRedis(server=FakeServer())
+    monkeypatch.setattr(redis_ext, "_client", client)
+    return client
+
+
+def test_acquire_and_release(redis):
+    async def run():
+        first = get_lock("job:1", blocking=False)
+        second = get_lock("job:1", blocking=False)
+        assert await first.acquire()
+        assert await first.owned() and await second.locked()
+        assert not await second.acquire()
+        with pytest.raises(LockNotOwnedError):
+            await second.do_release(b"other")
+        await first.release()
+        assert not await second.locked()
+        assert await second.acquire()
+        await second.release()
+        assert await redis.keys("*") == []
+
+    asyncio.run(run())
+
+
+def test_expired_lock_can_be_taken_over(redis):
+    async def run():
+        first = get_lock("job:1", timeout=0.2, blocking=False)
+        assert await first.acquire()
+        first.stop_renewal()  # 模拟持有者卡住，不再续约
+        await asyncio.sleep(0.3)
+        second = get_lock("job:1", timeout=5, blocking=False)
+        assert await second.acquire()
+        with pytest.raises(LockNotOwnedError):
+            await first.release()
+        await second.release()
+
+    asyncio.run(run())
+
+
+def test_renewal_keeps_lock_and_detects_loss(redis):
+    async def run():
+        lock = get_lock("job:1", timeout=0.3, blocking=False)
+        assert await lock.acquire()
+        await asyncio.sleep(0.6)  # 超过过期时间，续约管理器每0.1秒续约一次
+        assert await lock.owned() and not lock.lost
+        assert lease_stats()["renewals"] > 0
+
+        await redis.set("job:1", "other")  # 锁被他人持有
+        await asyncio.sleep(0.3)
+        assert lock.lost
+        assert await redis.get("job:1") == b"other"
+
+    asyncio.run(run())
+
+
+def test_fencing_token_increases(redis):
+    async def run():
+        tokens = []
+        for _ in range(3):
+            lock = get_lock("job:1", fencing=True, blocking=False)
+            assert await lock.acquire()
+            tokens.append(lock.fencing_token)
+            await lock.release()
+        assert tokens == [1, 2, 3]
+        assert await redis.get("job:1:fence") == b"3"
+        # 计数器不过期
+        assert await redis.pttl("job:1:fence") == -1
+
+    asyncio.run(run())
+
+
+def test_notified_waiters_wake_in_order(redis):
+    async def run():
+        holder = get_lock("job:1")
+        assert await holder.acquire()
+        order = []
+
+        async def wait(name):
+            lock = get_lock("job:1", blocking_timeout=5)
+            assert await lock.acquire()
+            order.append((name, time.monotonic()))
+            await lock.release()
+
+        waiters = [asyncio.create_task(wait("a"))]
+        await asyncio.sleep(0.05)
+        waiters.append(asyncio.create_task(wait("b")))
+        await asyncio.sleep(0.05)
+        released_at = time.monotonic()
+        await holder.release()
+        await asyncio.gather(*waiters)
+
+        assert [name for name, _ in order] == ["a", "b"]
+        # 锁不过期时没有PTTL提示，轮询间隔为NOTIFY_FALLBACK(1秒)，按通知唤醒时远小于该值
+        assert order[-1][1] - released_at < holder.NOTIFY_FALLBACK / 2
+
+    asyncio.run(run())
+
+
+def test_other_client_polls_with_sleep(redis):
+    async def run():
+        # 非共享客户端收不到共享客户端上订阅的释放通知，
+        # 按sleep间隔轮询而不是等待NOTIFY_FALLBACK
+        other = FakeRedis(server=FakeServer())
+        holder = DistributeLock(other, "job:1")
+        assert await holder.acquire()
+        waiter = DistributeLock(other, "job:1", sleep=0.02, blocking_timeout=5)
+        task = asyncio.create_task(waiter.acquire())
+        await asyncio.sleep(0.05)
+        released_at = time.monotonic()
+        await holder.release()
+        assert await asyncio.wait_for(task, 5)
+        assert time.monotonic() - released_at < waiter.NOTIFY_FALLBACK / 2
+        await waiter.release()
+
+    asyncio.run(run())
+
+
+def test_semaphore_limit_and_expiry(redis):
+    async def run():
+        holders = [
+            get_semaphore("sem", 2, timeout=0.3, blocking=False) for _ in range(3)
+        ]
+        assert await holders[0].acquire() and await holders[1].acquire()
+        assert not await holders[2].acquire()
+        assert await holders[2].locked()
+
+        await holders[0].release()
+        assert not await holders[2].locked()
+        assert await holders[2].acquire()
+        assert await holders[2].locked()
+
+        # 停止续约的持有者按redis服务端时间过期，locked与获取脚本的判断一致
+        holders[1].stop_renewal()
+        await asyncio.sleep(0.4)
+        assert not await holders[2].locked()
+        assert await holders[0].acquire()
+        for holder in (holders[0], holders[2]):
+            await holder.release()
+        assert await redis.zcard("sem") == 0
+
+    asyncio.run(run())
+
+
+def test_semaphore_waiter_is_notified(redis):
+    async def run():
+        holder = get_semaphore("sem", 1)
+        assert await holder.acquire()
+        waiter = get_semaphore("sem", 1, blocking_timeout=5)
+        task = asyncio.create_task(waiter.acquire())
+        await asyncio.sleep(0.05)
+        assert not task.done()
+        await holder.release()
+        assert await asyncio.wait_for(task, 0.5)
+        await waiter.release()
+
+    asyncio.run(run())
+
+
+def test_read_write_lock_prefers_writer(redis):
+    async def run():
+        reader = get_rw_lock("article:1", timeout=5)
+        assert await reader.read.acquire(blocking=False)
+        # 读锁之间不互斥
+        other_reader = get_rw_lock("article:1", timeout=5)
+        assert await other_reader.read.acquire(blocking=False)
+        await other_reader.read.release()
+
+        writer = get_rw_lock("article:1", timeout=5)
+        write_task = asyncio.create_task(writer.write.acquire(blocking_timeout=5))
+        await asyncio.sleep(0.05)
+        assert not write_task.done()
+        # 写锁在等待，新的读锁获取失败
+        late_reader = get_rw_lock("article:1", timeout=5)
+        assert not await late_reader.read.acquire(blocking=False)
+
+        await reader.read.release()
+        assert await asyncio.wait_for(write_task, 0.5)
+        assert await late_reader.read.locked()
+        assert not await late_reader.read.acquire(blocking=False)
+
+        await writer.write.release()
+        assert await late_reader.read.acquire(blocking=False)
+        await late_reader.read.release()
+
+    asyncio.run(run())
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+# @Author: martinf fangjie.martin@gmail.com
+# @Date: 2026-10-19 03:20:11
+# @LastEditors: martinf fangjie.martin@gmail.com
+# @LastEditTime: 2026-10-19 03:20:11
+# @Description: 延迟直方图和profile装饰器测试
+import asyncio
+import math
+import random
+
+import pytest
+
+from src.config.monitor import get_settings
+from src.ext import decorator
+from src.ext.histogram import (
+    BUCKET_COUNT,
+    MAX_VALUE_BITS,
+    SUB_BUCKET_BITS,
+    SUB_BUCKET_COUNT,
+    LatencyHistogram,
+    bucket_index,
+    bucket_range,
+)
+
+
+def _values():
+    yield from range(0, 4 * SUB_BUCKET_COUNT)
+    for bits in range(SUB_BUCKET_BITS + 1, MAX_VALUE_BITS + 1):
+        yield (1 << bits) - 1
+        yield 1 << bits
+        yield (1 << bits) + 1
+    rng = random.Random(0)
+    yield from (rng.randrange(1 << MAX_VALUE_BITS) for _ in range(2000))
+
+
+def test_bucket_index_round_trip():
+    for value in _values():
+        index = bucket_index(value)
+        low, high = bucket_range(index)
+        if value < 1 << MAX_VALUE_BITS:
+            assert low <= value <= high, value
+        # 相对误差不超过1/SUB_BUCKET_COUNT
+        assert high - low <= max(low, 1) / SUB_BUCKET_COUNT
+
+
+def test_buckets_are_contiguous():
+    previous = -1
+    for index in range(BUCKET_COUNT):
+        low, high = bucket_range(index)
+        assert low == previous + 1, index
+        assert bucket_index(low) == index and bucket_index(high) == index
+        previous = high
+    assert previous == (1 << MAX_VALUE_BITS) - 1
+
+
+def test_out_of_range_values_are_clamped():
+    assert bucket_index(-5) == 0
+    assert bucket_index(1 << (MAX_VALUE_BITS + 3)) == BUCKET_COUNT - 1
+
+
+def test_exact_percentiles_below_sub_bucket_count():
+    histogram = LatencyHistogram()
+    for value in range(1, SUB_BUCKET_COUNT + 1):
+        histogram.record(value)
+    result = histogram.percentiles((0, 50, 90, 100))
+    assert result[0] == 1
+    assert result[50] == SUB_BUCKET_COUNT // 2
+    assert result[90] == math.ceil(SUB_BUCKET_COUNT * 0.9)
+    assert result[100] == SUB_BUCKET_COUNT
+
+
+def test_percentiles_match_sorted_values():
+    rng = random.Random(1)
+    values = [int(rng.lognormvariate(15, 1.5)) for _ in range(10000)]
+    histogram = LatencyHistogram()
+    for value in values:
+        histogram.record(value)
+    values.sort()
+    result = histogram.percentiles((50, 90, 99, 99.9, 100))
+    for p, estimate in result.items():
+        exact = values[max(1, math.ceil(len(values) * p / 100)) - 1]
+        # 返回所在桶的最大值：不小于真实值，且不超过一个桶宽
+        assert exact <= estimate <= exact + exact / SUB_BUCKET_COUNT, p
+    assert result[100] == histogram.max == values[-1]
+
+
+def test_empty_histogram_and_snapshot():
+    histogram = LatencyHistogram("empty")
+    assert histogram.percentiles() == {50: 0, 90: 0, 99: 0, 99.9: 0}
+    assert histogram.snapshot()["count"] == 0
+
+    for value in (1_000_000, 3_000_000):
+        histogram.record(value)
+    snapshot = histogram.snapshot()
+    assert snapshot["count"] == 2
+    assert snapshot["mean_ms"] == 2
+    assert snapshot["min_ms"] == 1 and snapshot["max_ms"] == 3
+    assert histogram.buckets() == [
+        (bucket_range(bucket_index(1_000_000))[1], 1),
+        (bucket_range(bucket_index(3_000_000))[1], 1),
+    ]
+    histogram.reset()
+    assert histogram.count == 0 and not histogram.buckets()
+
+
+@pytest.fixture
+def monitor_env(monkeypatch):
+    get_settings.cache_clear()
+    decorator.reset_profile_stats()
+    yield monkeypatch
+    get_settings.cache_clear()
+
+
+def test_profile_reads_settings_on_first_call(monitor_env):
+    @decorator.profile(name="test.sync")
+    def add(a, b):
+        return a + b
+
+    # 装饰时不创建配置
+    assert get_settings.cache_info().currsize == 0
+    monitor_env.setenv("PROFILE_ENABLED", "true")
+    assert add(1, 2) == 3
+    assert decorator.profile_stats()["test.sync"]["count"] == 1
+
+
+def test_profile_disabled(monitor_env):
+    monitor_env.setenv("PROFILE_ENABLED", "false")
+
+    @decorator.profile(name="test.disabled")
+    async def noop():
+        return "ok"
+
+    assert asyncio.run(noop()) == "ok"
+    assert "test.disabled" not in decorator.profile_stats()
+
+
+def test_profile_records_exceptions_and_slow_calls(monitor_env):
+    monitor_env.setenv("PROFILE_SLOW_MS", "0")
+    warnings = []
+    handler = decorator.logger.add(warnings.append, level="WARNING", format="{message}")
+
+    @decorator.profile(name="test.fail")
+    async def fail():
+        raise ValueError
+
+    try:
+        with pytest.raises(ValueError):
+            asyncio.run(fail())
+    finally:
+        decorator.logger.remove(handler)
+    assert decorator.profile_stats()["test.fail"]["count"] == 1
+    assert any("test.fail execute used time" in message for message in warnings)
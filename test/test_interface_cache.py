@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+# @Author: martinf fangjie.martin@gmail.com
+# @Date: 2026-10-19 04:06:18
+# @LastEditors: martinf fangjie.martin@gmail.com
+# @LastEditTime: 2026-10-19 04:06:18
+# @Description: 接口缓存测试：fakeredis代替redis
+import asyncio
+
+import httpx
+import pytest
+from fakeredis import FakeServer
+from fakeredis.aioredis import FakeRedis
+from fastapi import FastAPI
+from fastapi_cache import FastAPICache
+
+from src.ext import interface_cache
+from src.ext import redis as redis_ext
+from src.ext.interface_cache import (
+    cache,
+    close_cache,
+    init_cache,
+    organization_key_builder,
+)
+from src.middlewares.identity import IdentityMiddleware
+
+USER = {"user-id": "u1", "organization-id": "1"}
+
+
+@pytest.fixture
+def app(monkeypatch):
+    monkeypatch.setattr(redis_ext, "_client", FakeRedis(server=FakeServer()))
+    monkeypatch.setattr(interface_cache.local_cache, "_max_bytes", 0)
+    calls = []
+    application = FastAPI()
+
+    @application.get("/user")
+    @cache(expire=60)
+    async def per_user():
+        calls.append("user")
+        return {"calls": len(calls)}
+
+    @application.get("/org")
+    @cache(expire=60, key_builder=organization_key_builder)
+    async def per_org():
+        calls.append("org")
+        return {"calls": len(calls)}
+
+    application.add_middleware(IdentityMiddleware)
+    yield application
+    FastAPICache.reset()  # FastAPICache.init只在第一次调用时生效
+
+
+def _run(app: FastAPI, *requests: tuple[str, dict]) -> tuple[list[dict], list[str]]:
+    """在同一个事件循环中依次发送请求，返回响应内容和redis中的key"""
+
+    async def run():
+        await init_cache()
+        transport = httpx.ASGITransport(app=app)
+        try:
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://test"
+            ) as client:
+                results = [
+                    (await client.get(path, headers=headers)).json()
+                    for path, headers in requests
+                ]
+            keys = sorted(key.decode() for key in await redis_ext._client.keys("*"))
+            return results, keys
+        finally:
+            await close_cache()
+
+    return asyncio.run(run())
+
+
+def test_identified_requests_are_cached(app):
+    results, keys = _run(app, ("/user", USER), ("/user", USER))
+    assert results == [{"calls": 1}, {"calls": 1}]
+    assert "fastapi-cache::/user:1:u1?" in keys
+
+
+def test_anonymous_requests_are_not_cached(app):
+    results, keys = _run(
+        app,
+        ("/user", {}),
+        ("/user", {}),
+        # 没有组织ID时不使用组织级别的缓存，不同调用方不会共用默认组织"0"
+        ("/org", {"user-id": "u1"}),
+        ("/org", {"user-id": "u1"}),
+    )
+    assert results == [{"calls": 1}, {"calls": 2}, {"calls": 3}, {"calls": 4}]
+    assert keys == []
+
+
+def test_organization_cache_is_shared_by_users(app):
+    results, keys = _run(app, ("/org", USER), ("/org", {**USER, "user-id": "u2"}))
+    assert results == [{"calls": 1}, {"calls": 1}]
+    assert "fastapi-cache::/org:1:*?" in keys
+
+
+def test_local_cache_size_is_read_on_first_call(app, monkeypatch):
+    local = interface_cache.LocalCache()
+    monkeypatch.setattr(interface_cache, "local_cache", local)
+
+    @app.get("/local")
+    @cache(expire=60, local=True)
+    async def local_route():
+        return {"local": True}
+
+    # 装饰时不读取CACHE_LOCAL_MAX_BYTES
+    assert local._max_bytes is None
+    local._max_bytes = 1 << 20
+    local_hits = interface_cache._lookups["local_hit"]
+    results, _ = _run(app, ("/local", USER), ("/local", USER))
+    assert results == [{"local": True}, {"local": True}]
+    assert interface_cache._lookups["local_hit"] == local_hits + 1
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+# @Author: martinf fangjie.martin@gmail.com
+# @Date: 2026-10-19 03:52:40
+# @LastEditors: martinf fangjie.martin@gmail.com
+# @LastEditTime: 2026-10-19 03:52:40
+# @Description: 日志缓冲输出端测试
+import io
+
+import orjson
+import pytest
+from loguru import logger
+
+from src.ext.logging import BufferedSink
+
+
+@pytest.fixture
+def sink():
+    stream = io.BytesIO()
+    sink = BufferedSink(
+        buffer_size=100,
+        batch_size=10,
+        flush_interval=60,
+        sampling_threshold=1,
+        sampling_rates={},
+        stream=stream,
+    )
+    handler = logger.add(sink, format="{message}", filter=sink.filter, catch=False)
+    yield sink, stream
+    logger.remove(handler)
+
+
+def _lines(stream: io.BytesIO) -> list[dict]:
+    return [orjson.loads(line) for line in stream.getvalue().splitlines()]
+
+
+def test_drain_writes_records(sink):
+    sink, stream = sink
+    logger.bind(order_id=1).info("hello")
+    sink.drain()
+    (line,) = _lines(stream)
+    assert line["message"] == "hello"
+    assert line["extra"] == {"order_id": 1}
+    assert sink.stats()["written"] == 1
+
+
+def test_unserializable_record_is_dropped_alone(sink):
+    sink, stream = sink
+    logger.info("before")
+    logger.info("lone surrogate \ud800")  # orjson无法编码
+    logger.info("after")
+    sink.drain()
+    assert [line["message"] for line in _lines(stream)] == ["before", "after"]
+    assert sink.stats()["dropped"] == {"RENDER_ERROR": 1}
+    # 写线程仍在运行
+    assert sink._thread.is_alive()
+    logger.info("later")
+    sink.drain()
+    assert _lines(stream)[-1]["message"] == "later"
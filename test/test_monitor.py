@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# @Author: martinf fangjie.martin@gmail.com
+# @Date: 2026-10-19 09:40:12
+# @LastEditors: martinf fangjie.martin@gmail.com
+# @LastEditTime: 2026-10-19 09:40:12
+# @Description: 监控接口令牌校验测试：生产环境未配置MONITOR_TOKEN时拒绝访问
+import asyncio
+
+import pytest
+
+from src.apps.monitor.dependencies import verify_monitor_token
+from src.config import common, monitor
+from src.ext.exceptions import PermissionDenied
+
+
+@pytest.fixture
+def env(monkeypatch):
+    monkeypatch.delenv("MONITOR_TOKEN", raising=False)
+    common.get_settings.cache_clear()
+    monitor.get_settings.cache_clear()
+    yield monkeypatch
+    common.get_settings.cache_clear()
+    monitor.get_settings.cache_clear()
+
+
+def _verify(x_monitor_token=None, authorization=None) -> None:
+    asyncio.run(verify_monitor_token(x_monitor_token, authorization))
+
+
+def test_no_token_is_open_outside_prod(env):
+    env.setenv("ENV", "local")
+    _verify()
+
+
+def test_no_token_denies_in_prod(env):
+    env.setenv("ENV", "prod")
+    with pytest.raises(PermissionDenied):
+        _verify()
+
+
+def test_token_is_checked(env):
+    env.setenv("ENV", "prod")
+    env.setenv("MONITOR_TOKEN", "secret")
+    _verify("secret")
+    _verify(authorization="Bearer secret")
+    with pytest.raises(PermissionDenied):
+        _verify("wrong")
+    with pytest.raises(PermissionDenied):
+        _verify()
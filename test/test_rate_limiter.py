@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# @Author: martinf fangjie.martin@gmail.com
+# @Date: 2026-10-19 09:12:40
+# @LastEditors: martinf fangjie.martin@gmail.com
+# @LastEditTime: 2026-10-19 09:12:40
+# @Description: redis限流测试：窗口和补充速度按redis服务端时间计算，与本机时钟无关
+import asyncio
+
+import pytest
+from fakeredis import FakeServer
+from fakeredis.aioredis import FakeRedis
+from limits import parse
+
+from src.config.rate_limit import RateLimitStrategy
+from src.ext import redis as redis_ext
+from src.ext.rate_limiter import RateLimiter
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    client = FakeRedis(server=FakeServer())
+    monkeypatch.setattr(redis_ext, "_client", client)
+    return client
+
+
+@pytest.mark.parametrize("strategy", list(RateLimitStrategy))
+def test_hit_uses_server_time(redis, strategy):
+    async def run():
+        limiter = RateLimiter()
+        limit = parse("3/minute")
+        results = [
+            await limiter.hit(limit, "user", strategy=strategy) for _ in range(4)
+        ]
+        assert [r.allowed for r in results] == [True, True, True, False]
+        assert [r.remaining for r in results] == [2, 1, 0, 0]
+        # 重置时间 = redis服务端时间 + reset_after
+        seconds, microseconds = await redis.time()
+        server_now = seconds + microseconds / 1_000_000
+        for result in results:
+            assert 0 <= result.reset_after <= 60
+            assert abs(result.reset_at - server_now - result.reset_after) < 1
+
+    asyncio.run(run())
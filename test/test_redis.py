@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+# @Author: martinf fangjie.martin@gmail.com
+# @Date: 2026-10-19 05:02:14
+# @LastEditors: martinf fangjie.martin@gmail.com
+# @LastEditTime: 2026-10-19 05:02:14
+# @Description: redis连接池统计和集群key工具测试
+import asyncio
+
+from fakeredis import FakeServer
+from redis.crc import key_slot
+from redis.exceptions import ConnectionError
+
+try:
+    from fakeredis.aioredis import FakeAsyncRedisConnection
+except ImportError:  # 旧版本fakeredis
+    from fakeredis.aioredis import FakeConnection as FakeAsyncRedisConnection
+
+from src.ext import redis as redis_ext
+from src.ext.redis import MetricsConnectionPool, group_by_slot, hash_tag
+
+
+def test_pool_in_use_survives_connect_failures():
+    async def run():
+        server = FakeServer()
+        pool = MetricsConnectionPool(
+            connection_class=FakeAsyncRedisConnection,
+            server=server,
+            max_connections=5,
+            timeout=1,
+        )
+        held = await pool.get_connection("GET")
+        assert pool.stats()["in_use"] == 1
+
+        # 连接失败时父类在计入之前就release了连接，不能抵消其他已借出的连接
+        server.connected = False
+        for _ in range(3):
+            try:
+                await pool.get_connection("GET")
+            except ConnectionError:
+                pass
+        assert pool.stats()["in_use"] == 1
+
+        server.connected = True
+        await pool.release(held)
+        await pool.release(held)  # 重复归还不会变成负数
+        stats = pool.stats()
+        assert stats["in_use"] == 0 and stats["idle"] == stats["created"]
+        assert stats["wait_count"] == 1
+
+    asyncio.run(run())
+
+
+def test_hash_tag_only_in_cluster_mode(monkeypatch):
+    assert hash_tag("job:1") == "job:1"
+    assert group_by_slot(["a", "b"]) == [["a", "b"]]
+
+    monkeypatch.setattr(redis_ext, "is_cluster", lambda: True)
+    assert hash_tag("job:1") == "{job:1}"
+    assert hash_tag("{job}:1") == "{job}:1"
+    assert hash_tag("a{}b") == "{a{}b}"  # 空的hash tag不生效
+    groups = group_by_slot(["{job}:1", "{job}:2", "other"])
+    assert sorted(groups) == sorted([["{job}:1", "{job}:2"], ["other"]])
+    assert key_slot(b"{job}:1") == key_slot(b"job")
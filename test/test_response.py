@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# @Author: martinf fangjie.martin@gmail.com
+# @Date: 2026-10-19 05:30:41
+# @LastEditors: martinf fangjie.martin@gmail.com
+# @LastEditTime: 2026-10-19 05:30:41
+# @Description: 统一响应结构测试
+import datetime
+import uuid
+
+import orjson
+from pydantic import BaseModel
+
+from src.ext.response import APIResponse, EnvelopeResponse, dumps_envelope
+
+
+class Item(BaseModel):
+    id: int
+    tags: dict[int, str]
+
+
+def test_envelope_wraps_data():
+    body = orjson.loads(EnvelopeResponse({"hello": "world"}).body)
+    assert body == {"code": 0, "message": "成功", "data": {"hello": "world"}}
+    body = orjson.loads(APIResponse(api_code=1001, message="失败").body)
+    assert body == {"code": 1001, "message": "失败", "data": None}
+
+
+def test_non_string_keys_are_converted():
+    # 与标准库json一致，非字符串的key转为字符串
+    key = uuid.UUID(int=1)
+    data = {1: "a", key: "b", datetime.date(2026, 1, 2): "c"}
+    expected = {"1": "a", str(key): "b", "2026-01-02": "c"}
+    assert orjson.loads(EnvelopeResponse(data).body)["data"] == expected
+    assert orjson.loads(dumps_envelope(data, 1001, "失败"))["data"] == expected
+    # 嵌套在pydantic模型中
+    body = orjson.loads(dumps_envelope([Item(id=1, tags={2: "x"})]))
+    assert body["data"] == [{"id": 1, "tags": {"2": "x"}}]
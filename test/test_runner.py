@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+# @Author: martinf fangjie.martin@gmail.com
+# @Date: 2026-10-19 04:48:02
+# @LastEditors: martinf fangjie.martin@gmail.com
+# @LastEditTime: 2026-10-19 04:48:02
+# @Description: worker进程管理测试：用假进程代替真实的worker
+import itertools
+import time
+
+import pytest
+
+from src.runner import Supervisor
+
+_pids = itertools.count(1000)
+
+
+class FakeProcess(object):
+    """记录terminate/kill调用，`stubborn`为True时忽略SIGTERM"""
+
+    def __init__(self, exitcode: int = 0, stubborn: bool = False):
+        self.pid = self.sentinel = next(_pids)
+        self.exitcode = exitcode
+        self.stubborn = stubborn
+        self.alive = True
+        self.killed = False
+        self.join_timeouts = []
+
+    def terminate(self):
+        if not self.stubborn:
+            self.alive = False
+
+    def kill(self):
+        self.killed = True
+        self.alive = False
+
+    def join(self, timeout=None):
+        self.join_timeouts.append(timeout)
+
+    def is_alive(self):
+        return self.alive
+
+
+def _sentinels(processes: list[FakeProcess]) -> set[int]:
+    return {process.sentinel for process in processes}
+
+
+@pytest.fixture
+def supervisor(monkeypatch):
+    supervisor = Supervisor(workers=1)
+    supervisor.spawned = []
+
+    def spawn():
+        process = FakeProcess()
+        supervisor.processes[process.sentinel] = (process, time.monotonic())
+        supervisor.spawned.append(process)
+
+    monkeypatch.setattr(supervisor, "spawn", spawn)
+    return supervisor
+
+
+def test_crashed_worker_is_restarted_later_without_blocking(supervisor):
+    crashed = FakeProcess(exitcode=1)
+    supervisor.processes[crashed.sentinel] = (crashed, time.monotonic())
+
+    started = time.monotonic()
+    supervisor._reap([crashed.sentinel])
+    assert time.monotonic() - started < 0.1  # 不在主循环中sleep
+    assert supervisor.spawned == [] and len(supervisor.pending) == 1
+    assert 0 < supervisor._wait_timeout() <= 0.5
+
+    supervisor._spawn_pending()
+    assert supervisor.spawned == []
+    supervisor.pending = [time.monotonic() - 0.01]
+    supervisor._spawn_pending()
+    assert len(supervisor.spawned) == 1 and supervisor.pending == []
+
+
+def test_backoff_grows_with_consecutive_crashes(supervisor):
+    for _ in range(3):
+        crashed = FakeProcess(exitcode=1)
+        supervisor.processes[crashed.sentinel] = (crashed, time.monotonic())
+        supervisor._reap([crashed.sentinel])
+    delays = [at - time.monotonic() for at in supervisor.pending]
+    assert [round(delay) for delay in delays] == [1, 2, 4]
+
+
+def test_clean_exit_restarts_immediately(supervisor):
+    process = FakeProcess(exitcode=0)
+    supervisor.processes[process.sentinel] = (process, time.monotonic() - 60)
+    supervisor._reap([process.sentinel])
+    assert len(supervisor.spawned) == 1 and supervisor.pending == []
+
+
+def test_reload_replaces_workers_one_at_a_time(supervisor):
+    first, second = FakeProcess(), FakeProcess()
+    for process in (first, second):
+        supervisor.processes[process.sentinel] = (process, time.monotonic())
+
+    # 只替换第一个worker，不等待它退出
+    supervisor._reload()
+    assert len(supervisor.spawned) == 1 and not first.alive and second.alive
+    assert list(supervisor.retiring) == [first.sentinel]
+    assert first.sentinel not in supervisor.processes
+
+    # 主循环回收旧worker后才替换下一个
+    supervisor._retire([])
+    assert len(supervisor.spawned) == 1
+    supervisor._retire([first.sentinel])
+    assert len(supervisor.spawned) == 2 and not second.alive
+    supervisor._retire([second.sentinel])
+    assert supervisor.retiring == {} and supervisor.reload_queue == []
+    assert set(supervisor.processes) == _sentinels(supervisor.spawned)
+
+
+def test_reload_kills_workers_that_do_not_exit(supervisor):
+    stubborn, graceful = FakeProcess(stubborn=True), FakeProcess()
+    for process in (stubborn, graceful):
+        supervisor.processes[process.sentinel] = (process, time.monotonic())
+
+    supervisor._reload()
+    assert stubborn.alive and 0 < supervisor._wait_timeout() <= 0.5
+    supervisor._retire([])
+    assert not stubborn.killed and len(supervisor.spawned) == 1
+
+    supervisor.retiring[stubborn.sentinel] = (stubborn, time.monotonic() - 0.01)
+    supervisor._retire([])
+    assert stubborn.killed and stubborn.join_timeouts[-1] is None
+    assert not graceful.killed and not graceful.alive
+    supervisor._retire([graceful.sentinel])
+    assert set(supervisor.processes) == _sentinels(supervisor.spawned)
+    assert len(supervisor.spawned) == 2
+
+
+def test_worker_crashing_during_reload_is_not_replaced_twice(supervisor):
+    first, second = FakeProcess(), FakeProcess(exitcode=1)
+    for process in (first, second):
+        supervisor.processes[process.sentinel] = (process, time.monotonic() - 60)
+
+    supervisor._reload()
+    supervisor._reap([second.sentinel])  # 排队等待替换的worker崩溃，由_reap补上
+    assert len(supervisor.spawned) == 2
+    supervisor._retire([first.sentinel])
+    assert len(supervisor.spawned) == 2 and supervisor.reload_queue == []
+    assert set(supervisor.processes) == _sentinels(supervisor.spawned)